@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import zlib
+from typing import Dict, Iterator, List, Tuple, Union
+
+import config as cfg
+
+
+class AnnotationJournal:
+    """Append only log of saved annotations, replaces per image files in output folder
+
+    Every line is a record "<crc32 of payload> [image_name, status, bboxes]", where status is name of
+    directory the annotation belongs to in per image files layout. Last record of image wins.
+    Labeling processes sharing output folder append to journals of their own worker names, all journals
+    are replayed together.
+    """
+
+    def __init__(self, output_folder: str, worker_name: str = None):
+        self._output_folder: str = output_folder
+        journal_name, ext = os.path.splitext(cfg.JOURNAL_FILE_NAME)
+        self._journal_prefix: str = f"{journal_name}_"
+        self._journal_ext: str = ext
+        self._journal_path: str = os.path.join(
+            output_folder, f"{self._journal_prefix}{worker_name}{ext}" if worker_name else cfg.JOURNAL_FILE_NAME
+        )
+        self._snapshot_path: str = os.path.join(output_folder, cfg.JOURNAL_SNAPSHOT_FILE_NAME)
+        self._journal_file = None
+
+    def append(self, image_name: str, status: str, bboxes: List[List[int]]):
+        self.append_records([(image_name, status, bboxes)])
+
+    def append_records(self, records: List[Tuple[str, str, List[List[int]]]]):
+        """Appends (image_name, status, bboxes) records with one flush"""
+        if self._journal_file is None:
+            self._journal_file = open(self._journal_path, "a", encoding="utf-8")
+            # terminate record torn by crash, so it does not corrupt the next one
+            if self._journal_file.tell() > 0 and not self._ends_with_newline(self._journal_path):
+                self._journal_file.write("\n")
+        self._journal_file.write("".join(self._make_record(*record) for record in records))
+        self._journal_file.flush()
+
+    def close(self):
+        if self._journal_file is not None:
+            self._journal_file.close()
+            self._journal_file = None
+
+    def replay(self) -> Dict[str, Tuple[str, List[List[int]]]]:
+        """Returns image name -> (status, bboxes) folded from snapshot and journal"""
+        return self._replay({path: None for path in [self._snapshot_path] + self._get_journal_paths()})
+
+    def compact(self):
+        """Folds journal into snapshot and truncates journal
+
+        Only complete records present when compaction started are folded and removed from journals, records
+        appended after that are moved to the start of journal. Record appended while they are moved is lost,
+        so workers sharing output folder are to be stopped first.
+        """
+        self.close()
+        replayed_sizes = {path: self._get_complete_size(path) for path in self._get_journal_paths()}
+        state = self._replay({self._snapshot_path: None, **replayed_sizes})
+
+        tmp_snapshot_path = f"{self._snapshot_path}.tmp"
+        with open(tmp_snapshot_path, "w", encoding="utf-8") as snapshot_file:
+            for image_name, (status, bboxes) in sorted(state.items()):
+                snapshot_file.write(self._make_record(image_name, status, bboxes))
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(tmp_snapshot_path, self._snapshot_path)
+
+        # replaying journal over the new snapshot gives the same state, so crash before truncation is safe
+        for journal_path, replayed_size in replayed_sizes.items():
+            if not replayed_size:
+                continue
+            with open(journal_path, "r+b") as journal_file:
+                journal_file.seek(replayed_size)
+                tail = journal_file.read()
+                journal_file.seek(0)
+                journal_file.write(tail)
+                journal_file.truncate()
+        print(f"journal compacted, {len(state)} annotations in snapshot")
+
+    def export_to_folders(self):
+        """Writes annotations in per image files layout: <status>/<image name>.txt"""
+        state = self.replay()
+        for image_name, (status, bboxes) in state.items():
+            dir_path = os.path.join(self._output_folder, status)
+            os.makedirs(dir_path, exist_ok=True)
+            base_img_name, ext = os.path.splitext(image_name)
+            with open(os.path.join(dir_path, f"{base_img_name}.txt"), "w") as output_file:
+                json.dump(bboxes, output_file)
+        print(f"{len(state)} annotations exported to {self._output_folder}")
+
+    def _get_journal_paths(self) -> List[str]:
+        """Returns paths of journal of single process and journals of all workers"""
+        journal_paths = [os.path.join(self._output_folder, cfg.JOURNAL_FILE_NAME)]
+        if os.path.isdir(self._output_folder):
+            journal_paths.extend(sorted(
+                entry.path for entry in os.scandir(self._output_folder)
+                if entry.name.startswith(self._journal_prefix) and entry.name.endswith(self._journal_ext)
+            ))
+        return journal_paths
+
+    @staticmethod
+    def _ends_with_newline(path: str) -> bool:
+        with open(path, "rb") as journal_file:
+            journal_file.seek(-1, os.SEEK_END)
+            return journal_file.read(1) == b"\n"
+
+    @staticmethod
+    def _make_record(image_name: str, status: str, bboxes: List[List[int]]) -> str:
+        payload = json.dumps([image_name, status, bboxes], separators=(",", ":"))
+        return f"{zlib.crc32(payload.encode('utf-8')):08x} {payload}\n"
+
+    @staticmethod
+    def _parse_record(line: str) -> Union[Tuple[str, str, List[List[int]]], None]:
+        checksum, _, payload = line.rstrip("\r\n").partition(" ")
+        if not payload or checksum != f"{zlib.crc32(payload.encode('utf-8')):08x}":
+            return None
+        image_name, status, bboxes = json.loads(payload)
+        return image_name, status, bboxes
+
+    def _replay(self, read_sizes: Dict[str, Union[int, None]]) -> Dict[str, Tuple[str, List[List[int]]]]:
+        state = dict()
+        for path, size in read_sizes.items():
+            for image_name, status, bboxes in self._read_records(path, size):
+                state[image_name] = (status, bboxes)
+        return state
+
+    @staticmethod
+    def _get_complete_size(path: str) -> int:
+        """Returns size of complete records of journal, record being appended at the moment is not included"""
+        if not os.path.isfile(path):
+            return 0
+        with open(path, "rb") as journal_file:
+            return journal_file.read().rfind(b"\n") + 1
+
+    def _read_records(self, path: str, size: int = None) -> Iterator[Tuple[str, str, List[List[int]]]]:
+        """Yields records of journal, of its first size bytes if size is given"""
+        if not os.path.isfile(path):
+            return
+        with open(path, "rb") as journal_file:
+            lines = journal_file if size is None else io.BytesIO(journal_file.read(size))
+            for line_number, line in enumerate(lines, 1):
+                record = self._parse_record(line.decode("utf-8", errors="replace"))
+                if record is None:
+                    print(f"{path}:{line_number} corrupted record skipped")
+                    continue
+                yield record
@@ -0,0 +1,291 @@
+import mmap
+import os
+import tempfile
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+
+import config as cfg
+from data_structures import BBox
+
+
+def _to_number(value: float) -> Union[int, float]:
+    return int(value) if value.is_integer() else value
+
+
+def release_mapped_pages(array: np.ndarray):
+    """Drops pages of memory mapped array from RSS, they are read from file again on the next access"""
+    base = array.base
+    while isinstance(base, np.ndarray):
+        base = base.base
+    if isinstance(base, mmap.mmap) and hasattr(mmap, "MADV_DONTNEED"):
+        base.madvise(mmap.MADV_DONTNEED)
+
+
+class ColumnarBBoxStore:
+    """Keeps bboxes of all images in flat numpy columns sorted by image index"""
+
+    COORDINATE_COLUMNS = ("x1", "y1", "x2", "y2")
+    COLUMNS = COORDINATE_COLUMNS + ("category_id", "image_index")
+    DTYPES = {
+        "x1": np.float64,
+        "y1": np.float64,
+        "x2": np.float64,
+        "y2": np.float64,
+        "category_id": np.int32,
+        "image_index": np.int32,
+    }
+
+    def __init__(self, columns: Dict[str, np.ndarray], ranges: np.ndarray):
+        self._columns: Dict[str, np.ndarray] = columns
+        # bboxes of image i are in range ranges[i]:ranges[i + 1]
+        self._ranges: np.ndarray = ranges
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, np.ndarray], images_amount: int) -> "ColumnarBBoxStore":
+        order = np.argsort(columns["image_index"], kind="stable")
+        sorted_columns = {name: np.asarray(columns[name], dtype=cls.DTYPES[name])[order] for name in cls.COLUMNS}
+
+        ranges = np.zeros(images_amount + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sorted_columns["image_index"], minlength=images_amount), out=ranges[1:])
+        return cls(sorted_columns, ranges)
+
+    @classmethod
+    def load(cls, store_dir: str, mmap: bool = True) -> "ColumnarBBoxStore":
+        mmap_mode = "r" if mmap else None
+        columns = {
+            name: np.load(os.path.join(store_dir, f"{name}.npy"), mmap_mode=mmap_mode) for name in cls.COLUMNS
+        }
+        ranges = np.load(os.path.join(store_dir, "ranges.npy"), mmap_mode=mmap_mode)
+        return cls(columns, ranges)
+
+    def save(self, store_dir: str):
+        os.makedirs(store_dir, exist_ok=True)
+        arrays = dict(self._columns, ranges=self._ranges)
+        for name, array in arrays.items():
+            # replace files instead of overwriting them, they may be memory mapped by running process
+            path = os.path.join(store_dir, f"{name}.npy")
+            with open(f"{path}.tmp", "wb") as array_file:
+                np.save(array_file, array)
+            os.replace(f"{path}.tmp", path)
+
+    @property
+    def images_amount(self):
+        return len(self._ranges) - 1
+
+    @property
+    def bboxes_amount(self):
+        return int(self._ranges[-1])
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns.values()) + self._ranges.nbytes
+
+    def column(self, name: str) -> np.ndarray:
+        return self._columns[name]
+
+    def release_pages(self):
+        for array in list(self._columns.values()) + [self._ranges]:
+            release_mapped_pages(array)
+
+    def get_bboxes(self, image_index: int) -> List[BBox]:
+        """Creates BBox objects for bboxes of one image"""
+        start, end = self._ranges[image_index], self._ranges[image_index + 1]
+        coordinates = zip(*(self._columns[name][start:end].tolist() for name in self.COORDINATE_COLUMNS))
+        category_ids = self._columns["category_id"][start:end].tolist()
+
+        # bboxes of unknown categories are kept in columns for validation and export, but are not shown
+        return [
+            BBox(_to_number(x1), _to_number(y1), _to_number(x2), _to_number(y2), cfg.CATEGORY_ID_TO_LABEL[category_id])
+            for (x1, y1, x2, y2), category_id in zip(coordinates, category_ids)
+            if category_id in cfg.CATEGORY_ID_TO_LABEL
+        ]
+
+
+class ImageNameTable:
+    """Sorted image names in one fixed width bytes array, id of name is found by binary search
+
+    Table saved to disk is memory mapped, so names take RAM only for pages which were read.
+    """
+
+    FILE_NAME = "image_names.npy"
+
+    def __init__(self, names: np.ndarray):
+        self._names: np.ndarray = names
+
+    @classmethod
+    def from_names(cls, sorted_names: List[str]) -> "ImageNameTable":
+        # utf-8 keeps order of code points, so names sorted as str stay sorted as bytes
+        return cls(np.array([name.encode() for name in sorted_names], dtype=bytes))
+
+    @classmethod
+    def load(cls, store_dir: str) -> "ImageNameTable":
+        # plain array view of mapping, indexing of memmap subclass is much slower
+        return cls(np.asarray(np.load(os.path.join(store_dir, cls.FILE_NAME), mmap_mode="r")))
+
+    def save(self, store_dir: str):
+        os.makedirs(store_dir, exist_ok=True)
+        path = os.path.join(store_dir, self.FILE_NAME)
+        with open(f"{path}.tmp", "wb") as names_file:
+            np.save(names_file, self._names)
+        os.replace(f"{path}.tmp", path)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, image_id: int) -> str:
+        return self._names[image_id].decode()
+
+    def __iter__(self) -> Iterator[str]:
+        return (name.decode() for name in self._names)
+
+    def __contains__(self, name: str):
+        return self.get(name) is not None
+
+    def get(self, name: str) -> Union[int, None]:
+        """Returns id of image name, None if there is no such image"""
+        encoded = name.encode()
+        image_id = int(self._names.searchsorted(encoded))
+        if image_id < len(self._names) and self._names[image_id] == encoded:
+            return image_id
+        return None
+
+    def find_by_stem(self, stem: str) -> Union[str, None]:
+        """Returns name of image with name stem and any extension"""
+        prefix = f"{stem}.".encode()
+        # names with the same prefix are neighbours, 0xff byte never occurs in utf-8
+        start = self._names.searchsorted(prefix)
+        end = self._names.searchsorted(prefix + b"\xff")
+        found = None
+        for name in self._names[start:end].tolist():
+            name = name.decode()
+            if os.path.splitext(name)[0] == stem:
+                found = name
+        return found
+
+    def release_pages(self):
+        release_mapped_pages(self._names)
+
+
+class PagedBBoxes(MutableMapping):
+    """Image id -> bboxes, only images in window around current image are kept as BBox objects
+
+    Assigned bboxes are written to temporary spill file as rows of (x1, y1, x2, y2, category id), image keeps
+    offset, amount and capacity of its rows, so image outside of window takes 16 bytes of RAM. Rows overwrite
+    the slot of image when they fit in it and are appended otherwise. Images are read back from spill file when
+    they are requested.
+    """
+
+    ROW_SIZE = 5
+
+    def __init__(self, spill_dir: str, images_amount: int, window_size: int):
+        os.makedirs(spill_dir, exist_ok=True)
+        # several labeling processes may spill to the same directory, temporary file is private and removed on close
+        self._spill_file = tempfile.TemporaryFile(dir=spill_dir, prefix="edited_bboxes_")
+        self._spilled_rows: int = 0
+        # row of the first bbox of image in spill file, -1 for image without bboxes in this mapping
+        self._offsets: np.ndarray = np.full(images_amount, -1, dtype=np.int64)
+        self._counts: np.ndarray = np.zeros(images_amount, dtype=np.int32)
+        # rows reserved for image in spill file, rewritten image reuses them while its bboxes fit
+        self._capacities: np.ndarray = np.zeros(images_amount, dtype=np.int32)
+        self._amount: int = 0
+        self._window_size: int = window_size
+        self._center: int = 0
+        # materialized bboxes of images in window
+        self._window: Dict[int, List[BBox]] = dict()
+
+    def __len__(self):
+        return self._amount
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(np.flatnonzero(self._offsets >= 0).tolist())
+
+    def __contains__(self, image_id: int):
+        return 0 <= image_id < len(self._offsets) and self._offsets[image_id] >= 0
+
+    def __getitem__(self, image_id: int) -> List[BBox]:
+        bboxes = self._window.get(image_id)
+        if bboxes is not None:
+            return bboxes
+        if image_id not in self:
+            raise KeyError(image_id)
+        bboxes = self._read(image_id)
+        if self._is_in_window(image_id):
+            self._window[image_id] = bboxes
+        return bboxes
+
+    def __setitem__(self, image_id: int, bboxes: List[BBox]):
+        rows = np.array([
+            [bbox.x1, bbox.y1, bbox.x2, bbox.y2, cfg.LABEL_CATEGORY_ID[bbox.label]] for bbox in bboxes
+        ], dtype=np.float64).reshape(-1, self.ROW_SIZE)
+        if self._offsets[image_id] < 0:
+            self._amount += 1
+        if self._offsets[image_id] < 0 or len(rows) > self._capacities[image_id]:
+            self._offsets[image_id] = self._spilled_rows
+            self._capacities[image_id] = len(rows)
+            self._spilled_rows += len(rows)
+        self._spill_file.seek(int(self._offsets[image_id]) * self.ROW_SIZE * 8)
+        self._spill_file.write(rows.tobytes())
+        self._counts[image_id] = len(rows)
+        if self._is_in_window(image_id):
+            self._window[image_id] = bboxes
+        else:
+            self._window.pop(image_id, None)
+
+    def __delitem__(self, image_id: int):
+        if image_id not in self:
+            raise KeyError(image_id)
+        self._offsets[image_id] = -1
+        self._counts[image_id] = 0
+        self._capacities[image_id] = 0
+        self._amount -= 1
+        self._window.pop(image_id, None)
+
+    def items(self) -> Iterator[Tuple[int, List[BBox]]]:
+        """Iterates over all images mapping spill file once instead of reading every image separately"""
+        if not self._spilled_rows:
+            yield from ((image_id, list()) for image_id in self)
+            return
+        self._spill_file.flush()
+        rows = np.asarray(np.memmap(self._spill_file, dtype=np.float64, mode="r",
+                                    shape=(self._spilled_rows, self.ROW_SIZE)))
+        for image_id in self:
+            bboxes = self._window.get(image_id)
+            if bboxes is None:
+                offset = int(self._offsets[image_id])
+                bboxes = self._to_bboxes(rows[offset:offset + int(self._counts[image_id])])
+            yield image_id, bboxes
+
+    @property
+    def materialized_amount(self) -> int:
+        return len(self._window)
+
+    def move_window(self, center: int):
+        """Drops BBox objects of images which are out of window around new center"""
+        self._center = center
+        for image_id in [image_id for image_id in self._window if not self._is_in_window(image_id)]:
+            del self._window[image_id]
+
+    def clear_window(self):
+        self._window.clear()
+
+    def close(self):
+        self._spill_file.close()
+
+    def _is_in_window(self, image_id: int) -> bool:
+        return abs(image_id - self._center) <= self._window_size
+
+    def _read(self, image_id: int) -> List[BBox]:
+        self._spill_file.seek(int(self._offsets[image_id]) * self.ROW_SIZE * 8)
+        count = int(self._counts[image_id])
+        rows = np.frombuffer(self._spill_file.read(count * self.ROW_SIZE * 8), dtype=np.float64)
+        return self._to_bboxes(rows.reshape(count, self.ROW_SIZE))
+
+    @staticmethod
+    def _to_bboxes(rows: np.ndarray) -> List[BBox]:
+        return [
+            BBox(_to_number(x1), _to_number(y1), _to_number(x2), _to_number(y2),
+                 cfg.CATEGORY_ID_TO_LABEL[int(category_id)])
+            for x1, y1, x2, y2, category_id in rows.tolist()
+        ]
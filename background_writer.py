@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple, Union
+
+import config as cfg
+from tracing import NullTracer, Tracer
+
+
+def atomic_write_json(path: str, value: Any):
+    """Writes json to temporary file and renames it, so readers never see partially written file"""
+    tmp_path = f"{path}{cfg.TMP_FILE_SUFFIX}"
+    with open(tmp_path, "w") as json_file:
+        json.dump(value, json_file)
+    os.replace(tmp_path, path)
+
+
+class BackgroundWriter:
+    """Runs writes in background thread, so the event loop never waits on disk
+
+    Writes are keyed by their target. A write submitted while a write with the same key is still waiting
+    replaces it, so only the latest bookmark or annotation of an image is written. Submitting blocks only
+    when more than max_pending distinct targets wait for disk.
+    """
+
+    def __init__(self, max_pending: int = cfg.WRITER_MAX_PENDING, tracer: Union[Tracer, NullTracer] = None):
+        self._max_pending: int = max_pending
+        self._tracer: Union[Tracer, NullTracer] = tracer if tracer is not None else NullTracer()
+        # key -> (submit time, write function), in submission order
+        self._pending: "OrderedDict[Hashable, Tuple[float, Callable[[], Any]]]" = OrderedDict()
+        self._busy: bool = False
+        self._closed: bool = False
+        self._condition = threading.Condition()
+
+        self._written: int = 0
+        self._coalesced: int = 0
+        self._errors: int = 0
+        self._total_latency: float = 0.0
+        self._max_latency: float = 0.0
+        self._sequence_number: int = 0
+
+        self._thread = threading.Thread(target=self._run, name="background-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, key: Hashable, write: Callable[[], Any]):
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            while len(self._pending) >= self._max_pending and key not in self._pending:
+                self._condition.wait()
+            if key in self._pending:
+                self._coalesced += 1
+            self._pending[key] = (time.perf_counter(), write)
+            self._condition.notify_all()
+
+    def submit_ordered(self, write: Callable[[], Any]):
+        """Submits write which is never coalesced, ordered writes run in submission order"""
+        with self._condition:
+            self._sequence_number += 1
+            key = ("ordered", self._sequence_number)
+        self.submit(key, write)
+
+    def write_json(self, path: str, value: Any):
+        self.submit(path, lambda: atomic_write_json(path, value))
+
+    def flush(self):
+        """Waits until all submitted writes are done"""
+        with self._condition:
+            while self._pending or self._busy:
+                self._condition.wait()
+
+    def close(self):
+        self.flush()
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def stats(self) -> Dict[str, float]:
+        with self._condition:
+            return {
+                "queue_depth": len(self._pending),
+                "written": self._written,
+                "coalesced": self._coalesced,
+                "errors": self._errors,
+                "mean_latency_ms": round(1000 * self._total_latency / max(self._written, 1), 2),
+                "max_latency_ms": round(1000 * self._max_latency, 2),
+            }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                _, (submit_time, write) = self._pending.popitem(last=False)
+                self._busy = True
+                self._condition.notify_all()
+
+            try:
+                with self._tracer.span("write"):
+                    write()
+            except Exception as e:
+                print(f"background write failed: {e}")
+                with self._condition:
+                    self._errors += 1
+            latency = time.perf_counter() - submit_time
+
+            with self._condition:
+                self._busy = False
+                self._written += 1
+                self._total_latency += latency
+                self._max_latency = max(self._max_latency, latency)
+                self._condition.notify_all()
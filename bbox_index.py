@@ -0,0 +1,52 @@
+from typing import List
+
+import numpy as np
+
+from data_structures import BBox, Point
+
+
+class BBoxIndex:
+    """Coordinates of canvas bboxes in numpy array for vectorized hit-testing
+
+    Rows are kept in the same order as bboxes, so found ids can be used as bbox ids.
+    """
+
+    def __init__(self, bboxes: List[BBox] = ()):
+        # rows x1, y1, x2, y2, columns are bboxes
+        self._coords: np.ndarray = np.empty((4, 0), dtype=np.float64)
+        self._size: int = 0
+        self.set_bboxes(bboxes)
+
+    def __len__(self):
+        return self._size
+
+    def set_bboxes(self, bboxes: List[BBox]):
+        self._coords = np.array([(bbox.x1, bbox.y1, bbox.x2, bbox.y2) for bbox in bboxes],
+                                dtype=np.float64).reshape(-1, 4).T.copy()
+        self._size = self._coords.shape[1]
+
+    def append(self, bbox: BBox):
+        if self._size == self._coords.shape[1]:
+            grown = np.empty((4, max(2 * self._size, 16)), dtype=np.float64)
+            grown[:, :self._size] = self._coords[:, :self._size]
+            self._coords = grown
+        self._coords[:, self._size] = (bbox.x1, bbox.y1, bbox.x2, bbox.y2)
+        self._size += 1
+
+    def insert(self, bbox_id: int, bbox: BBox):
+        self.append(bbox)
+        self._coords[:, bbox_id + 1:self._size] = self._coords[:, bbox_id:self._size - 1].copy()
+        self._coords[:, bbox_id] = (bbox.x1, bbox.y1, bbox.x2, bbox.y2)
+
+    def delete(self, bbox_id: int):
+        self._coords[:, bbox_id:self._size - 1] = self._coords[:, bbox_id + 1:self._size]
+        self._size -= 1
+
+    def get_ids_containing(self, point: Point) -> List[int]:
+        """Ids of bboxes containing point in ascending order, same as BBox.__contains__ for every bbox"""
+        x1, y1, x2, y2 = self._coords[:, :self._size]
+        mask = x1 <= point.x
+        mask &= x2 >= point.x
+        mask &= y1 <= point.y
+        mask &= y2 >= point.y
+        return np.flatnonzero(mask).tolist()
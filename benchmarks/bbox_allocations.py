@@ -0,0 +1,56 @@
+"""Measures memory allocated per navigation by bbox copies, deepcopy of the previous version vs shared bboxes"""
+import argparse
+import os
+import sys
+import tracemalloc
+from copy import deepcopy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config as cfg
+from data_structures import BBox
+
+
+def navigate_with_deepcopy(bboxes):
+    # set_bboxes and bboxes property of the previous canvas, called on every navigation and save
+    canvas_bboxes = deepcopy(bboxes)
+    return deepcopy(canvas_bboxes)
+
+
+def navigate_shared(bboxes):
+    # canvas keeps reference to storage list and copies it only when a bbox is changed
+    canvas_bboxes = bboxes
+    return canvas_bboxes
+
+
+def measure(navigate, bboxes, navigations):
+    kept = list()
+    tracemalloc.start()
+    start_size, _ = tracemalloc.get_traced_memory()
+    for _ in range(navigations):
+        kept.append(navigate(bboxes))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (size - start_size) / navigations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bboxes", type=int, default=100, help='amount of bboxes on frame')
+    parser.add_argument("--navigations", type=int, default=200)
+    args = parser.parse_args()
+
+    bboxes = [BBox(i, i, i + 50, i + 100, cfg.DEFAULT_CLASS_LABEL) for i in range(args.bboxes)]
+    tracemalloc.start()
+    start_size, _ = tracemalloc.get_traced_memory()
+    more_bboxes = [BBox(i, i, i + 50, i + 100, cfg.DEFAULT_CLASS_LABEL) for i in range(1000)]
+    bbox_size = (tracemalloc.get_traced_memory()[0] - start_size) / len(more_bboxes)
+    tracemalloc.stop()
+
+    print(f"{args.bboxes} bboxes per frame, {bbox_size:.0f} bytes per bbox")
+    print(f"deepcopy: {measure(navigate_with_deepcopy, bboxes, args.navigations):.0f} bytes per navigation")
+    print(f"shared:   {measure(navigate_shared, bboxes, args.navigations):.0f} bytes per navigation")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Compares BBoxIndex hit-testing with linear scan over BBox objects"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config as cfg
+from bbox_index import BBoxIndex
+from data_structures import BBox, Point
+
+
+def linear_scan(bboxes, point):
+    return [i for i, bbox in enumerate(bboxes) if point in bbox]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bboxes", type=int, default=300, help='amount of bboxes on frame')
+    parser.add_argument("--clicks", type=int, default=2000, help='amount of hit-tests')
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    x1 = rng.integers(0, args.width - 200, args.bboxes)
+    y1 = rng.integers(0, args.height - 400, args.bboxes)
+    w = rng.integers(20, 200, args.bboxes)
+    h = rng.integers(40, 400, args.bboxes)
+    bboxes = [BBox(int(x), int(y), int(x + bw), int(y + bh), cfg.DEFAULT_CLASS_LABEL) for x, y, bw, bh in zip(x1, y1, w, h)]
+    points = [Point(int(x), int(y)) for x, y in zip(rng.integers(0, args.width, args.clicks),
+                                                     rng.integers(0, args.height, args.clicks))]
+    bbox_index = BBoxIndex(bboxes)
+
+    for point in points:
+        assert bbox_index.get_ids_containing(point) == linear_scan(bboxes, point)
+
+    start_time = time.perf_counter()
+    for point in points:
+        linear_scan(bboxes, point)
+    linear_time = (time.perf_counter() - start_time) / args.clicks
+
+    start_time = time.perf_counter()
+    for point in points:
+        bbox_index.get_ids_containing(point)
+    index_time = (time.perf_counter() - start_time) / args.clicks
+
+    print(f"{args.bboxes} bboxes, {args.clicks} clicks")
+    print(f"linear scan: {linear_time * 1e6:.1f} us per click")
+    print(f"bbox index:  {index_time * 1e6:.1f} us per click ({linear_time / index_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
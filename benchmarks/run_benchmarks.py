@@ -0,0 +1,203 @@
+"""Runs benchmarks of coco load, labeled merge, navigation, render, hit-test and save on synthetic dataset
+
+Results are printed as json, so they can be compared across versions.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config as cfg
+from bbox_index import BBoxIndex
+from data_structures import Point
+from main import LabelingTool
+from synthetic_dataset import generate_dataset
+from utils import AnnotationStorage, Canvas, read_annotation_files
+from window import HeadlessWindow
+
+
+def summarize(seconds: List[float]) -> Dict[str, float]:
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "count": len(milliseconds),
+        "mean_ms": round(float(np.mean(milliseconds)), 3),
+        "p50_ms": round(float(np.percentile(milliseconds, 50)), 3),
+        "p95_ms": round(float(np.percentile(milliseconds, 95)), 3),
+        "max_ms": round(float(np.max(milliseconds)), 3),
+    }
+
+
+def measure(function: Callable[[], Any], repeats: int) -> List[float]:
+    seconds = list()
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start_time)
+    return seconds
+
+
+def get_version() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(__file__),
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def reset_labeling_state(annotation_path: str, output_folder: str):
+    """Removes bookmark and annotations saved by previous run, so the next run starts from the first frame"""
+    variables_path = os.path.join(os.path.dirname(annotation_path), cfg.VARIABLES_FILE_NAME)
+    if os.path.exists(variables_path):
+        os.remove(variables_path)
+    shutil.rmtree(output_folder, ignore_errors=True)
+
+
+def run_labeling_tool(annotation_path: str, output_folder: str, images_dir: str, keys: List[int]) -> HeadlessWindow:
+    reset_labeling_state(annotation_path, output_folder)
+    window = HeadlessWindow(("key", key) for key in keys)
+    try:
+        LabelingTool(annotation_path, output_folder, images_dir, window=window)
+    except SystemExit:
+        pass
+    return window
+
+
+def key_latencies(window: HeadlessWindow, key: int) -> List[float]:
+    return [seconds for pressed_key, seconds in window.key_latencies if pressed_key == key]
+
+
+def benchmark_coco_load(annotation_path: str, images_dir: str) -> Dict[str, Any]:
+    cache_dir = os.path.join(os.path.dirname(annotation_path), cfg.CACHE_DIRECTORY_NAME)
+    output_folder = os.path.join(os.path.dirname(annotation_path), "output")
+    shutil.rmtree(cache_dir, ignore_errors=True)
+
+    start_time = time.perf_counter()
+    AnnotationStorage(annotation_path, output_folder, images_dir)
+    cold_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    AnnotationStorage(annotation_path, output_folder, images_dir)
+    snapshot_time = time.perf_counter() - start_time
+    return {"cold_s": round(cold_time, 3), "snapshot_s": round(snapshot_time, 3)}
+
+
+def benchmark_labeled_merge(annotation_path: str, workers: int) -> Dict[str, Any]:
+    labeled_dir = os.path.join(os.path.dirname(annotation_path), "output", cfg.DIRECTORY_FOR_LABELED_NAME)
+    start_time = time.perf_counter()
+    files_amount = len(read_annotation_files(labeled_dir, workers=workers))
+    elapsed = time.perf_counter() - start_time
+    return {"files": files_amount, "seconds": round(elapsed, 3), "files_per_s": round(files_amount / elapsed)}
+
+
+def benchmark_navigation(annotation_path: str, images_dir: str, steps: int) -> Dict[str, Any]:
+    output_folder = os.path.join(os.path.dirname(annotation_path), "benchmark_output")
+    keys = [cfg.HotKey.OpenNext] * steps + [cfg.HotKey.OpenPrevious] * steps
+    window = run_labeling_tool(annotation_path, output_folder, images_dir, keys)
+    reset_labeling_state(annotation_path, output_folder)
+    return {
+        "next": summarize(key_latencies(window, cfg.HotKey.OpenNext)),
+        "previous": summarize(key_latencies(window, cfg.HotKey.OpenPrevious)),
+    }
+
+
+def benchmark_save(annotation_path: str, images_dir: str, steps: int) -> Dict[str, Any]:
+    output_folder = os.path.join(os.path.dirname(annotation_path), "benchmark_output")
+    keys = [cfg.HotKey.SaveAndOpenNext] * steps
+    start_time = time.perf_counter()
+    window = run_labeling_tool(annotation_path, output_folder, images_dir, keys)
+    # includes startup and waiting for background writes on quit
+    total_time = time.perf_counter() - start_time
+    saved_files = len(os.listdir(os.path.join(output_folder, cfg.DIRECTORY_FOR_LABELED_NAME)))
+    reset_labeling_state(annotation_path, output_folder)
+    return {
+        "save_and_next": summarize(key_latencies(window, cfg.HotKey.SaveAndOpenNext)),
+        "saved_files": saved_files,
+        "total_s": round(total_time, 3),
+    }
+
+
+def benchmark_render(annotation_path: str, images_dir: str, repeats: int) -> Dict[str, Any]:
+    storage = AnnotationStorage(annotation_path, os.path.join(os.path.dirname(annotation_path), "output"), images_dir)
+    canvas = Canvas(window=HeadlessWindow())
+    canvas.set_image(cv2.imread(os.path.join(images_dir, storage.get_image_name_by_id(0))))
+    bboxes = storage.get_bboxes_by_image_id(0)
+    canvas.set_bboxes(bboxes)
+    return {
+        "bboxes": len(bboxes),
+        "refresh": summarize(measure(canvas.refresh, repeats)),
+        "refresh_region": summarize(measure(lambda: canvas.refresh_region(bboxes[:1]), repeats)),
+    }
+
+
+def benchmark_hit_test(annotation_path: str, images_dir: str, clicks: int, width: int, height: int) -> Dict[str, Any]:
+    storage = AnnotationStorage(annotation_path, os.path.join(os.path.dirname(annotation_path), "output"), images_dir)
+    bbox_index = BBoxIndex(storage.get_bboxes_by_image_id(0))
+    rng = np.random.default_rng(0)
+    points = [Point(x, y) for x, y in zip(rng.integers(0, width, clicks).tolist(),
+                                          rng.integers(0, height, clicks).tolist())]
+    points_iterator = iter(points)
+    return {"click": summarize(measure(lambda: bbox_index.get_ids_containing(next(points_iterator)), clicks))}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dataset_dir", help='directory for synthetic dataset, temporary directory by default')
+    parser.add_argument("--images", type=int, default=100000, help='amount of images in coco file')
+    parser.add_argument("--bboxes", type=int, default=10, help='amount of bboxes per image')
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--labeled", type=int, default=10000, help='amount of images with labeled annotation')
+    parser.add_argument("--steps", type=int, default=200, help='amount of navigations and saves')
+    parser.add_argument("--repeats", type=int, default=200, help='amount of renders and clicks')
+    parser.add_argument("--merge_workers", type=int, default=cfg.MERGE_WORKERS)
+    parser.add_argument("--output", help='json file to write results to, stdout by default')
+    args = parser.parse_args()
+
+    dataset_dir = args.dataset_dir or tempfile.mkdtemp(prefix="label_utility_benchmark_")
+    images_dir = os.path.join(dataset_dir, "images")
+    results = dict()
+    # labeling tool prints every action, results are printed only when all benchmarks are done
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start_time = time.perf_counter()
+        annotation_path = generate_dataset(dataset_dir, args.images, args.bboxes, args.width, args.height,
+                                           image_files=2 * args.steps + 1, labeled=args.labeled)
+        results["generate_dataset_s"] = round(time.perf_counter() - start_time, 3)
+        results["coco_load"] = benchmark_coco_load(annotation_path, images_dir)
+        results["labeled_merge"] = benchmark_labeled_merge(annotation_path, args.merge_workers)
+        results["navigation"] = benchmark_navigation(annotation_path, images_dir, args.steps)
+        results["render"] = benchmark_render(annotation_path, images_dir, args.repeats)
+        results["hit_test"] = benchmark_hit_test(annotation_path, images_dir, args.repeats, args.width, args.height)
+        results["save"] = benchmark_save(annotation_path, images_dir, args.steps)
+    if args.dataset_dir is None:
+        shutil.rmtree(dataset_dir, ignore_errors=True)
+
+    report = {
+        "version": get_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "parameters": {name: value for name, value in vars(args).items() if name not in ("dataset_dir", "output")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
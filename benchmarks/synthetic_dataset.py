@@ -0,0 +1,90 @@
+"""Generates synthetic COCO dataset with images and labeled annotations for benchmarks"""
+import argparse
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config as cfg
+
+
+def generate_dataset(dataset_dir: str, images: int, bboxes_per_image: int, width: int = 1920, height: int = 1080,
+                     image_files: int = 1000, labeled: int = 0, seed: int = 0) -> str:
+    """Writes coco.json, images folder and output folder with labeled annotations, returns path to coco.json
+
+    Only first image_files images are written to disk, the same encoded frame is used for all of them.
+    First labeled images get annotation file in labeled folder.
+    """
+    rng = np.random.default_rng(seed)
+    images_dir = os.path.join(dataset_dir, "images")
+    labeled_dir = os.path.join(dataset_dir, "output", cfg.DIRECTORY_FOR_LABELED_NAME)
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(labeled_dir, exist_ok=True)
+
+    image_names = [f"frame_{image_id:08d}.jpg" for image_id in range(images)]
+    bboxes_amount = images * bboxes_per_image
+    box_widths = rng.integers(8, max(9, width // 8), bboxes_amount)
+    box_heights = rng.integers(8, max(9, height // 4), bboxes_amount)
+    x1 = rng.integers(0, width - box_widths + 1)
+    y1 = rng.integers(0, height - box_heights + 1)
+    category_ids = rng.choice(sorted(cfg.CATEGORY_ID_TO_LABEL), bboxes_amount)
+
+    annotation_path = os.path.join(dataset_dir, "coco.json")
+    with open(annotation_path, "w") as coco_file:
+        coco_file.write('{"images": [\n')
+        coco_file.write(",\n".join(
+            f'{{"id":{image_id},"file_name":"{image_name}","width":{width},"height":{height}}}'
+            for image_id, image_name in enumerate(image_names)
+        ))
+        coco_file.write('\n],\n"annotations": [\n')
+        coco_file.write(",\n".join(
+            f'{{"id":{i},"image_id":{i // bboxes_per_image},"category_id":{category_id},'
+            f'"bbox":[{x},{y},{w},{h}],"area":{w * h},"iscrowd":0}}'
+            for i, (x, y, w, h, category_id) in enumerate(zip(x1.tolist(), y1.tolist(), box_widths.tolist(),
+                                                               box_heights.tolist(), category_ids.tolist()))
+        ))
+        coco_file.write("\n],\n\"categories\": " + json.dumps([
+            {"id": category_id, "name": label} for category_id, label in sorted(cfg.CATEGORY_ID_TO_LABEL.items())
+        ]) + "}\n")
+
+    frame = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
+    encoded_frame = cv2.imencode(".jpg", frame)[1].tobytes()
+    for image_name in image_names[:image_files]:
+        with open(os.path.join(images_dir, image_name), "wb") as image_file:
+            image_file.write(encoded_frame)
+
+    for image_id, image_name in enumerate(image_names[:labeled]):
+        start = image_id * bboxes_per_image
+        bboxes = [
+            [x, y, x + w, y + h, category_id]
+            for x, y, w, h, category_id in zip(*(column[start:start + bboxes_per_image].tolist()
+                                                 for column in (x1, y1, box_widths, box_heights, category_ids)))
+        ]
+        with open(os.path.join(labeled_dir, f"{os.path.splitext(image_name)[0]}.txt"), "w") as ann_file:
+            json.dump(bboxes, ann_file)
+    return annotation_path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dataset_dir")
+    parser.add_argument("--images", type=int, default=10000, help='amount of images in coco file')
+    parser.add_argument("--bboxes", type=int, default=10, help='amount of bboxes per image')
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--image_files", type=int, default=1000, help='amount of images written to disk')
+    parser.add_argument("--labeled", type=int, default=0, help='amount of images with labeled annotation')
+    args = parser.parse_args()
+
+    annotation_path = generate_dataset(args.dataset_dir, args.images, args.bboxes, args.width, args.height,
+                                       args.image_files, args.labeled)
+    print(f"dataset generated: {annotation_path}")
+
+
+if __name__ == "__main__":
+    main()
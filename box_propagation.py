@@ -0,0 +1,157 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple, Union
+
+import cv2
+import numpy as np
+
+import config as cfg
+from data_structures import BBox
+
+
+def _track_step(previous_frame: np.ndarray, frame: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """Moves and scales boxes by median motion of grid points inside them, boxes without motion stay in place"""
+    grid = np.linspace(0.2, 0.8, cfg.PROPAGATION_GRID_SIZE, dtype=np.float32)
+    grid_x, grid_y = (coordinates.ravel() for coordinates in np.meshgrid(grid, grid))
+    x1, y1, x2, y2 = (boxes[:, i:i + 1] for i in range(4))
+    # (boxes, points, 2)
+    points = np.stack([x1 + grid_x * (x2 - x1), y1 + grid_y * (y2 - y1)], axis=-1).astype(np.float32)
+
+    lk_params = dict(winSize=(cfg.PROPAGATION_WINDOW_SIZE, cfg.PROPAGATION_WINDOW_SIZE),
+                     maxLevel=cfg.PROPAGATION_PYRAMID_LEVELS)
+    flat_points = points.reshape(-1, 1, 2)
+    next_points, status, _ = cv2.calcOpticalFlowPyrLK(previous_frame, frame, flat_points, None, **lk_params)
+    back_points, back_status, _ = cv2.calcOpticalFlowPyrLK(frame, previous_frame, next_points, None, **lk_params)
+    # points which are not tracked back to where they started are unreliable
+    back_error = np.linalg.norm(back_points - flat_points, axis=-1).ravel()
+    is_good = (status.ravel() == 1) & (back_status.ravel() == 1) & (back_error < cfg.PROPAGATION_MAX_BACK_ERROR)
+    is_good = is_good.reshape(points.shape[:2])
+    next_points = next_points.reshape(points.shape)
+
+    propagated = boxes.copy()
+    is_tracked = is_good.sum(axis=1) >= cfg.PROPAGATION_MIN_POINTS
+    if not np.any(is_tracked):
+        return propagated
+    points, next_points, is_good = points[is_tracked], next_points[is_tracked], is_good[is_tracked]
+    shift = np.nanmedian(np.where(is_good[..., None], next_points - points, np.nan), axis=1)
+
+    # scale is median ratio of distances of points to their center
+    distances = np.linalg.norm(points - np.median(points, axis=1, keepdims=True), axis=-1)
+    next_distances = np.linalg.norm(next_points - np.median(next_points, axis=1, keepdims=True), axis=-1)
+    ratios = np.where(is_good & (distances > 0), next_distances / np.maximum(distances, 1e-6), np.nan)
+    with np.errstate(all="ignore"):
+        scale = np.nan_to_num(np.nanmedian(ratios, axis=1), nan=1.0)
+    scale = np.clip(scale, 1 / cfg.PROPAGATION_MAX_SCALE_CHANGE, cfg.PROPAGATION_MAX_SCALE_CHANGE)
+
+    tracked = boxes[is_tracked]
+    center = (tracked[:, :2] + tracked[:, 2:]) / 2 + shift
+    half_size = (tracked[:, 2:] - tracked[:, :2]) / 2 * scale[:, None]
+    propagated[is_tracked] = np.concatenate([center - half_size, center + half_size], axis=1)
+    return propagated
+
+
+def track_bboxes(previous_frame: np.ndarray, frames: List[np.ndarray], boxes: np.ndarray) -> List[np.ndarray]:
+    """Carries boxes (x1, y1, x2, y2 rows) of previous frame through grayscale frames, runs in worker process"""
+    results = list()
+    for frame in frames:
+        if len(boxes):
+            boxes = _track_step(previous_frame, frame, boxes)
+        results.append(boxes)
+        previous_frame = frame
+    return results
+
+
+class BoxPropagator:
+    """Carries saved bboxes to the next frames with optical flow while user works on the current frame
+
+    Frames are read in background thread, tracking runs in worker process. Only the latest submitted
+    bboxes are propagated, older requests which did not start yet are dropped.
+    """
+
+    def __init__(self, read_frame: Callable[[int], np.ndarray], images_amount: int,
+                 display_scale: int = cfg.DEFAULT_DISPLAY_SCALE, frames_ahead: int = cfg.PROPAGATION_FRAMES_AHEAD,
+                 get_next_image_id: Callable[[int, bool], Union[int, None]] = None):
+        self._read_frame: Callable[[int], np.ndarray] = read_frame
+        self._images_amount: int = images_amount
+        # id of image navigation goes to next, the neighbouring one by default
+        self._get_next_image_id: Callable[[int, bool], Union[int, None]] = (
+            get_next_image_id if get_next_image_id is not None else self._get_neighbour_image_id
+        )
+        self._display_scale: int = display_scale
+        self._frames_ahead: int = frames_ahead
+        # spawned worker does not inherit locks held by threads of this process
+        self._process_executor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
+        self._thread_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="propagation")
+        # image id -> (id of image bboxes are propagated from, bboxes), only images ahead of the latest saved one
+        self._propagated: Dict[int, Tuple[int, List[BBox]]] = dict()
+        self._lock = threading.Lock()
+        self._last_request: int = 0
+        # start worker process now, so the first propagation does not wait for it
+        self._process_executor.submit(int)
+
+    def submit(self, image_id: int, bboxes: List[BBox]):
+        with self._lock:
+            self._last_request += 1
+            request = self._last_request
+        self._thread_executor.submit(self._propagate, request, image_id, list(bboxes))
+
+    def get(self, image_id: int) -> Union[Tuple[int, List[BBox]], None]:
+        """Returns (id of source image, bboxes) propagated to image, None if nothing is propagated yet"""
+        with self._lock:
+            return self._propagated.get(image_id)
+
+    def release_memory(self):
+        """Drops propagated bboxes, they are propagated again when the next image is saved"""
+        with self._lock:
+            self._propagated.clear()
+
+    def shutdown(self):
+        self._thread_executor.shutdown(wait=False, cancel_futures=True)
+        self._process_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_neighbour_image_id(self, image_id: int, direction: bool) -> Union[int, None]:
+        next_image_id = image_id + 1 if direction else image_id - 1
+        return next_image_id if 0 <= next_image_id < self._images_amount else None
+
+    def _propagate(self, request: int, image_id: int, bboxes: List[BBox]):
+        try:
+            target_ids = list()
+            target_id = image_id
+            for _ in range(self._frames_ahead):
+                target_id = self._get_next_image_id(target_id, True)
+                if target_id is None:
+                    break
+                target_ids.append(target_id)
+            frames = list()
+            for frame_id in [image_id] + target_ids:
+                if request != self._last_request:
+                    return
+                frame = self._read_frame(frame_id)
+                if frame is None:
+                    break
+                frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+            if len(frames) < 2:
+                return
+
+            boxes = np.array([[bbox.x1, bbox.y1, bbox.x2, bbox.y2] for bbox in bboxes],
+                             dtype=np.float32).reshape(-1, 4) / self._display_scale
+            results = self._process_executor.submit(track_bboxes, frames[0], frames[1:], boxes).result()
+        except Exception as e:
+            print(f"bboxes propagation failed: {e}")
+            return
+
+        height, width = (size * self._display_scale for size in frames[0].shape[:2])
+        with self._lock:
+            # bboxes propagated to images behind saved one or beyond its window are never offered
+            last_id = target_ids[len(results) - 1]
+            self._propagated = {
+                frame_id: value for frame_id, value in self._propagated.items() if image_id < frame_id <= last_id
+            }
+            for frame_id, frame_boxes in zip(target_ids, results):
+                frame_boxes = np.rint(frame_boxes * self._display_scale).astype(np.int64)
+                np.clip(frame_boxes[:, 0::2], 0, width, out=frame_boxes[:, 0::2])
+                np.clip(frame_boxes[:, 1::2], 0, height, out=frame_boxes[:, 1::2])
+                self._propagated[frame_id] = (image_id, [
+                    BBox(x1, y1, x2, y2, bbox.label) for (x1, y1, x2, y2), bbox in zip(frame_boxes.tolist(), bboxes)
+                ])
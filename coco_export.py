@@ -0,0 +1,165 @@
+import json
+import os
+from typing import Dict, Iterator, List, TextIO, Tuple, Union
+
+import numpy as np
+
+import config as cfg
+from coco_reader import CocoStreamReader
+from utils import AnnotationStorage
+
+
+ANNOTATION_TEMPLATE = (
+    '{{"id":{},"image_id":{},"category_id":{},"bbox":[{},{},{},{}],"area":{},"iscrowd":0}}'
+)
+
+
+def _as_printable(column: np.ndarray) -> List[Union[int, float]]:
+    """Integral values are printed as ints, like coordinates in input coco file"""
+    if column.dtype.kind != "f":
+        return column.tolist()
+    if np.all(np.mod(column, 1) == 0):
+        return column.astype(np.int64).tolist()
+    return [int(value) if value.is_integer() else value for value in column.tolist()]
+
+
+def _iter_annotation_chunks(columns: Dict[str, np.ndarray], coco_image_ids: np.ndarray,
+                            first_id: int) -> Iterator[List[str]]:
+    bboxes_amount = len(columns["image_index"])
+    for start in range(0, bboxes_amount, cfg.EXPORT_CHUNK_SIZE):
+        end = min(start + cfg.EXPORT_CHUNK_SIZE, bboxes_amount)
+        x1, y1, x2, y2 = (columns[name][start:end] for name in ("x1", "y1", "x2", "y2"))
+        width = x2 - x1
+        height = y2 - y1
+        values = zip(
+            np.arange(first_id + start, first_id + end).tolist(),
+            coco_image_ids[columns["image_index"][start:end]].tolist(),
+            columns["category_id"][start:end].tolist(),
+            _as_printable(x1),
+            _as_printable(y1),
+            _as_printable(width),
+            _as_printable(height),
+            _as_printable(width * height),
+        )
+        yield [ANNOTATION_TEMPLATE.format(*annotation_values) for annotation_values in values]
+
+
+def _filter_original_annotations(annotations: List[Tuple[int, str]], kept_image_ids: np.ndarray,
+                                 duplicate_image_ids: Dict[int, int]) -> List[str]:
+    """Returns texts of (coco image id, text) annotations whose images are among sorted kept_image_ids
+
+    Annotations of images whose file name repeats an earlier image are moved to that image, as they are shown.
+    """
+    image_ids = np.fromiter((image_id for image_id, _ in annotations), dtype=np.int64, count=len(annotations))
+    is_duplicate = np.isin(image_ids, np.fromiter(duplicate_image_ids, dtype=np.int64))
+    if not np.any(is_duplicate):
+        return [annotations[i][1] for i in np.flatnonzero(np.isin(image_ids, kept_image_ids)).tolist()]
+
+    image_ids[is_duplicate] = [duplicate_image_ids[image_id] for image_id in image_ids[is_duplicate].tolist()]
+    texts = list()
+    for i in np.flatnonzero(np.isin(image_ids, kept_image_ids)).tolist():
+        text = annotations[i][1]
+        if is_duplicate[i]:
+            annotation = json.loads(text)
+            annotation["image_id"] = int(image_ids[i])
+            text = json.dumps(annotation)
+        texts.append(text)
+    return texts
+
+
+def _write_annotations(output_file: TextIO, texts: List[str], written_amount: int) -> int:
+    """Writes annotation texts after written_amount annotations, returns amount of written annotations"""
+    if texts:
+        output_file.write(("" if written_amount == 0 else ",\n") + ",\n".join(texts))
+    return written_amount + len(texts)
+
+
+def _finish_images(output_file: TextIO, coco_image_ids: np.ndarray, is_replaced: np.ndarray) -> np.ndarray:
+    """Writes categories after images, returns sorted coco ids of exported images whose coco bboxes are kept"""
+    categories = [
+        {"id": category_id, "name": label} for label, category_id in sorted(cfg.LABEL_CATEGORY_ID.items(),
+                                                                          key=lambda item: item[1])
+    ]
+    output_file.write('\n],\n"categories": ' + json.dumps(categories) + ',\n"annotations": [\n')
+    return np.sort(coco_image_ids[(coco_image_ids != -1) & ~is_replaced])
+
+
+def export_coco(storage: AnnotationStorage, annotation_path: str, output_path: str, drop_skipped: bool = False):
+    """Writes coco file with images of annotation_path and bboxes corrected in labeled and skipped results
+
+    Annotations of images which are neither labeled nor skipped are copied from the input coco file as they are,
+    with their ids and all their fields. Bboxes of labeled and skipped images replace them and get ids after
+    the largest original id. Images repeating file name of an earlier image are exported once, with annotations
+    of all of them. Top level values other than images, annotations and categories are copied after annotations.
+    Items are streamed from the input coco file and annotations are written in chunks, so memory does not grow
+    with the size of the output, unless annotations precede images in the input file.
+    """
+    skipped_annotations = storage.get_skipped_annotations()
+    is_replaced, replaced_columns = storage.get_replaced_bboxes_columns(
+        None if drop_skipped else skipped_annotations
+    )
+
+    # image id in storage -> image id in coco file, -1 for images which are not exported
+    coco_image_ids = np.full(storage.images_amount, -1, dtype=np.int64)
+
+    tmp_output_path = f"{output_path}{cfg.TMP_FILE_SUFFIX}"
+    with open(tmp_output_path, "w") as output_file:
+        output_file.write('{"images": [\n')
+        images_amount = 0
+        annotations_amount = 0
+        max_annotation_id = 0
+        # (coco image id, text) of original annotations waiting until all images are read
+        original_annotations: List[Tuple[int, str]] = list()
+        # sorted coco ids of exported images whose original annotations are kept, known once images are read
+        kept_image_ids: Union[np.ndarray, None] = None
+        # coco id of image with already seen file name -> coco id of the first image with this file name
+        duplicate_image_ids: Dict[int, int] = dict()
+        # (key, text) of other top level values, written after annotations
+        other_values: List[Tuple[str, str]] = list()
+        previous_key = None
+        reader = CocoStreamReader(annotation_path)
+        for key, item, text in reader.iter_items_with_text(array_keys=("images", "annotations")):
+            if kept_image_ids is None and previous_key == "images" and key != "images":
+                kept_image_ids = _finish_images(output_file, coco_image_ids, is_replaced)
+            previous_key = key
+
+            if key == "images":
+                image_id = storage.get_image_id_by_name(item["file_name"])
+                if coco_image_ids[image_id] == -1 and not (drop_skipped and image_id in skipped_annotations):
+                    coco_image_ids[image_id] = item["id"]
+                    output_file.write(("" if images_amount == 0 else ",\n") + text)
+                    images_amount += 1
+                elif coco_image_ids[image_id] != -1:
+                    duplicate_image_ids[item["id"]] = int(coco_image_ids[image_id])
+            elif key == "annotations":
+                max_annotation_id = max(max_annotation_id, item["id"])
+                original_annotations.append((item["image_id"], text))
+                if kept_image_ids is not None and len(original_annotations) >= cfg.EXPORT_CHUNK_SIZE:
+                    annotations_amount = _write_annotations(
+                        output_file,
+                        _filter_original_annotations(original_annotations, kept_image_ids, duplicate_image_ids),
+                        annotations_amount
+                    )
+                    original_annotations = list()
+            elif key != "categories":
+                other_values.append((key, text))
+
+        if kept_image_ids is None:
+            kept_image_ids = _finish_images(output_file, coco_image_ids, is_replaced)
+        if original_annotations:
+            annotations_amount = _write_annotations(
+                output_file, _filter_original_annotations(original_annotations, kept_image_ids, duplicate_image_ids),
+                annotations_amount
+            )
+
+        exported = coco_image_ids[replaced_columns["image_index"]] != -1
+        replaced_columns = {name: column[exported] for name, column in replaced_columns.items()}
+        for chunk in _iter_annotation_chunks(replaced_columns, coco_image_ids, max_annotation_id + 1):
+            annotations_amount = _write_annotations(output_file, chunk, annotations_amount)
+        output_file.write("\n]" + "".join(f",\n{json.dumps(key)}: {text}" for key, text in other_values) + "}\n")
+    os.replace(tmp_output_path, output_path)
+
+    print(f"{images_amount} images and {annotations_amount} annotations exported to {output_path}")
+    if duplicate_image_ids:
+        print(f"{len(duplicate_image_ids)} images repeat file name of another image, "
+              f"their annotations are exported with the first image of this name")
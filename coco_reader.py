@@ -0,0 +1,121 @@
+import codecs
+import json
+import re
+from typing import Any, Iterator, Tuple, Union
+
+import config as cfg
+
+
+class CocoStreamReader:
+    """Incrementally parses top level arrays of COCO json without loading the whole file"""
+
+    _WHITESPACES = " \t\r\n"
+    _NON_WHITESPACE = re.compile(r"[^ \t\r\n]")
+
+    def __init__(self, annotation_path: str, chunk_size: int = cfg.COCO_READ_CHUNK_SIZE):
+        self._annotation_path: str = annotation_path
+        self._chunk_size: int = chunk_size
+        self._decoder = json.JSONDecoder()
+
+    def iter_items(self) -> Iterator[Tuple[str, Any]]:
+        """Yields (top level key, item) for every item of top level arrays"""
+        for key, item, _ in self._iter_items(with_text=False):
+            yield key, item
+
+    def iter_items_with_text(self,
+                             array_keys: Union[Tuple[str, ...], None] = None) -> Iterator[Tuple[str, Any, str]]:
+        """Yields (top level key, item, item text) for every item of top level arrays
+
+        Item text is the item as it is written in the file, so it can be copied to another json unchanged.
+        If array_keys is given, only these arrays are split into items and all other top level values are
+        yielded whole, as (top level key, value, value text).
+        """
+        return self._iter_items(with_text=True, array_keys=array_keys)
+
+    def iter_array(self, array_key: str) -> Iterator[Any]:
+        for key, item in self.iter_items():
+            if key == array_key:
+                yield item
+
+    def _iter_items(self, with_text: bool,
+                    array_keys: Union[Tuple[str, ...], None] = None) -> Iterator[Tuple[str, Any, Union[str, None]]]:
+        with open(self._annotation_path, "rb") as self._file:
+            self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+            self._buffer: str = ""
+            self._pos: int = 0
+            # position of buffer start in the whole text, for error messages
+            self._buffer_start: int = 0
+            self._eof: bool = False
+            # start of the last decoded value in buffer, the value ends at current position
+            self._value_start: int = 0
+
+            self._expect("{")
+            while self._peek() != "}":
+                key = self._decode_value()
+                self._expect(":")
+                if self._peek() == "[" and (array_keys is None or key in array_keys):
+                    self._consume(1)
+                    while self._peek() != "]":
+                        item = self._decode_value()
+                        yield key, item, self._buffer[self._value_start:self._pos] if with_text else None
+                        if self._peek() == ",":
+                            self._consume(1)
+                    self._consume(1)
+                else:
+                    value = self._decode_value()
+                    if array_keys is not None:
+                        yield key, value, self._buffer[self._value_start:self._pos] if with_text else None
+                if self._peek() == ",":
+                    self._consume(1)
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        # drop already parsed text
+        self._buffer = self._buffer[self._pos:]
+        self._buffer_start += self._pos
+        self._pos = 0
+
+        chunk = self._file.read(self._chunk_size)
+        self._eof = not chunk
+        self._buffer += self._text_decoder.decode(chunk, final=self._eof)
+        return not self._eof
+
+    def _peek(self) -> str:
+        """Skips whitespaces and returns next significant char"""
+        while True:
+            if self._pos < len(self._buffer) and self._buffer[self._pos] not in self._WHITESPACES:
+                return self._buffer[self._pos]
+            match = self._NON_WHITESPACE.search(self._buffer, self._pos)
+            if match is not None:
+                self._pos = match.start()
+                return self._buffer[self._pos]
+            self._pos = len(self._buffer)
+            if not self._fill():
+                raise ValueError(f"unexpected end of file {self._annotation_path}")
+
+    def _consume(self, length: int):
+        self._pos += length
+
+    def _expect(self, char: str):
+        if self._peek() != char:
+            raise ValueError(f"expected '{char}' at char {self._buffer_start + self._pos} of {self._annotation_path}")
+        self._consume(1)
+
+    def _decode_value(self) -> Any:
+        """Decodes value at current position"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # number at the end of buffer may continue in the next chunk
+                if end < len(self._buffer) or self._eof:
+                    break
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._fill()
+
+        self._value_start = self._pos
+        self._pos = end
+        return value
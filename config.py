@@ -41,8 +41,18 @@ class HotKey:
     MarkSkipped = ord("n")
     Quit = ord("q")
     UndoLabeling = ord("r")
+    RedoLabeling = ord("e")
+    ResetLabeling = ord("t")
     OpenNext = ord("x")
     OpenPrevious = ord("z")
+    OpenNextUntouched = ord("u")
+    OpenPreviousUntouched = ord("U")
+    OpenNextWithClass = ord("f")
+    OpenPreviousWithClass = ord("F")
+    ZoomIn = ord("=")
+    ZoomOut = ord("-")
+    ResetView = ord("v")
+    ToggleOriginalBBoxes = ord("o")
 
 
 ClassHotKeys = {
@@ -96,6 +106,9 @@ CATEGORY_ID_TO_LABEL = {
 
 
 WINDOW_NAME = "Labeler"
+# wait for key returns NO_KEY after this time, so signals are handled while no key is pressed
+KEY_POLL_MS = 100
+NO_KEY = -1
 BOLD_BBOX_LINE_THICKNESS = 5
 DEFAULT_BBOX_LINE_THICKNESS = 3
 TEXT_COLOR = Color.Cyan
@@ -107,6 +120,125 @@ DIRECTORY_FOR_LABELED_NAME = 'labeled'
 
 VARIABLES_FILE_NAME = 'last_frame_id.json'
 
+JOURNAL_FILE_NAME = 'annotations_journal.log'
+JOURNAL_SNAPSHOT_FILE_NAME = 'annotations_snapshot.log'
+
+
+class OutputFormat:
+    FILES = 'files'
+    JOURNAL = 'journal'
+
+COCO_READ_CHUNK_SIZE = 2 ** 20
+CACHE_DIRECTORY_NAME = '.label_utility_cache'
+STARTUP_SNAPSHOT_FILE_NAME = 'startup_snapshot.pkl'
+STARTUP_SNAPSHOT_VERSION = 2
+FINGERPRINT_CHUNK_SIZE = 2 ** 20
+
+TMP_FILE_SUFFIX = '.tmp'
+WRITER_MAX_PENDING = 10000
+
+MERGE_WORKERS = 16
+MERGE_BATCH_SIZE = 1000
+
+EXPORT_CHUNK_SIZE = 100000
+
+VALIDATION_BATCH_SIZE = 2000
+# lower edges of bbox width and height histogram bins in pixels, the last bin is open
+BBOX_SIZE_HISTOGRAM_BINS = (0, 8, 16, 32, 64, 128, 256, 512, 1024, 2048)
+
+
+class ValidationIssue:
+    MISSING_IMAGE = 'missing_image'
+    UNREADABLE_IMAGE = 'unreadable_image'
+    OUT_OF_BOUNDS = 'out_of_bounds'
+    DEGENERATE = 'degenerate'
+    INVERTED = 'inverted'
+    UNKNOWN_CATEGORY = 'unknown_category'
+
 
 class PresistentVariableName:
     IMAGE_ID = 'img_id'
+
+UNDO_DEPTH = 100
+
+FRAME_CACHE_BUDGET_MB = 1024
+PREFETCH_FRAMES_AMOUNT = 4
+PREFETCH_WORKERS = 2
+
+# images are decoded and displayed downscaled by this factor, bboxes are kept in full resolution
+DISPLAY_SCALES = (1, 2, 4, 8)
+DEFAULT_DISPLAY_SCALE = 1
+
+# frame is scaled to fit this size, zoomed views are cropped from the frame and scaled to the same size
+VIEWPORT_MAX_WIDTH = 1920
+VIEWPORT_MAX_HEIGHT = 1080
+ZOOM_STEP = 1.5
+MAX_ZOOM = 64
+
+# coco file_name of a video frame, frame is frame number in video counted from VIDEO_FIRST_FRAME_NUMBER
+VIDEO_FRAME_NAME_PATTERN = r'(?P<video>.+)_(?P<frame>\d+)\.\w+'
+VIDEO_FIRST_FRAME_NUMBER = 0
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv', '.mov')
+# frames up to this amount ahead are reached by decoding forward instead of seeking
+VIDEO_MAX_GRAB_AHEAD = 64
+VIDEO_MAX_OPEN_READERS = 4
+VIDEO_INDEX_VERSION = 1
+
+# saved bboxes are carried by optical flow to this amount of the next frames
+PROPAGATION_FRAMES_AHEAD = 3
+# bbox is tracked by grid of PROPAGATION_GRID_SIZE x PROPAGATION_GRID_SIZE points inside it
+PROPAGATION_GRID_SIZE = 5
+PROPAGATION_WINDOW_SIZE = 15
+PROPAGATION_PYRAMID_LEVELS = 3
+# points tracked back further than this amount of pixels from their start are dropped
+PROPAGATION_MAX_BACK_ERROR = 1.0
+# bboxes with less tracked points stay in place
+PROPAGATION_MIN_POINTS = 4
+PROPAGATION_MAX_SCALE_CHANGE = 1.25
+
+# images are hashed by dHash of DEDUP_HASH_SIZE x DEDUP_HASH_SIZE bits
+DEDUP_HASH_SIZE = 16
+# neighbouring images whose hashes differ from hash of the first image of their run in at most this amount
+# of bits are collapsed in navigation
+DEDUP_MAX_DISTANCE = 20
+# images after the first image of a run are compared with it in blocks growing from this size
+DEDUP_SCAN_BLOCK_SIZE = 64
+DEDUP_BATCH_SIZE = 500
+DEDUP_CACHE_FILE_NAME = 'image_hashes.pkl'
+DEDUP_CACHE_VERSION = 1
+
+# labeling processes sharing output folder claim batches of SHARD_BATCH_SIZE images with leases
+SHARDS_DIRECTORY_NAME = '.shards'
+SHARD_BATCH_SIZE = 100
+# lease is renewed while its holder works, lease not renewed for this time is taken over by another worker
+SHARD_LEASE_SECONDS = 600
+
+# in review corrected bbox is matched to original one of the same image if their IoU is at least DIFF_MATCH_IOU,
+# matched bbox whose IoU is below DIFF_MOVED_IOU is moved
+DIFF_MATCH_IOU = 0.3
+DIFF_MOVED_IOU = 0.9
+DIFF_BATCH_SIZE = 50000
+DIFF_LINE_THICKNESS = 1
+
+
+class ChangeType:
+    ADDED = 'added'
+    REMOVED = 'removed'
+    RELABELED = 'relabeled'
+    MOVED = 'moved'
+
+
+CHANGE_TYPES = (ChangeType.ADDED, ChangeType.REMOVED, ChangeType.RELABELED, ChangeType.MOVED)
+CHANGE_COLORS = {
+    ChangeType.ADDED: Color.Lime,
+    ChangeType.REMOVED: Color.White,
+    ChangeType.RELABELED: Color.Magenta,
+    ChangeType.MOVED: Color.Orange,
+}
+
+# frames cache gets at most this part of memory left under RSS budget after annotations are loaded
+RSS_BUDGET_FRAME_CACHE_SHARE = 0.5
+
+TRACE_MAX_EVENTS = 1000000
+# amount of the last presses of each key used for latency percentiles
+TRACE_LATENCY_WINDOW = 1000
@@ -5,12 +5,18 @@ import config as cfg
 
 
 class Point:
+    __slots__ = ("x", "y")
+
     def __init__(self, x: int, y: int):
         self.x: int = x
         self.y: int = y
 
 
 class BBox:
+    """Bboxes are shared between storage and canvas, so they are never changed in place"""
+
+    __slots__ = ("x1", "y1", "x2", "y2", "label")
+
     def __init__(self, x1: int, y1: int, x2: int, y2: int, label: cfg.ClassLabel):
         self.x1: int = x1
         self.y1: int = y1
@@ -18,6 +24,9 @@ class BBox:
         self.y2: int = y2
         self.label: cfg.ClassLabel = label
 
+    def with_label(self, label: cfg.ClassLabel) -> "BBox":
+        return BBox(self.x1, self.y1, self.x2, self.y2, label)
+
     def __contains__(self, item: Point):
         if self.x1 <= item.x <= self.x2 and self.y1 <= item.y <= self.y2:
             return True
@@ -0,0 +1,193 @@
+import json
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, BinaryIO, Dict, List, Tuple, Union
+
+import numpy as np
+
+import config as cfg
+from utils import AnnotationStorage
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# start of frame markers, all markers from C0 to CF except DHT, JPG and DAC
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# image size of missing and unreadable images
+MISSING_IMAGE_SIZE = (-1, -1)
+UNREADABLE_IMAGE_SIZE = (0, 0)
+
+
+def _read_jpeg_size(image_file: BinaryIO) -> Union[Tuple[int, int], None]:
+    image_file.seek(2)
+    while True:
+        byte = image_file.read(1)
+        while byte and byte != b"\xff":
+            byte = image_file.read(1)
+        # markers may be preceded by any amount of fill bytes
+        while byte == b"\xff":
+            byte = image_file.read(1)
+        if not byte:
+            return None
+
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # markers without segment
+            continue
+        if marker in (0xD9, 0xDA):
+            # end of image or start of scan before frame header
+            return None
+        length_bytes = image_file.read(2)
+        if len(length_bytes) < 2:
+            return None
+        if marker in JPEG_SOF_MARKERS:
+            frame_header = image_file.read(5)
+            if len(frame_header) < 5:
+                return None
+            _, height, width = struct.unpack(">BHH", frame_header)
+            return width, height
+        image_file.seek(struct.unpack(">H", length_bytes)[0] - 2, os.SEEK_CUR)
+
+
+def read_image_size(image_path: str) -> Union[Tuple[int, int], None]:
+    """Returns (width, height) parsed from file header without decoding, None for unsupported formats"""
+    with open(image_path, "rb") as image_file:
+        head = image_file.read(26)
+        if head.startswith(PNG_SIGNATURE) and head[12:16] == b"IHDR":
+            return struct.unpack(">II", head[16:24])
+        if head.startswith(b"\xff\xd8"):
+            return _read_jpeg_size(image_file)
+        if head.startswith(b"BM") and len(head) == 26:
+            width, height = struct.unpack("<ii", head[18:26])
+            return width, abs(height)
+    return None
+
+
+def _read_image_sizes(images_folder: str, image_names: List[str]) -> List[Tuple[int, int]]:
+    sizes = list()
+    for image_name in image_names:
+        try:
+            size = read_image_size(os.path.join(images_folder, image_name))
+        except FileNotFoundError:
+            size = MISSING_IMAGE_SIZE
+        except (OSError, struct.error):
+            size = None
+        sizes.append(size or UNREADABLE_IMAGE_SIZE)
+    return sizes
+
+
+def read_image_sizes(images_folder: str, image_names: List[str], workers: int = None) -> np.ndarray:
+    """Reads sizes of images in process pool, returns array of (width, height) rows
+
+    Missing images have size MISSING_IMAGE_SIZE, images with unsupported or broken header UNREADABLE_IMAGE_SIZE.
+    """
+    sizes = np.empty((len(image_names), 2), dtype=np.int64)
+    batches = [
+        image_names[batch_start:batch_start + cfg.VALIDATION_BATCH_SIZE]
+        for batch_start in range(0, len(image_names), cfg.VALIDATION_BATCH_SIZE)
+    ]
+
+    start_time = time.perf_counter()
+    read_amount = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch_sizes in executor.map(partial(_read_image_sizes, images_folder), batches):
+            sizes[read_amount:read_amount + len(batch_sizes)] = batch_sizes
+            read_amount += len(batch_sizes)
+            elapsed = time.perf_counter() - start_time
+            print(f"{images_folder}: {read_amount}/{len(image_names)} image headers read, "
+                  f"{read_amount / max(elapsed, 1e-6):.0f} images/s",
+                  end="\r" if read_amount < len(image_names) else "\n")
+    return sizes
+
+
+def _size_histogram(sizes: np.ndarray) -> List[int]:
+    bins = list(cfg.BBOX_SIZE_HISTOGRAM_BINS) + [np.inf]
+    return np.histogram(sizes, bins=bins)[0].tolist()
+
+
+def validate_dataset(storage: AnnotationStorage, images_folder: str, workers: int = None) -> Dict[str, Any]:
+    """Checks images and bboxes as they would be exported, returns report with issues and per class statistics"""
+    image_names = storage.get_sorted_images_names()
+    image_sizes = read_image_sizes(images_folder, image_names, workers)
+    columns = storage.get_bboxes_columns(storage.get_skipped_annotations())
+
+    x1, y1, x2, y2 = (columns[name] for name in ("x1", "y1", "x2", "y2"))
+    category_ids = columns["category_id"]
+    image_indexes = columns["image_index"]
+    widths = x2 - x1
+    heights = y2 - y1
+    image_widths = image_sizes[image_indexes, 0]
+    image_heights = image_sizes[image_indexes, 1]
+
+    # bboxes of missing and unreadable images are not checked against image bounds
+    is_known_size = image_widths > 0
+    issues = {
+        cfg.ValidationIssue.INVERTED: (widths < 0) | (heights < 0),
+        cfg.ValidationIssue.DEGENERATE: (widths == 0) | (heights == 0),
+        cfg.ValidationIssue.OUT_OF_BOUNDS: is_known_size & (
+            (np.minimum(x1, x2) < 0) | (np.minimum(y1, y2) < 0)
+            | (np.maximum(x1, x2) > image_widths) | (np.maximum(y1, y2) > image_heights)
+        ),
+        cfg.ValidationIssue.UNKNOWN_CATEGORY: ~np.isin(category_ids, list(cfg.CATEGORY_ID_TO_LABEL)),
+    }
+
+    bbox_issues = list()
+    has_issue = np.logical_or.reduce(list(issues.values()))
+    for i in np.flatnonzero(has_issue).tolist():
+        bbox_issues.append({
+            "image_name": image_names[image_indexes[i]],
+            "bbox": [int(value) if value.is_integer() else value for value in (x1[i], y1[i], x2[i], y2[i])],
+            "category_id": category_ids[i].item(),
+            "issues": [issue for issue, mask in issues.items() if mask[i]],
+        })
+
+    classes = dict()
+    is_valid = ~has_issue
+    for category_id, label in sorted(cfg.CATEGORY_ID_TO_LABEL.items()):
+        is_class = category_ids == category_id
+        classes[label] = {
+            "bboxes": int(np.count_nonzero(is_class)),
+            "images": int(len(np.unique(image_indexes[is_class]))),
+            "width_histogram": _size_histogram(widths[is_class & is_valid]),
+            "height_histogram": _size_histogram(heights[is_class & is_valid]),
+        }
+
+    is_missing = image_sizes[:, 0] == MISSING_IMAGE_SIZE[0]
+    is_unreadable = image_sizes[:, 0] == UNREADABLE_IMAGE_SIZE[0]
+    return {
+        "images": len(image_names),
+        "bboxes": len(image_indexes),
+        "images_without_bboxes": int(len(image_names) - len(np.unique(image_indexes))),
+        "issues_count": {
+            cfg.ValidationIssue.MISSING_IMAGE: int(np.count_nonzero(is_missing)),
+            cfg.ValidationIssue.UNREADABLE_IMAGE: int(np.count_nonzero(is_unreadable)),
+            **{issue: int(np.count_nonzero(mask)) for issue, mask in issues.items()},
+        },
+        cfg.ValidationIssue.MISSING_IMAGE: [image_names[i] for i in np.flatnonzero(is_missing).tolist()],
+        cfg.ValidationIssue.UNREADABLE_IMAGE: [image_names[i] for i in np.flatnonzero(is_unreadable).tolist()],
+        "bbox_issues": bbox_issues,
+        "histogram_bins": list(cfg.BBOX_SIZE_HISTOGRAM_BINS),
+        "classes": classes,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"{report['images']} images, {report['bboxes']} bboxes, "
+          f"{report['images_without_bboxes']} images without bboxes")
+    for issue, amount in report["issues_count"].items():
+        print(f"{issue}: {amount}")
+
+    bins = report["histogram_bins"]
+    print("bbox size bins: " + " ".join(f"{edge}+" for edge in bins))
+    for label, statistics in report["classes"].items():
+        print(f"{label}: {statistics['bboxes']} bboxes on {statistics['images']} images")
+        print(f"    width:  {statistics['width_histogram']}")
+        print(f"    height: {statistics['height_histogram']}")
+
+
+def save_report(report: Dict[str, Any], report_path: str):
+    with open(report_path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f"validation report saved to {report_path}")
@@ -0,0 +1,77 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Deque, Union
+
+import config as cfg
+from data_structures import BBox
+
+
+class EditOperation(ABC):
+    """Single change of canvas bboxes, undone by applying its inverse"""
+
+    __slots__ = ("bbox_id", "bbox")
+
+    def __init__(self, bbox_id: int, bbox: BBox):
+        self.bbox_id: int = bbox_id
+        self.bbox: BBox = bbox
+
+    @abstractmethod
+    def inverse(self) -> "EditOperation":
+        """Returns operation which reverts this one"""
+
+
+class AddBBox(EditOperation):
+    __slots__ = ()
+
+    def inverse(self) -> "EditOperation":
+        return DeleteBBox(self.bbox_id, self.bbox)
+
+
+class DeleteBBox(EditOperation):
+    __slots__ = ()
+
+    def inverse(self) -> "EditOperation":
+        return AddBBox(self.bbox_id, self.bbox)
+
+
+class RelabelBBox(EditOperation):
+    """Replaces bbox with bbox_id by bbox"""
+
+    __slots__ = ("old_bbox",)
+
+    def __init__(self, bbox_id: int, old_bbox: BBox, bbox: BBox):
+        super().__init__(bbox_id, bbox)
+        self.old_bbox: BBox = old_bbox
+
+    def inverse(self) -> "EditOperation":
+        return RelabelBBox(self.bbox_id, self.bbox, self.old_bbox)
+
+
+class EditHistory:
+    """Undo and redo stacks of edit operations of current frame, bounded by depth"""
+
+    def __init__(self, depth: int = cfg.UNDO_DEPTH):
+        self._undo_stack: Deque[EditOperation] = deque(maxlen=depth)
+        self._redo_stack: Deque[EditOperation] = deque(maxlen=depth)
+
+    def push(self, operation: EditOperation):
+        self._undo_stack.append(operation)
+        self._redo_stack.clear()
+
+    def pop_undo(self) -> Union[EditOperation, None]:
+        if not self._undo_stack:
+            return None
+        operation = self._undo_stack.pop()
+        self._redo_stack.append(operation)
+        return operation
+
+    def pop_redo(self) -> Union[EditOperation, None]:
+        if not self._redo_stack:
+            return None
+        operation = self._redo_stack.pop()
+        self._undo_stack.append(operation)
+        return operation
+
+    def clear(self):
+        self._undo_stack.clear()
+        self._redo_stack.clear()
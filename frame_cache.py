@@ -0,0 +1,172 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Union
+
+import numpy as np
+
+import config as cfg
+from image_source import FolderImageSource, VideoImageSource
+from tracing import NullTracer, Tracer
+
+
+class FrameCache:
+    """Thread safe LRU cache of decoded frames bounded by memory budget"""
+
+    def __init__(self, budget_bytes: int):
+        self._budget_bytes: int = budget_bytes
+        self._frames: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._size_bytes: int = 0
+        self._lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    @property
+    def size_bytes(self):
+        return self._size_bytes
+
+    @property
+    def budget_bytes(self):
+        return self._budget_bytes
+
+    def __contains__(self, key: str):
+        with self._lock:
+            return key in self._frames
+
+    def __len__(self):
+        with self._lock:
+            return len(self._frames)
+
+    def get(self, key: str) -> Union[np.ndarray, None]:
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is None:
+                self.misses += 1
+                return None
+            self._frames.move_to_end(key)
+            self.hits += 1
+            return frame
+
+    def put(self, key: str, frame: np.ndarray):
+        if frame is None or frame.nbytes > self._budget_bytes:
+            return
+        with self._lock:
+            if key in self._frames:
+                self._size_bytes -= self._frames.pop(key).nbytes
+            self._frames[key] = frame
+            self._size_bytes += frame.nbytes
+            self._evict()
+
+    def set_budget(self, budget_bytes: int):
+        """Changes memory budget, frames over new budget are evicted immediately"""
+        with self._lock:
+            self._budget_bytes = budget_bytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._size_bytes = 0
+
+    def _evict(self):
+        while self._size_bytes > self._budget_bytes:
+            _, evicted = self._frames.popitem(last=False)
+            self._size_bytes -= evicted.nbytes
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "frames": len(self._frames),
+                "size_mb": self._size_bytes // 2 ** 20,
+            }
+
+
+class ImagePrefetcher:
+    """Decodes images around the cursor in background threads"""
+
+    def __init__(self, image_source: Union[FolderImageSource, VideoImageSource], get_image_name: Callable[[int], str],
+                 images_amount: int, budget_mb: int = cfg.FRAME_CACHE_BUDGET_MB,
+                 prefetch_amount: int = cfg.PREFETCH_FRAMES_AMOUNT, workers: int = cfg.PREFETCH_WORKERS,
+                 tracer: Union[Tracer, NullTracer] = None,
+                 get_next_image_id: Callable[[int, bool], Union[int, None]] = None):
+        self._tracer: Union[Tracer, NullTracer] = tracer if tracer is not None else NullTracer()
+        self._image_source: Union[FolderImageSource, VideoImageSource] = image_source
+        self._get_image_name: Callable[[int], str] = get_image_name
+        self._images_amount: int = images_amount
+        self._prefetch_amount: int = prefetch_amount
+        # id of image navigation goes to next, the neighbouring one by default
+        self._get_next_image_id: Callable[[int, bool], Union[int, None]] = (
+            get_next_image_id if get_next_image_id is not None else self._get_neighbour_image_id
+        )
+        self.cache: FrameCache = FrameCache(budget_mb * 2 ** 20)
+        # sequential source decodes frames in the order they are scheduled, so one thread reads them
+        workers = 1 if image_source.sequential else max(1, workers)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        # image name -> decoding in progress
+        self._pending: Dict[str, Future] = dict()
+        self._pending_lock = threading.Lock()
+
+    def get(self, image_id: int) -> np.ndarray:
+        img_name = self._get_image_name(image_id)
+        img = self.cache.get(img_name)
+        if img is not None:
+            return img
+
+        with self._pending_lock:
+            future = self._pending.get(img_name)
+        if future is not None:
+            with self._tracer.span("wait prefetch"):
+                img = future.result()
+        else:
+            img = self._read(img_name)
+            self.cache.put(img_name, img)
+        return img
+
+    def prefetch(self, image_id: int, direction: bool):
+        """Schedule decoding of next images in the direction of travel and the nearest one behind
+
+        Sequential source reads frames behind the current one by seeking back, so they are not prefetched.
+        """
+        image_ids = list()
+        prefetch_id = image_id
+        for _ in range(self._prefetch_amount):
+            prefetch_id = self._get_next_image_id(prefetch_id, direction)
+            if prefetch_id is None:
+                break
+            image_ids.append(prefetch_id)
+        if not self._image_source.sequential:
+            image_ids.append(self._get_next_image_id(image_id, not direction))
+        for prefetch_id in image_ids:
+            if prefetch_id is not None:
+                self._schedule(self._get_image_name(prefetch_id))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _get_neighbour_image_id(self, image_id: int, direction: bool) -> Union[int, None]:
+        next_image_id = image_id + 1 if direction else image_id - 1
+        return next_image_id if 0 <= next_image_id < self._images_amount else None
+
+    def _schedule(self, img_name: str):
+        if img_name in self.cache:
+            return
+        with self._pending_lock:
+            if img_name in self._pending:
+                return
+            future = self._executor.submit(self._decode_to_cache, img_name)
+            self._pending[img_name] = future
+
+    def _decode_to_cache(self, img_name: str) -> np.ndarray:
+        try:
+            img = self._read(img_name)
+            self.cache.put(img_name, img)
+            return img
+        finally:
+            with self._pending_lock:
+                self._pending.pop(img_name, None)
+
+    def _read(self, img_name: str) -> np.ndarray:
+        with self._tracer.span("imread"):
+            return self._image_source.read(img_name)
@@ -0,0 +1,157 @@
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+import config as cfg
+
+
+# amount of set bits of every byte value
+BYTE_POPCOUNTS = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def difference_hashes(images: np.ndarray) -> np.ndarray:
+    """Returns dHash of every grayscale image of (images, hash size, hash size + 1) array as rows of bytes
+
+    Bit is set when pixel is brighter than its left neighbour, so hash survives small changes of brightness.
+    """
+    bits = images[:, :, 1:] > images[:, :, :-1]
+    return np.packbits(bits.reshape(len(images), -1), axis=1)
+
+
+def _hash_images(images_folder: str, hash_size: int, image_names: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns hashes of images and mask of images which were read"""
+    thumbnails = np.zeros((len(image_names), hash_size, hash_size + 1), dtype=np.uint8)
+    is_read = np.zeros(len(image_names), dtype=bool)
+    for i, image_name in enumerate(image_names):
+        # hash needs only a thumbnail, so jpeg is decoded at 1/8 of its size
+        img = cv2.imread(os.path.join(images_folder, image_name), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if img is not None:
+            thumbnails[i] = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+            is_read[i] = True
+    return difference_hashes(thumbnails), is_read
+
+
+def _stat_images(images_folder: str) -> Dict[str, Tuple[int, int]]:
+    """Returns image name -> (modification time, size) of files in images folder"""
+    stats = dict()
+    with os.scandir(images_folder) as entries:
+        for entry in entries:
+            if entry.is_file():
+                stat = entry.stat()
+                stats[entry.name] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def compute_image_hashes(images_folder: str, image_names: List[str], workers: int = None,
+                         hash_size: int = cfg.DEDUP_HASH_SIZE) -> Tuple[np.ndarray, np.ndarray]:
+    """Computes hashes of images in process pool, returns (hashes rows, mask of images which were read)
+
+    Hashes are cached in images folder, only images which are new or changed since the last run are read.
+    """
+    cache_path = os.path.join(images_folder, cfg.CACHE_DIRECTORY_NAME, cfg.DEDUP_CACHE_FILE_NAME)
+    cached = {"names": list(), "stats": np.zeros((0, 2), dtype=np.int64),
+              "hashes": np.zeros((0, hash_size * hash_size // 8), dtype=np.uint8)}
+    try:
+        with open(cache_path, "rb") as cache_file:
+            loaded = pickle.load(cache_file)
+        if loaded["version"] == cfg.DEDUP_CACHE_VERSION and loaded["hash_size"] == hash_size:
+            cached = loaded
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        pass
+
+    file_stats = _stat_images(images_folder)
+    # missing images never match cached stats, so they are read and reported as not read
+    stats = np.array([file_stats.get(image_name, (-1, -1)) for image_name in image_names],
+                     dtype=np.int64).reshape(-1, 2)
+    cached_rows = {image_name: row for row, image_name in enumerate(cached["names"])}
+    rows = np.array([cached_rows.get(image_name, -1) for image_name in image_names], dtype=np.int64)
+    is_cached = rows >= 0
+    is_cached[is_cached] = np.all(cached["stats"][rows[is_cached]] == stats[is_cached], axis=1)
+
+    hashes = np.zeros((len(image_names), hash_size * hash_size // 8), dtype=np.uint8)
+    hashes[is_cached] = cached["hashes"][rows[is_cached]]
+    is_read = is_cached.copy()
+
+    stale_ids = np.flatnonzero(~is_cached)
+    batches = [
+        stale_ids[batch_start:batch_start + cfg.DEDUP_BATCH_SIZE]
+        for batch_start in range(0, len(stale_ids), cfg.DEDUP_BATCH_SIZE)
+    ]
+    start_time = time.perf_counter()
+    hashed_amount = 0
+    if batches:
+        # spawned workers do not inherit locks held by background writer thread
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            batch_names = ([image_names[image_id] for image_id in batch] for batch in batches)
+            for batch, (batch_hashes, batch_is_read) in zip(
+                    batches, executor.map(partial(_hash_images, images_folder, hash_size), batch_names)):
+                hashes[batch] = batch_hashes
+                is_read[batch] = batch_is_read
+                hashed_amount += len(batch)
+                elapsed = time.perf_counter() - start_time
+                print(f"{images_folder}: {hashed_amount}/{len(stale_ids)} images hashed, "
+                      f"{hashed_amount / max(elapsed, 1e-6):.0f} images/s",
+                      end="\r" if hashed_amount < len(stale_ids) else "\n")
+
+        # images which were not read are not cached, so they are retried on the next run
+        cache = {"version": cfg.DEDUP_CACHE_VERSION, "hash_size": hash_size,
+                 "names": [image_names[image_id] for image_id in np.flatnonzero(is_read)],
+                 "stats": stats[is_read], "hashes": hashes[is_read]}
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(f"{cache_path}{cfg.TMP_FILE_SUFFIX}", "wb") as cache_file:
+                pickle.dump(cache, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{cache_path}{cfg.TMP_FILE_SUFFIX}", cache_path)
+        except OSError as e:
+            print(f"image hashes are not cached: {e}")
+    return hashes, is_read
+
+
+def hamming_distances(hashes: np.ndarray, other_hashes: np.ndarray) -> np.ndarray:
+    """Returns amount of different bits of every pair of hash rows"""
+    return BYTE_POPCOUNTS[hashes ^ other_hashes].sum(axis=1, dtype=np.int64)
+
+
+def _find_far_image(hashes: np.ndarray, image_id: int, end: int, max_distance: int) -> int:
+    """Returns the first image after image_id and before end whose hash differs from hash of image_id
+    in more than max_distance bits, end if there is no such image
+    """
+    block_start = image_id + 1
+    block_size = cfg.DEDUP_SCAN_BLOCK_SIZE
+    while block_start < end:
+        block_end = min(block_start + block_size, end)
+        far_ids = np.flatnonzero(hamming_distances(hashes[block_start:block_end], hashes[image_id]) > max_distance)
+        if len(far_ids):
+            return block_start + int(far_ids[0])
+        block_start = block_end
+        block_size *= 2
+    return end
+
+
+def find_duplicate_runs(hashes: np.ndarray, is_read: np.ndarray,
+                        max_distance: int = cfg.DEDUP_MAX_DISTANCE) -> np.ndarray:
+    """Returns id of run representative for every image
+
+    Run is a sequence of neighbouring images whose hashes differ from hash of its first image, the representative,
+    in at most max_distance bits. The first image far from the representative starts the next run.
+    Images which were not read are runs of their own.
+    """
+    # image which differs from the previous one in more than 2 * max_distance bits can not be in a run with it,
+    # both of them would be at most max_distance bits away from the representative
+    is_start = np.ones(len(hashes), dtype=bool)
+    is_start[1:] = ~(is_read[1:] & is_read[:-1]) | (hamming_distances(hashes[1:], hashes[:-1]) > 2 * max_distance)
+    segment_starts = np.flatnonzero(is_start).tolist()
+    for segment_start, segment_end in zip(segment_starts, segment_starts[1:] + [len(hashes)]):
+        # runs between these starts are found one after another
+        start = _find_far_image(hashes, segment_start, segment_end, max_distance)
+        while start < segment_end:
+            is_start[start] = True
+            start = _find_far_image(hashes, start, segment_end, max_distance)
+    return np.maximum.accumulate(np.where(is_start, np.arange(len(hashes)), 0))
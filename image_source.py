@@ -0,0 +1,184 @@
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Tuple, Union
+
+import cv2
+import numpy as np
+
+import config as cfg
+from utils import file_fingerprint
+
+
+# display scale -> imread flag decoding image directly at reduced size
+REDUCED_READ_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class FolderImageSource:
+    """Reads frames from image files named as coco file_name"""
+
+    # reads of different images are independent, so they may run in parallel
+    sequential = False
+
+    def __init__(self, images_folder: str, display_scale: int = cfg.DEFAULT_DISPLAY_SCALE):
+        self._images_folder: str = images_folder
+        self._read_flag: int = REDUCED_READ_FLAGS[display_scale]
+
+    def read(self, image_name: str) -> Union[np.ndarray, None]:
+        """Reads frame downscaled by display scale"""
+        return cv2.imread(os.path.join(self._images_folder, image_name), self._read_flag)
+
+    def read_full_resolution(self, image_name: str) -> Union[np.ndarray, None]:
+        return cv2.imread(os.path.join(self._images_folder, image_name))
+
+    def close(self):
+        pass
+
+
+class _VideoReader:
+    """Decodes frames of one video, reads forward without seeking when target frame is close ahead"""
+
+    def __init__(self, video_path: str, timestamps: np.ndarray):
+        self._capture = cv2.VideoCapture(video_path)
+        # presentation time of every frame in milliseconds
+        self._timestamps: np.ndarray = timestamps
+        # number of the frame capture returns next
+        self._position: int = 0
+        self.lock = threading.Lock()
+
+    def read(self, frame_number: int) -> Union[np.ndarray, None]:
+        if not 0 <= frame_number < len(self._timestamps):
+            return None
+        if frame_number < self._position or frame_number - self._position > cfg.VIDEO_MAX_GRAB_AHEAD:
+            # seek by timestamp, seeking by frame number assumes constant frame rate
+            self._capture.set(cv2.CAP_PROP_POS_MSEC, float(self._timestamps[frame_number]))
+            self._position = frame_number
+        while self._position < frame_number:
+            if not self._capture.grab():
+                return None
+            self._position += 1
+
+        ok, frame = self._capture.read()
+        if not ok:
+            # position is unknown after failed read, the next read seeks
+            self._position = len(self._timestamps)
+            return None
+        self._position += 1
+        return frame
+
+    def close(self):
+        self._capture.release()
+
+
+class VideoImageSource:
+    """Reads frames straight from videos, coco file_name is mapped to (video, frame number) by regex
+
+    Timestamps of all frames of a video are collected at the first open and saved next to videos, they are
+    used to seek exactly. Reads go forward without seeking, so frames must be requested in order.
+    """
+
+    sequential = True
+
+    def __init__(self, videos_folder: str, display_scale: int = cfg.DEFAULT_DISPLAY_SCALE,
+                 name_pattern: str = cfg.VIDEO_FRAME_NAME_PATTERN):
+        self._videos_folder: str = videos_folder
+        self._display_scale: int = display_scale
+        self._name_pattern = re.compile(name_pattern)
+        self._index_dir: str = os.path.join(videos_folder, cfg.CACHE_DIRECTORY_NAME, "video_index")
+        # video name without extension -> video path
+        self._video_paths: Dict[str, str] = dict()
+        with os.scandir(videos_folder) as entries:
+            for entry in entries:
+                video_name, ext = os.path.splitext(entry.name)
+                if entry.is_file() and ext.lower() in cfg.VIDEO_EXTENSIONS:
+                    self._video_paths[video_name] = entry.path
+        # video name -> reader, the least recently used reader is closed when too many videos are open
+        self._readers: "OrderedDict[str, _VideoReader]" = OrderedDict()
+        self._readers_lock = threading.Lock()
+
+    def locate(self, image_name: str) -> Union[Tuple[str, int], None]:
+        """Returns (video name, frame number) of coco file_name"""
+        match = self._name_pattern.fullmatch(image_name)
+        if match is None or match.group("video") not in self._video_paths:
+            return None
+        return match.group("video"), int(match.group("frame")) - cfg.VIDEO_FIRST_FRAME_NUMBER
+
+    def read(self, image_name: str) -> Union[np.ndarray, None]:
+        """Reads frame downscaled by display scale"""
+        frame = self.read_full_resolution(image_name)
+        if frame is None or self._display_scale == 1:
+            return frame
+        height, width = frame.shape[:2]
+        return cv2.resize(frame, (-(-width // self._display_scale), -(-height // self._display_scale)),
+                          interpolation=cv2.INTER_AREA)
+
+    def read_full_resolution(self, image_name: str) -> Union[np.ndarray, None]:
+        location = self.locate(image_name)
+        if location is None:
+            return None
+        video_name, frame_number = location
+        reader = self._get_reader(video_name)
+        with reader.lock:
+            return reader.read(frame_number)
+
+    def close(self):
+        with self._readers_lock:
+            for reader in self._readers.values():
+                with reader.lock:
+                    reader.close()
+            self._readers.clear()
+
+    def _get_reader(self, video_name: str) -> _VideoReader:
+        with self._readers_lock:
+            reader = self._readers.get(video_name)
+            if reader is not None:
+                self._readers.move_to_end(video_name)
+                return reader
+
+            video_path = self._video_paths[video_name]
+            reader = _VideoReader(video_path, self._load_timestamps(video_path))
+            self._readers[video_name] = reader
+            while len(self._readers) > cfg.VIDEO_MAX_OPEN_READERS:
+                _, closed_reader = self._readers.popitem(last=False)
+                with closed_reader.lock:
+                    closed_reader.close()
+            return reader
+
+    def _load_timestamps(self, video_path: str) -> np.ndarray:
+        """Loads frame timestamps of video from index, builds the index if video is opened for the first time"""
+        index_path = os.path.join(self._index_dir, f"{os.path.basename(video_path)}.pkl")
+        fingerprint = file_fingerprint(video_path)
+        try:
+            with open(index_path, "rb") as index_file:
+                index = pickle.load(index_file)
+            if index["version"] == cfg.VIDEO_INDEX_VERSION and index["fingerprint"] == fingerprint:
+                return index["timestamps"]
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+
+        start_time = time.perf_counter()
+        capture = cv2.VideoCapture(video_path)
+        timestamps = list()
+        while capture.grab():
+            timestamps.append(capture.get(cv2.CAP_PROP_POS_MSEC))
+        capture.release()
+        timestamps = np.array(timestamps, dtype=np.float64)
+        print(f"{video_path}: {len(timestamps)} frames indexed in {time.perf_counter() - start_time:.1f} s")
+
+        index = {"version": cfg.VIDEO_INDEX_VERSION, "fingerprint": fingerprint, "timestamps": timestamps}
+        try:
+            os.makedirs(self._index_dir, exist_ok=True)
+            with open(f"{index_path}{cfg.TMP_FILE_SUFFIX}", "wb") as index_file:
+                pickle.dump(index, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{index_path}{cfg.TMP_FILE_SUFFIX}", index_path)
+        except OSError as e:
+            print(f"video index is not saved: {e}")
+        return timestamps
@@ -0,0 +1,206 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import config as cfg
+from annotation_store import ColumnarBBoxStore
+from data_structures import BBox
+
+
+def _order_corners(boxes: np.ndarray) -> np.ndarray:
+    """Returns (x1, y1, x2, y2) rows with top left corner first, inverted bboxes are compared as drawn"""
+    return np.concatenate([np.minimum(boxes[:, :2], boxes[:, 2:]), np.maximum(boxes[:, :2], boxes[:, 2:])], axis=1)
+
+
+def _to_boxes(columns: Dict[str, np.ndarray]) -> np.ndarray:
+    return _order_corners(np.stack([columns[name] for name in ColumnarBBoxStore.COORDINATE_COLUMNS], axis=1)
+                          .astype(np.float64))
+
+
+def _bboxes_to_boxes(bboxes: List[BBox]) -> np.ndarray:
+    return _order_corners(np.array([[bbox.x1, bbox.y1, bbox.x2, bbox.y2] for bbox in bboxes],
+                                   dtype=np.float64).reshape(-1, 4))
+
+
+def box_ious(boxes: np.ndarray, other_boxes: np.ndarray) -> np.ndarray:
+    """Returns IoU of every pair of (x1, y1, x2, y2) rows"""
+    widths = np.clip(np.minimum(boxes[:, 2], other_boxes[:, 2]) - np.maximum(boxes[:, 0], other_boxes[:, 0]), 0, None)
+    heights = np.clip(np.minimum(boxes[:, 3], other_boxes[:, 3]) - np.maximum(boxes[:, 1], other_boxes[:, 1]), 0, None)
+    intersections = widths * heights
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    other_areas = (other_boxes[:, 2] - other_boxes[:, 0]) * (other_boxes[:, 3] - other_boxes[:, 1])
+    unions = areas + other_areas - intersections
+    return np.divide(intersections, unions, out=np.zeros_like(intersections), where=unions > 0)
+
+
+def match_bboxes(original_images: np.ndarray, original_boxes: np.ndarray,
+                 corrected_images: np.ndarray, corrected_boxes: np.ndarray,
+                 min_iou: float = cfg.DIFF_MATCH_IOU) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Greedily matches bboxes of the same image, returns rows of original and corrected bboxes and IoU of matches
+
+    Bboxes of both sides are sorted by image. Greedy matching takes pairs in order of decreasing IoU and keeps
+    pair whose bboxes are both free. It is done for all images at once as rounds which keep pairs that are the best
+    for both of their bboxes, the best pair of the rest is always kept, so the result is the same.
+    """
+    # pairs of every original bbox with all corrected bboxes of its image
+    starts = np.searchsorted(corrected_images, original_images, side="left")
+    counts = np.searchsorted(corrected_images, original_images, side="right") - starts
+    pair_original = np.repeat(np.arange(len(original_images)), counts)
+    pair_positions = np.arange(len(pair_original)) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_corrected = np.repeat(starts, counts) + pair_positions
+    pair_ious = box_ious(original_boxes[pair_original], corrected_boxes[pair_corrected])
+
+    is_candidate = pair_ious >= min_iou
+    pair_original, pair_corrected, pair_ious = (
+        pair_original[is_candidate], pair_corrected[is_candidate], pair_ious[is_candidate]
+    )
+    # stable sort keeps ties in pair order, so every bbox has one best pair
+    order = np.argsort(-pair_ious, kind="stable")
+    pair_original, pair_corrected, pair_ious = pair_original[order], pair_corrected[order], pair_ious[order]
+
+    matches = list()
+    while len(pair_original):
+        is_best = np.zeros(len(pair_original), dtype=bool)
+        is_best[np.unique(pair_original, return_index=True)[1]] = True
+        is_best_corrected = np.zeros(len(pair_original), dtype=bool)
+        is_best_corrected[np.unique(pair_corrected, return_index=True)[1]] = True
+        is_best &= is_best_corrected
+        matches.append((pair_original[is_best], pair_corrected[is_best], pair_ious[is_best]))
+
+        is_original_free = np.ones(len(original_images), dtype=bool)
+        is_original_free[pair_original[is_best]] = False
+        is_corrected_free = np.ones(len(corrected_images), dtype=bool)
+        is_corrected_free[pair_corrected[is_best]] = False
+        is_free = is_original_free[pair_original] & is_corrected_free[pair_corrected]
+        pair_original, pair_corrected, pair_ious = pair_original[is_free], pair_corrected[is_free], pair_ious[is_free]
+
+    if not matches:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+    return tuple(np.concatenate(parts) for parts in zip(*matches))
+
+
+def _count_changes(original: Dict[str, np.ndarray], corrected: Dict[str, np.ndarray], image_ids: np.ndarray,
+                   min_iou: float, moved_iou: float) -> np.ndarray:
+    """Returns (images, CHANGE_TYPES) counts of changes of bboxes of image_ids"""
+    matched_original, matched_corrected, ious = match_bboxes(
+        original["image_index"], _to_boxes(original), corrected["image_index"], _to_boxes(corrected), min_iou
+    )
+    is_original_matched = np.zeros(len(original["image_index"]), dtype=bool)
+    is_original_matched[matched_original] = True
+    is_corrected_matched = np.zeros(len(corrected["image_index"]), dtype=bool)
+    is_corrected_matched[matched_corrected] = True
+    matched_images = corrected["image_index"][matched_corrected]
+    is_relabeled = original["category_id"][matched_original] != corrected["category_id"][matched_corrected]
+
+    changed_images = {
+        cfg.ChangeType.ADDED: corrected["image_index"][~is_corrected_matched],
+        cfg.ChangeType.REMOVED: original["image_index"][~is_original_matched],
+        cfg.ChangeType.RELABELED: matched_images[is_relabeled],
+        cfg.ChangeType.MOVED: matched_images[ious < moved_iou],
+    }
+    counts = np.zeros((len(image_ids), len(cfg.CHANGE_TYPES)), dtype=np.int32)
+    for i, change_type in enumerate(cfg.CHANGE_TYPES):
+        np.add.at(counts[:, i], np.searchsorted(image_ids, changed_images[change_type]), 1)
+    return counts
+
+
+class LabelDiff:
+    """Change counts of labeled images whose bboxes differ from original coco bboxes"""
+
+    def __init__(self, image_ids: np.ndarray, counts: np.ndarray, compared_amount: int):
+        # sorted ids of changed images and their (images, CHANGE_TYPES) counts of changed bboxes
+        self.image_ids: np.ndarray = image_ids
+        self.counts: np.ndarray = counts
+        self.compared_amount: int = compared_amount
+
+    def __len__(self):
+        return len(self.image_ids)
+
+    def get_changed_mask(self, images_amount: int) -> np.ndarray:
+        is_changed = np.zeros(images_amount, dtype=bool)
+        is_changed[self.image_ids] = True
+        return is_changed
+
+    def get_changes(self, image_id: int) -> Dict[str, int]:
+        """Returns change type -> amount of changed bboxes of image"""
+        position = int(np.searchsorted(self.image_ids, image_id))
+        if position == len(self.image_ids) or self.image_ids[position] != image_id:
+            return {change_type: 0 for change_type in cfg.CHANGE_TYPES}
+        return dict(zip(cfg.CHANGE_TYPES, self.counts[position].tolist()))
+
+    def get_totals(self) -> Dict[str, int]:
+        return dict(zip(cfg.CHANGE_TYPES, self.counts.sum(axis=0, dtype=np.int64).tolist()))
+
+
+def compute_label_diff(original: Dict[str, np.ndarray], corrected: Dict[str, np.ndarray], image_ids: np.ndarray,
+                       workers: int = None, min_iou: float = cfg.DIFF_MATCH_IOU,
+                       moved_iou: float = cfg.DIFF_MOVED_IOU) -> LabelDiff:
+    """Compares original and corrected bboxes of image_ids in process pool
+
+    Both are numpy columns sorted by image index, image_ids are sorted ids of compared images, corrected image
+    without bboxes has all its original bboxes removed. Matched bboxes with IoU below moved_iou are moved.
+    """
+    if not len(image_ids):
+        return LabelDiff(image_ids, np.zeros((0, len(cfg.CHANGE_TYPES)), dtype=np.int32), 0)
+    # only bboxes of compared images are sent to workers
+    original_images = np.asarray(original["image_index"])
+    is_compared = image_ids[np.searchsorted(image_ids, original_images).clip(max=len(image_ids) - 1)] == original_images
+    original = {name: np.asarray(original[name])[is_compared] for name in ColumnarBBoxStore.COLUMNS}
+
+    batches = list()
+    for batch_start in range(0, len(image_ids), cfg.DIFF_BATCH_SIZE):
+        batch_ids = image_ids[batch_start:batch_start + cfg.DIFF_BATCH_SIZE]
+        first_id, last_id = batch_ids[0], batch_ids[-1]
+        batch = list()
+        for columns in (original, corrected):
+            start, end = np.searchsorted(columns["image_index"], [first_id, last_id + 1])
+            batch.append({name: column[start:end] for name, column in columns.items()})
+        batches.append((*batch, batch_ids))
+
+    start_time = time.perf_counter()
+    counts = np.zeros((len(image_ids), len(cfg.CHANGE_TYPES)), dtype=np.int32)
+    compared_amount = 0
+    # spawned workers do not inherit locks held by background writer thread
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        count_changes = partial(_count_changes, min_iou=min_iou, moved_iou=moved_iou)
+        for batch_counts in executor.map(count_changes, *zip(*batches)):
+            counts[compared_amount:compared_amount + len(batch_counts)] = batch_counts
+            compared_amount += len(batch_counts)
+            elapsed = time.perf_counter() - start_time
+            print(f"{compared_amount}/{len(image_ids)} labeled images compared, "
+                  f"{compared_amount / max(elapsed, 1e-6):.0f} images/s",
+                  end="\r" if compared_amount < len(image_ids) else "\n")
+
+    is_changed = counts.any(axis=1)
+    return LabelDiff(image_ids[is_changed], counts[is_changed], len(image_ids))
+
+
+def diff_image_bboxes(original_bboxes: List[BBox], corrected_bboxes: List[BBox],
+                      min_iou: float = cfg.DIFF_MATCH_IOU,
+                      moved_iou: float = cfg.DIFF_MOVED_IOU) -> List[Tuple[BBox, str]]:
+    """Returns changed bboxes of one image with change type, drawn over image in review
+
+    Added bboxes are corrected ones, removed, relabeled and moved bboxes are original ones, so reviewer sees
+    where they were before correction. Bbox which is both relabeled and moved is shown as relabeled.
+    """
+    matched_original, matched_corrected, ious = match_bboxes(
+        np.zeros(len(original_bboxes), dtype=np.int64), _bboxes_to_boxes(original_bboxes),
+        np.zeros(len(corrected_bboxes), dtype=np.int64), _bboxes_to_boxes(corrected_bboxes), min_iou
+    )
+
+    changes = list()
+    for i, j, iou in zip(matched_original.tolist(), matched_corrected.tolist(), ious.tolist()):
+        if original_bboxes[i].label != corrected_bboxes[j].label:
+            changes.append((original_bboxes[i], cfg.ChangeType.RELABELED))
+        elif iou < moved_iou:
+            changes.append((original_bboxes[i], cfg.ChangeType.MOVED))
+    matched_original, matched_corrected = set(matched_original.tolist()), set(matched_corrected.tolist())
+    changes.extend((bbox, cfg.ChangeType.REMOVED)
+                   for i, bbox in enumerate(original_bboxes) if i not in matched_original)
+    changes.extend((bbox, cfg.ChangeType.ADDED)
+                   for j, bbox in enumerate(corrected_bboxes) if j not in matched_corrected)
+    return changes
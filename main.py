@@ -1,111 +1,461 @@
 import argparse
-import json
 import os
+import signal
 import sys
-from copy import deepcopy
+import time
+from typing import Union, List, Tuple
 
-from typing import Union, List, Dict
-
-import cv2
 import numpy as np
 
 import config as cfg
-from data_structures import BBox, Point
-from utils import Canvas, AnnotationStorage
+from annotation_journal import AnnotationJournal
+from background_writer import BackgroundWriter, atomic_write_json
+from box_propagation import BoxPropagator
+from coco_export import export_coco
+from data_structures import BBox
+from dataset_validation import print_report, save_report, validate_dataset
+from frame_cache import ImagePrefetcher
+from frame_dedup import compute_image_hashes, find_duplicate_runs
+from image_source import FolderImageSource, VideoImageSource
+from label_diff import LabelDiff, compute_label_diff, diff_image_bboxes
+from sharding import ShardCoordinator, get_live_workers, get_shard_status, print_shard_status
+from tracing import NullTracer, Tracer
+from utils import Canvas, AnnotationStorage, get_current_rss_mb, get_peak_rss_mb
+from window import HeadlessWindow, OpenCVWindow
+
+
+# key code -> name of hotkey, used in latency traces
+HOTKEY_NAMES = {key: name for name, key in vars(cfg.HotKey).items() if not name.startswith("_")}
+
+
+def get_key_name(key: int) -> str:
+    if key in HOTKEY_NAMES:
+        return HOTKEY_NAMES[key]
+    return chr(key) if 32 < key < 127 else str(key)
 
 
 class LabelingTool:
     """Connects user with canvas"""
 
-    def __init__(self, annotation_path: str, output_folder: str, image_folder: str, start_frame_id: str=None):
-        self._images_folder: str = image_folder
+    def __init__(self, annotation_path: str, output_folder: str, image_folder: str, start_frame_id: str=None,
+                 cache_mb: int = cfg.FRAME_CACHE_BUDGET_MB, prefetch_amount: int = cfg.PREFETCH_FRAMES_AMOUNT,
+                 display_scale: int = cfg.DEFAULT_DISPLAY_SCALE, mmap_annotations: bool = False,
+                 output_format: str = cfg.OutputFormat.FILES, merge_workers: int = cfg.MERGE_WORKERS,
+                 window: Union[OpenCVWindow, HeadlessWindow] = None, trace_path: str = None,
+                 start_frame_name: str = None, videos_folder: str = None, propagate: bool = False,
+                 dedup: bool = False, shard_worker: str = None, shard_batch_size: int = cfg.SHARD_BATCH_SIZE,
+                 window_size: int = None, rss_budget_mb: int = None, review_diff: bool = False):
+        start_time = time.perf_counter()
+        self._window: Union[OpenCVWindow, HeadlessWindow] = window if window is not None else OpenCVWindow()
+        # latency of keys is traced only when trace is requested, disabled tracer does nothing
+        self._trace_path: Union[str, None] = trace_path
+        self._tracer: Union[Tracer, NullTracer] = Tracer() if trace_path else NullTracer()
+        self._display_scale: int = display_scale
+        # frames are read from video files if videos folder is set, otherwise from image files
+        self._image_source: Union[FolderImageSource, VideoImageSource] = (
+            VideoImageSource(videos_folder, display_scale) if videos_folder is not None
+            else FolderImageSource(image_folder, display_scale)
+        )
+        self._output_folder: str = output_folder
+        # all writes to disk are done in background, so keypresses never wait on disk
+        self._writer: BackgroundWriter = BackgroundWriter(tracer=self._tracer)
+        self._journal: Union[AnnotationJournal, None] = (
+            AnnotationJournal(output_folder, shard_worker) if output_format == cfg.OutputFormat.JOURNAL else None
+        )
         self._dir_skipped = os.path.join(output_folder, cfg.DIRECTORY_FOR_SKIPPED_NAME)
         self._dir_labeled = os.path.join(output_folder, cfg.DIRECTORY_FOR_LABELED_NAME)
         self._create_directories()
-        self._canvas: Canvas = Canvas()
+        self._canvas: Canvas = Canvas(window=self._window, tracer=self._tracer)
         self._annotations: AnnotationStorage = AnnotationStorage(annotation_path,
                                                                  output_folder,
                                                                  image_folder,
-                                                                 start_frame_id)
+                                                                 start_frame_id,
+                                                                 mmap_annotations,
+                                                                 self._journal,
+                                                                 merge_workers,
+                                                                 self._writer,
+                                                                 start_frame_name,
+                                                                 self._get_variables_file_name(shard_worker),
+                                                                 window_size)
+        # memory which can be read back from disk is freed when RSS of process exceeds budget
+        self._rss_budget_mb: Union[int, None] = rss_budget_mb
+        self._rss_budget_exceeded: bool = False
+        if rss_budget_mb is not None:
+            cache_mb = self._get_frame_cache_budget_mb(cache_mb)
+        # labeled images whose bboxes differ from coco ones, navigation is limited to them in review
+        self._label_diff: Union[LabelDiff, None] = None
+        if review_diff and shard_worker is not None:
+            print("review of changes is not available for shard workers")
+        elif review_diff:
+            self._label_diff = self._compute_label_diff()
+        # image id -> id of the first image of its run of near identical images, runs are collapsed in navigation
+        self._duplicate_runs: Union[np.ndarray, None] = None
+        if dedup and videos_folder is not None:
+            print("near identical frames are collapsed only for images folder")
+        elif dedup and self._label_diff is not None:
+            # saving collapsed run would overwrite reviewed annotations of other images
+            print("near identical frames are not collapsed in review of changes")
+        elif dedup:
+            self._duplicate_runs = self._find_duplicate_runs(image_folder)
+        self._prefetcher: ImagePrefetcher = ImagePrefetcher(self._image_source,
+                                                            self._annotations.get_image_name_by_id,
+                                                            self._annotations.images_amount,
+                                                            cache_mb,
+                                                            prefetch_amount,
+                                                            tracer=self._tracer,
+                                                            get_next_image_id=self._annotations.get_next_image_id)
+        # saved bboxes are carried to the next frames in background and offered instead of coco bboxes
+        self._propagator: Union[BoxPropagator, None] = (
+            BoxPropagator(self._prefetcher.get, self._annotations.images_amount, display_scale,
+                          get_next_image_id=self._annotations.get_next_image_id) if propagate else None
+        )
+        self._show_original_bboxes: bool = False
+        # processes sharing output folder label separate batches of images claimed with leases
+        self._shards: Union[ShardCoordinator, None] = None
+        if shard_worker is not None:
+            self._shards = ShardCoordinator(output_folder, shard_worker, self._annotations.images_amount,
+                                            shard_batch_size)
+            if not self._claim_batch():
+                print("all batches are done or leased by other workers")
+                self._quit()
+        else:
+            self._update_navigation_filter()
+        if self._label_diff is not None:
+            self._open_changed_image()
+        # direction of the last navigation, used to prefetch images ahead
+        self._direction: bool = True
         self._running: bool = True
+        # set by signal handler, the tool quits from event loop, so handler never interrupts a save
+        self._quit_requested: bool = False
+        signal.signal(signal.SIGINT, self._on_signal)
+        signal.signal(signal.SIGTERM, self._on_signal)
         self._reload_canvas()
+        print(f"time to first frame: {time.perf_counter() - start_time:.2f} s")
+        self._enforce_rss_budget()
+        peak_rss_mb = get_peak_rss_mb()
+        if peak_rss_mb is not None:
+            print(f"peak RSS: {peak_rss_mb:.0f} MB")
         self._run_event_loop()
 
     def _run_event_loop(self):
-        while self._running:
-            k = cv2.waitKey()
-            if k == cfg.HotKey.SetDrawMode:
-                print("draw bbox")
-                self._canvas.draw_bbox()
-            elif k == cfg.HotKey.SetDeletionMode:
-                self._canvas.set_mode(cfg.LabelingMode.DELETION)
-                print("delete mode is set")
-            elif k == cfg.HotKey.SetModeChangeName:
-                self._canvas.set_mode(cfg.LabelingMode.SET_LABEL)
-                print("name changing mode is set")
-            elif k == cfg.HotKey.MarkSkipped:
-                self._mark_as_skiped()
-            elif k == cfg.HotKey.UndoLabeling:
-                self._undo_changes()
-            elif k == cfg.HotKey.SaveAndOpenNext:
-                self._save_and_open_next()
-            elif k == cfg.HotKey.OpenNext:
-                self._iterate(True, 1)
-            elif k == cfg.HotKey.OpenPrevious:
-                self._iterate(False, 1)
-            elif k == cfg.HotKey.Quit:
-                self._quit()
+        # writes queued in background are flushed even if the loop fails, closing twice after quit is harmless
+        try:
+            while self._running:
+                k = self._window.wait_key()
+                if self._quit_requested:
+                    self._quit()
+                if k == cfg.NO_KEY:
+                    continue
+                self._tracer.begin_key(get_key_name(k))
+                # lease is checked before key is handled, so image of batch taken over by another worker is not saved
+                if self._shards is not None and not self._shards.renew():
+                    print("lease of batch was taken over by another worker, key is ignored")
+                    self._open_next_batch()
+                    self._tracer.end_key()
+                    continue
+                if k == cfg.HotKey.SetDrawMode:
+                    print("draw bbox")
+                    self._canvas.draw_bbox()
+                elif k == cfg.HotKey.SetDeletionMode:
+                    self._canvas.set_mode(cfg.LabelingMode.DELETION)
+                    print("delete mode is set")
+                elif k == cfg.HotKey.SetModeChangeName:
+                    self._canvas.set_mode(cfg.LabelingMode.SET_LABEL)
+                    print("name changing mode is set")
+                elif k == cfg.HotKey.MarkSkipped:
+                    self._mark_as_skiped()
+                elif k == cfg.HotKey.UndoLabeling:
+                    self._canvas.undo()
+                elif k == cfg.HotKey.RedoLabeling:
+                    self._canvas.redo()
+                elif k == cfg.HotKey.ResetLabeling:
+                    self._reset_changes()
+                elif k == cfg.HotKey.SaveAndOpenNext:
+                    self._save_and_open_next()
+                elif k == cfg.HotKey.OpenNext:
+                    self._iterate(True, 1)
+                elif k == cfg.HotKey.OpenPrevious:
+                    self._iterate(False, 1)
+                elif k == cfg.HotKey.OpenNextUntouched:
+                    self._open_untouched(True)
+                elif k == cfg.HotKey.OpenPreviousUntouched:
+                    self._open_untouched(False)
+                elif k == cfg.HotKey.OpenNextWithClass:
+                    self._open_with_selected_class(True)
+                elif k == cfg.HotKey.OpenPreviousWithClass:
+                    self._open_with_selected_class(False)
+                elif k == cfg.HotKey.ZoomIn:
+                    self._canvas.zoom(cfg.ZOOM_STEP)
+                elif k == cfg.HotKey.ZoomOut:
+                    self._canvas.zoom(1 / cfg.ZOOM_STEP)
+                elif k == cfg.HotKey.ResetView:
+                    self._canvas.reset_view()
+                elif k == cfg.HotKey.ToggleOriginalBBoxes:
+                    self._toggle_original_bboxes()
+                elif k == cfg.HotKey.Quit:
+                    self._quit()
+
+                self._enforce_rss_budget()
+
+                if self._canvas.state == cfg.CanvasState.NORMAL:
+                    for key, class_label in cfg.ClassHotKeys.items():
+                        if k == key:
+                            print(f"selected class {class_label}")
+                            self._update_canvas_label(class_label)
+
+                elif self._canvas.state == cfg.CanvasState.ASK_BBOX_INDEX:
+                    for key, number_value in cfg.NumberHotKeys.items():
+                        if k == key:
+                            print(f"selected bbox id {number_value}")
+                            self._canvas.specify_bbox(number_value)
+                self._tracer.end_key()
+        finally:
+            if self._shards is not None:
+                self._shards.release()
+            self._writer.close()
+            if self._journal is not None:
+                self._journal.close()
 
-            if self._canvas.state == cfg.CanvasState.NORMAL:
-                for key, class_label in cfg.ClassHotKeys.items():
-                    if k == key:
-                        print(f"selected class {class_label}")
-                        self._update_canvas_label(class_label)
+    @staticmethod
+    def _get_variables_file_name(shard_worker: Union[str, None]) -> str:
+        """Every worker sharing dataset keeps its own last frame id"""
+        if shard_worker is None:
+            return cfg.VARIABLES_FILE_NAME
+        variables_name, ext = os.path.splitext(cfg.VARIABLES_FILE_NAME)
+        return f"{variables_name}_{shard_worker}{ext}"
 
-            elif self._canvas.state == cfg.CanvasState.ASK_BBOX_INDEX:
-                for key, number_value in cfg.NumberHotKeys.items():
-                    if k == key:
-                        print(f"selected bbox id {number_value}")
-                        self._canvas.specify_bbox(number_value)
+    def _find_duplicate_runs(self, image_folder: str) -> np.ndarray:
+        start_time = time.perf_counter()
+        hashes, is_read = compute_image_hashes(image_folder, self._annotations.get_sorted_images_names())
+        duplicate_runs = find_duplicate_runs(hashes, is_read)
+        collapsed_amount = int(np.count_nonzero(duplicate_runs != np.arange(len(duplicate_runs))))
+        print(f"{collapsed_amount} near identical images collapsed in {time.perf_counter() - start_time:.2f} s")
+        return duplicate_runs
+
+    def _compute_label_diff(self) -> Union[LabelDiff, None]:
+        start_time = time.perf_counter()
+        labeled_image_ids = self._annotations.get_labeled_image_ids()
+        label_diff = compute_label_diff(self._annotations.get_coco_bboxes_columns(),
+                                        self._annotations.get_edited_bboxes_columns(labeled_image_ids),
+                                        labeled_image_ids)
+        totals = ", ".join(f"{change_type} {amount}" for change_type, amount in label_diff.get_totals().items())
+        print(f"{len(label_diff)} of {label_diff.compared_amount} labeled images changed "
+              f"in {time.perf_counter() - start_time:.2f} s, bboxes {totals}")
+        if not len(label_diff):
+            print("no changed images to review, all images are shown")
+            return None
+        return label_diff
+
+    def _open_changed_image(self):
+        """Opens the nearest changed image after current one, the first changed image if there is none"""
+        image_id = self._annotations.current_image_id
+        position = int(np.searchsorted(self._label_diff.image_ids, image_id))
+        if position == len(self._label_diff):
+            position = 0
+        self._annotations.set_current_image_id(int(self._label_diff.image_ids[position]))
+
+    def _update_navigation_filter(self):
+        """Limits next and previous navigation to the first images of duplicate runs, to claimed batch
+        and to changed images in review
+        """
+        if self._duplicate_runs is None and self._shards is None and self._label_diff is None:
+            return
+        images_amount = self._annotations.images_amount
+        if self._label_diff is not None:
+            is_visible = self._label_diff.get_changed_mask(images_amount)
+        elif self._duplicate_runs is not None:
+            is_visible = self._duplicate_runs == np.arange(images_amount)
+        else:
+            is_visible = np.ones(images_amount, dtype=bool)
+        if self._shards is not None:
+            batch_image_ids = self._shards.get_batch_image_ids(self._shards.batch)
+            is_in_batch = np.zeros(images_amount, dtype=bool)
+            is_in_batch[batch_image_ids.start:batch_image_ids.stop] = True
+            # run continued from the previous batch starts again in this batch
+            is_visible[batch_image_ids.start] = True
+            is_visible &= is_in_batch
+        self._annotations.set_navigation_filter(is_visible)
+
+    def _get_collapsed_image_ids(self, image_id: int) -> List[int]:
+        """Returns ids of images of the same run after image, they are saved with the same annotation"""
+        if self._duplicate_runs is None:
+            return list()
+        run_end = int(np.searchsorted(self._duplicate_runs, self._duplicate_runs[image_id], side="right"))
+        if self._shards is not None:
+            # images of other batches may be labeled by other workers
+            run_end = min(run_end, self._shards.get_batch_image_ids(self._shards.batch).stop)
+        return list(range(image_id + 1, run_end))
+
+    def _get_frame_cache_budget_mb(self, cache_mb: int) -> int:
+        """Limits frames cache to a part of memory left under RSS budget after annotations are loaded"""
+        rss_mb = get_current_rss_mb()
+        if rss_mb is None:
+            print("RSS budget is not enforced, RSS of process can not be read on this platform")
+            self._rss_budget_mb = None
+            return cache_mb
+        if rss_mb > self._rss_budget_mb:
+            print(f"annotations take {rss_mb:.0f} MB, more than RSS budget of {self._rss_budget_mb} MB")
+        available_mb = int((self._rss_budget_mb - rss_mb) * cfg.RSS_BUDGET_FRAME_CACHE_SHARE)
+        if available_mb < cache_mb:
+            cache_mb = max(available_mb, 0)
+            print(f"frames cache is limited to {cache_mb} MB by RSS budget")
+        return cache_mb
+
+    def _enforce_rss_budget(self):
+        """Shrinks frames cache and drops annotations which are read back from disk when RSS exceeds budget"""
+        if self._rss_budget_mb is None:
+            return
+        rss_mb = get_current_rss_mb()
+        if rss_mb is None or rss_mb <= self._rss_budget_mb:
+            return
+        with self._tracer.span("enforce rss budget"):
+            cache = self._prefetcher.cache
+            excess_bytes = int((rss_mb - self._rss_budget_mb) * 2 ** 20)
+            budget_bytes = max(cache.size_bytes - excess_bytes, 0)
+            if budget_bytes < cache.budget_bytes:
+                cache.set_budget(budget_bytes)
+                print(f"frames cache is limited to {budget_bytes // 2 ** 20} MB by RSS budget")
+            self._annotations.release_memory()
+            if self._propagator is not None:
+                self._propagator.release_memory()
+            rss_mb = get_current_rss_mb()
+        if rss_mb > self._rss_budget_mb and not self._rss_budget_exceeded:
+            print(f"RSS of {rss_mb:.0f} MB stays over budget of {self._rss_budget_mb} MB after memory is freed")
+        self._rss_budget_exceeded = rss_mb > self._rss_budget_mb
+
+    def _claim_batch(self) -> bool:
+        """Claims the next batch of images and sets its first untouched image as current one"""
+        while True:
+            batch = self._shards.claim()
+            if batch is None:
+                return False
+            batch_image_ids = self._shards.get_batch_image_ids(batch)
+            # worker which held lease of batch before may have saved some of its images
+            self._annotations.reload_saved_annotations(batch_image_ids)
+            untouched_ids = self._get_untouched_batch_image_ids()
+            if untouched_ids:
+                break
+            self._shards.finish()
+
+        self._update_navigation_filter()
+        self._annotations.set_current_image_id(untouched_ids[0])
+        print(f"batch {batch} claimed, images {batch_image_ids.start}-{batch_image_ids.stop - 1}, "
+              f"{len(untouched_ids)} untouched")
+        return True
+
+    def _get_untouched_batch_image_ids(self) -> List[int]:
+        return [image_id for image_id in self._shards.get_batch_image_ids(self._shards.batch)
+                if self._annotations.get_image_status(image_id) is None]
+
+    def _open_next_batch(self):
+        if not self._claim_batch():
+            print("all batches are done or leased by other workers")
+            self._quit()
+        self._show_original_bboxes = False
+        self._reload_canvas()
 
     def _create_directories(self):
-        if not os.path.exists(self._dir_skipped):
-            os.makedirs(self._dir_skipped)
-        if not os.path.exists(self._dir_labeled):
-            os.makedirs(self._dir_labeled)
+        # other workers sharing output folder may create them at the same time
+        os.makedirs(self._dir_skipped, exist_ok=True)
+        os.makedirs(self._dir_labeled, exist_ok=True)
 
     def _update_canvas_label(self, class_label: cfg.ClassLabel):
         self._canvas.set_class_label(class_label)
 
     def _save_and_open_next(self):
-        self._save(self._dir_labeled)
+        self._save(cfg.DIRECTORY_FOR_LABELED_NAME)
         img_name = self._annotations.current_image_name
         img_id = self._annotations.current_image_id
         print(f"image id: {img_id}, image name: {img_name} annotation saved in labeled folder")
+        if self._propagator is not None:
+            self._propagator.submit(img_id, self._canvas.bboxes)
 
-        self._iterate(True, 1)
+        self._open_next()
 
     def _mark_as_skiped(self):
-        self._save(self._dir_skipped)
+        self._save(cfg.DIRECTORY_FOR_SKIPPED_NAME)
         img_name = self._annotations.current_image_name
         img_id = self._annotations.current_image_id
         print(f"image id: {img_id}, image name: {img_name} annotation saved in skipped folder")
 
-        self._iterate(True, 1)
+        self._open_next()
+
+    def _open_next(self):
+        """Opens next image after save, in shard mode the first untouched image of batch after its last image
+        and the next batch when all images of batch are saved
+        """
+        if self._shards is None:
+            self._iterate(True, 1)
+            return
+        untouched_ids = self._get_untouched_batch_image_ids()
+        if not untouched_ids:
+            batch = self._shards.batch
+            if self._shards.finish():
+                print(f"batch {batch} done")
+            else:
+                print(f"lease of batch {batch} was taken over by another worker, it is not marked as done")
+            self._open_next_batch()
+        elif self._annotations.get_next_image_id(self._annotations.current_image_id, True) is None:
+            self._jump(untouched_ids[0], True)
+        else:
+            self._iterate(True, 1)
 
-    def _undo_changes(self):
+    def _reset_changes(self):
         self._set_current_bboxes_to_canvas()
         self._reload_canvas()
         print("changes reverted")
 
     def _set_current_bboxes_to_canvas(self):
-        self._canvas.set_bboxes(self._annotations.current_bboxes)
+        propagated = self._get_propagated_bboxes()
+        with self._tracer.span("set bboxes"):
+            if propagated is not None and not self._show_original_bboxes:
+                self._canvas.set_bboxes(propagated[1])
+            else:
+                self._canvas.set_bboxes(self._annotations.current_bboxes)
+        if self._label_diff is not None:
+            self._set_current_changes_to_canvas()
+        if propagated is not None:
+            shown = ("original bboxes" if self._show_original_bboxes
+                     else f"bboxes propagated from image id {propagated[0]}")
+            print(f"{shown} are shown, press {chr(cfg.HotKey.ToggleOriginalBBoxes)} to switch")
+
+    def _set_current_changes_to_canvas(self):
+        """Shows differences between coco bboxes and saved bboxes of current image"""
+        img_id = self._annotations.current_image_id
+        if not self._annotations.is_edited(img_id):
+            return
+        changes = diff_image_bboxes(self._annotations.get_coco_bboxes_by_image_id(img_id),
+                                    self._annotations.get_bboxes_by_image_id(img_id))
+        self._canvas.set_changes(changes)
+        amounts = {change_type: 0 for change_type in cfg.CHANGE_TYPES}
+        for _, change_type in changes:
+            amounts[change_type] += 1
+        print("changes: " + ", ".join(f"{change_type} {amount}" for change_type, amount in amounts.items()))
+
+    def _get_propagated_bboxes(self) -> Union[Tuple[int, List[BBox]], None]:
+        """Returns (source image id, bboxes) propagated to current image if it is not saved yet"""
+        img_id = self._annotations.current_image_id
+        if self._propagator is None or self._annotations.is_edited(img_id):
+            return None
+        return self._propagator.get(img_id)
+
+    def _toggle_original_bboxes(self):
+        """Switches canvas between propagated and original bboxes, changes of shown bboxes are reverted"""
+        if self._get_propagated_bboxes() is None:
+            print("no propagated bboxes for current image")
+            return
+        self._show_original_bboxes = not self._show_original_bboxes
+        self._set_current_bboxes_to_canvas()
+        self._canvas.refresh()
 
     def _set_current_image_to_canvas(self):
+        img_id = self._annotations.current_image_id
+        with self._tracer.span("get image"):
+            img = self._prefetcher.get(img_id)
         img_name = self._annotations.current_image_name
-        img_path = os.path.join(self._images_folder, img_name)
-        img = cv2.imread(img_path)
-        self._canvas.set_image(img)
+        self._canvas.set_image(img, self._display_scale, lambda: self._image_source.read_full_resolution(img_name))
+        with self._tracer.span("schedule prefetch"):
+            self._prefetcher.prefetch(img_id, self._direction)
 
     def _reload_canvas(self):
         self._set_current_bboxes_to_canvas()
@@ -116,32 +466,189 @@ class LabelingTool:
         print(f"image id: {img_id}, image name: {img_name} opened")
 
     def _iterate(self, direction: bool, step: int):
-        self._annotations.change_current_image_id(direction, step)
+        self._direction = direction
+        self._show_original_bboxes = False
+        with self._tracer.span("change image id"):
+            self._annotations.change_current_image_id(direction, step)
         self._reload_canvas()
 
-    def _save(self, dir_path: str):
-        json_bboxes = self._canvas.get_bboxes_json()
-        img_name = self._annotations.current_image_name
-        base_img_name, ext = os.path.splitext(img_name)
-        output_ann_path = os.path.join(dir_path, f"{base_img_name}.txt")
-        with open(output_ann_path, "w") as output_file:
-            json.dump(json_bboxes, output_file)
+    def _open_untouched(self, direction: bool):
+        image_id = self._annotations.find_untouched_image_id(direction)
+        if image_id is None:
+            print(f"no untouched images {'after' if direction else 'before'} current one")
+            return
+        self._jump(image_id, direction)
+        print(f"{self._annotations.get_untouched_amount()} untouched images left")
+
+    def _open_with_selected_class(self, direction: bool):
+        class_label = self._canvas.selected_class_label
+        image_id = self._annotations.find_image_id_with_class(class_label, direction)
+        if image_id is None:
+            print(f"no images with {class_label} {'after' if direction else 'before'} current one")
+            return
+        self._jump(image_id, direction)
+
+    def _jump(self, image_id: int, direction: bool):
+        if self._shards is not None and self._shards.get_batch(image_id) != self._shards.batch:
+            print(f"image id {image_id} is out of claimed batch")
+            return
+        self._direction = direction
+        self._show_original_bboxes = False
+        with self._tracer.span("change image id"):
+            self._annotations.set_current_image_id(image_id)
+        self._reload_canvas()
+
+    def _save(self, status: str):
+        """Saves annotation to status directory or appends it to journal
 
-        # also save bboxes to annotations
-        self._annotations.update_current_image_bboxes(self._canvas.bboxes)
+        Images collapsed into current one are saved with the same annotation in one write.
+        """
+        with self._tracer.span("save"):
+            json_bboxes = self._canvas.get_bboxes_json()
+            img_id = self._annotations.current_image_id
+            image_ids = [img_id] + self._get_collapsed_image_ids(img_id)
+            img_names = [self._annotations.get_image_name_by_id(image_id) for image_id in image_ids]
+            if self._journal is not None:
+                records = [(img_name, status, json_bboxes) for img_name in img_names]
+                self._writer.submit_ordered(lambda: self._journal.append_records(records))
+            else:
+                output_ann_paths = list()
+                for img_name in img_names:
+                    base_img_name, ext = os.path.splitext(img_name)
+                    output_ann_paths.append(os.path.join(self._output_folder, status, f"{base_img_name}.txt"))
+                if len(output_ann_paths) == 1:
+                    self._writer.write_json(output_ann_paths[0], json_bboxes)
+                else:
+                    self._writer.submit(("run", status, img_id), lambda: [
+                        atomic_write_json(output_ann_path, json_bboxes) for output_ann_path in output_ann_paths
+                    ])
+
+            # also save bboxes to annotations
+            self._annotations.update_images_bboxes(image_ids, self._canvas.bboxes, status)
+        if len(image_ids) > 1:
+            print(f"annotation also saved for {len(image_ids) - 1} near identical images")
+
+    def _on_signal(self, signum, frame):
+        print(f"signal {signum} received")
+        self._quit_requested = True
 
     def _quit(self):
-        cv2.destroyAllWindows()
+        self._window.close()
+        if self._shards is not None:
+            self._shards.release()
+        if self._propagator is not None:
+            self._propagator.shutdown()
+        self._prefetcher.shutdown()
+        self._image_source.close()
+        # wait for pending writes
+        self._writer.close()
+        if self._journal is not None:
+            self._journal.close()
+        print(f"frame cache: {self._prefetcher.cache.stats()}")
+        print(f"writer: {self._writer.stats()}")
+        print(f"annotations: {self._annotations.get_memory_stats()}")
+        self._annotations.close()
+        if self._tracer.enabled:
+            self._tracer.print_stats()
+            self._tracer.dump_chrome_trace(self._trace_path)
         print("exiting")
         sys.exit(0)
 
 
+def open_annotation_storage(args: argparse.Namespace) -> AnnotationStorage:
+    """Opens annotations without gui for command line commands"""
+    journal = AnnotationJournal(args.output_folder) if args.output_format == cfg.OutputFormat.JOURNAL else None
+    return AnnotationStorage(args.input_coco, args.output_folder, args.images, args.start_frame_id,
+                             args.mmap_annotations, journal, args.merge_workers,
+                             start_frame_name=args.start_frame, window_size=args.window_size)
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--input_coco", help='path to json with annotations in COCO format')
     parser.add_argument("--output_folder", help='directory to save corrected annotations')
     parser.add_argument("--images", help='directory with images')
+    parser.add_argument("--videos", help='directory with videos to read frames from instead of images')
     parser.add_argument("--start_frame_id", help='frame number from which to start labeling')
+    parser.add_argument("--start_frame", metavar='IMAGE_NAME', help='name of image from which to start labeling')
+    parser.add_argument("--cache_mb", type=int, default=cfg.FRAME_CACHE_BUDGET_MB,
+                        help='memory budget of decoded frames cache in megabytes')
+    parser.add_argument("--prefetch", type=int, default=cfg.PREFETCH_FRAMES_AMOUNT,
+                        help='amount of images decoded in background ahead of the current one')
+    parser.add_argument("--display_scale", type=int, choices=cfg.DISPLAY_SCALES, default=cfg.DEFAULT_DISPLAY_SCALE,
+                        help='decode and display images downscaled by this factor')
+    parser.add_argument("--mmap_annotations", action='store_true',
+                        help='keep coco bboxes in memory mapped files instead of RAM')
+    parser.add_argument("--window_size", type=int,
+                        help='keep bboxes only of this amount of images on each side of the current one in RAM, '
+                             'other annotations are paged from disk')
+    parser.add_argument("--rss_budget_mb", type=int,
+                        help='soft memory budget of process in megabytes, frames cache and paged annotations are '
+                             'freed when it is exceeded, RSS may stay above it')
+    parser.add_argument("--output_format", choices=[cfg.OutputFormat.FILES, cfg.OutputFormat.JOURNAL],
+                        default=cfg.OutputFormat.FILES,
+                        help='save annotations as file per image or to append only journal')
+    parser.add_argument("--compact_journal", action='store_true',
+                        help='fold journal in output folder into snapshot and exit')
+    parser.add_argument("--export_journal", action='store_true',
+                        help='write journal in output folder as file per image and exit')
+    parser.add_argument("--merge_workers", type=int, default=cfg.MERGE_WORKERS,
+                        help='amount of threads reading labeled annotations at startup')
+    parser.add_argument("--export_coco", metavar='OUTPUT_JSON',
+                        help='write input coco merged with labeled and skipped annotations to json and exit')
+    parser.add_argument("--drop_skipped", action='store_true',
+                        help='do not export images marked as skipped')
+    parser.add_argument("--propagate", action='store_true',
+                        help='carry saved bboxes to the next frames with optical flow and offer them for labeling')
+    parser.add_argument("--dedup", action='store_true',
+                        help='collapse runs of near identical images in navigation and save them together')
+    parser.add_argument("--shard_worker", metavar='NAME',
+                        help='label batches of images claimed by this worker name, '
+                             'several workers may share one output folder')
+    parser.add_argument("--shard_batch_size", type=int, default=cfg.SHARD_BATCH_SIZE,
+                        help='amount of images in batch claimed by worker')
+    parser.add_argument("--shard_status", action='store_true',
+                        help='print progress of batches and workers in output folder and exit')
+    parser.add_argument("--review_diff", action='store_true',
+                        help='navigate only labeled images whose bboxes differ from coco and draw the differences')
+    parser.add_argument("--trace", metavar='TRACE_JSON',
+                        help='trace latency of every key and save chrome trace to json on quit')
+    parser.add_argument("--validate", action='store_true',
+                        help='check images and bboxes, print per class statistics and exit')
+    parser.add_argument("--report", metavar='REPORT_JSON',
+                        help='save validation report with all found issues to json')
+    parser.add_argument("--validation_workers", type=int,
+                        help='amount of processes reading image headers, all cores by default')
     args = parser.parse_args()
 
-    ltool = LabelingTool(args.input_coco, args.output_folder, args.images, args.start_frame_id)
+    if args.compact_journal:
+        live_workers = list()
+        if os.path.isdir(os.path.join(args.output_folder, cfg.SHARDS_DIRECTORY_NAME)):
+            live_workers = get_live_workers(ShardCoordinator(args.output_folder, "", 0))
+        if live_workers:
+            # records appended by running workers during compaction would be truncated
+            print(f"journal is not compacted, workers {', '.join(live_workers)} hold leases of batches, "
+                  f"stop them first or wait until their leases expire")
+        else:
+            AnnotationJournal(args.output_folder).compact()
+    elif args.export_journal:
+        AnnotationJournal(args.output_folder).export_to_folders()
+    elif args.export_coco:
+        export_coco(open_annotation_storage(args), args.input_coco, args.export_coco, args.drop_skipped)
+    elif args.shard_status:
+        storage = open_annotation_storage(args)
+        coordinator = ShardCoordinator(args.output_folder, "", storage.images_amount, args.shard_batch_size)
+        print_shard_status(get_shard_status(coordinator, storage.get_saved_image_ids()))
+    elif args.validate:
+        report = validate_dataset(open_annotation_storage(args), args.images, args.validation_workers)
+        print_report(report)
+        if args.report:
+            save_report(report, args.report)
+    else:
+        ltool = LabelingTool(args.input_coco, args.output_folder, args.images, args.start_frame_id,
+                             args.cache_mb, args.prefetch, args.display_scale, args.mmap_annotations,
+                             args.output_format, args.merge_workers, trace_path=args.trace,
+                             start_frame_name=args.start_frame, videos_folder=args.videos,
+                             propagate=args.propagate, dedup=args.dedup, shard_worker=args.shard_worker,
+                             shard_batch_size=args.shard_batch_size, window_size=args.window_size,
+                             rss_budget_mb=args.rss_budget_mb, review_diff=args.review_diff)
@@ -0,0 +1,126 @@
+from typing import Dict, List, Union
+
+import numpy as np
+
+import config as cfg
+from data_structures import BBox
+
+
+class ImageIdSet:
+    """Set of image ids which finds the nearest member in O(log n), backed by Fenwick tree of member counts"""
+
+    def __init__(self, members: np.ndarray):
+        self._members: np.ndarray = np.asarray(members, dtype=bool).copy()
+        self._size: int = len(self._members)
+        # tree[i] is amount of members among ids [i - lowbit(i), i), tree is indexed from 1
+        prefix_counts = np.zeros(self._size + 1, dtype=np.int64)
+        np.cumsum(self._members, out=prefix_counts[1:])
+        indexes = np.arange(1, self._size + 1)
+        self._tree: np.ndarray = np.zeros(self._size + 1, dtype=np.int32)
+        self._tree[1:] = prefix_counts[indexes] - prefix_counts[indexes - (indexes & -indexes)]
+        self._amount: int = int(prefix_counts[-1])
+        self._top_step: int = 1 << (self._size.bit_length() - 1) if self._size else 0
+
+    def __contains__(self, image_id: int):
+        return bool(self._members[image_id])
+
+    def __len__(self):
+        return self._amount
+
+    def add(self, image_id: int):
+        if not self._members[image_id]:
+            self._members[image_id] = True
+            self._update(image_id, 1)
+
+    def discard(self, image_id: int):
+        if self._members[image_id]:
+            self._members[image_id] = False
+            self._update(image_id, -1)
+
+    def next(self, image_id: int) -> Union[int, None]:
+        """Returns the smallest member greater than image_id"""
+        count = self._count_before(image_id + 1)
+        return self._find_kth(count + 1) if count < self._amount else None
+
+    def previous(self, image_id: int) -> Union[int, None]:
+        """Returns the greatest member less than image_id"""
+        count = self._count_before(image_id)
+        return self._find_kth(count) if count > 0 else None
+
+    def _update(self, image_id: int, delta: int):
+        self._amount += delta
+        index = image_id + 1
+        while index <= self._size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def _count_before(self, image_id: int) -> int:
+        count = 0
+        index = min(image_id, self._size)
+        while index > 0:
+            count += int(self._tree[index])
+            index &= index - 1
+        return count
+
+    def _find_kth(self, k: int) -> int:
+        """Returns id of k-th member counting from 1"""
+        position = 0
+        step = self._top_step
+        while step:
+            if position + step <= self._size and self._tree[position + step] < k:
+                position += step
+                k -= int(self._tree[position])
+            step >>= 1
+        return position
+
+
+class NavigationIndex:
+    """Keeps status of images and images of every class, so navigation jumps straight to the wanted image"""
+
+    def __init__(self, images_amount: int, image_indexes: np.ndarray, category_ids: np.ndarray,
+                 edited_bboxes: Dict[int, List[BBox]], statuses: Dict[int, str]):
+        """Builds index from coco bboxes columns, bboxes replaced by labeled annotations and saved statuses"""
+        self._statuses: Dict[int, str] = dict(statuses)
+        is_untouched = np.ones(images_amount, dtype=bool)
+        is_untouched[list(self._statuses.keys())] = False
+        self._untouched: ImageIdSet = ImageIdSet(is_untouched)
+
+        is_edited = np.zeros(images_amount, dtype=bool)
+        is_edited[list(edited_bboxes.keys())] = True
+        keep = ~is_edited[image_indexes]
+        has_class: Dict[str, np.ndarray] = dict()
+        for category_id, label in cfg.CATEGORY_ID_TO_LABEL.items():
+            has_class[label] = np.zeros(images_amount, dtype=bool)
+            has_class[label][image_indexes[keep & (category_ids == category_id)]] = True
+        for image_id, bboxes in edited_bboxes.items():
+            labels = {bbox.label for bbox in bboxes}
+            for label, class_mask in has_class.items():
+                class_mask[image_id] = label in labels
+        self._class_images: Dict[str, ImageIdSet] = {label: ImageIdSet(mask) for label, mask in has_class.items()}
+
+    @property
+    def untouched_amount(self):
+        return len(self._untouched)
+
+    def get_status(self, image_id: int) -> Union[str, None]:
+        return self._statuses.get(image_id)
+
+    def get_saved_image_ids(self) -> List[int]:
+        return list(self._statuses.keys())
+
+    def update_image(self, image_id: int, status: str, bboxes: List[BBox]):
+        self._statuses[image_id] = status
+        self._untouched.discard(image_id)
+        labels = {bbox.label for bbox in bboxes}
+        for label, class_images in self._class_images.items():
+            if label in labels:
+                class_images.add(image_id)
+            else:
+                class_images.discard(image_id)
+
+    def find_untouched(self, image_id: int, direction: bool) -> Union[int, None]:
+        return self._untouched.next(image_id) if direction else self._untouched.previous(image_id)
+
+    def find_with_class(self, image_id: int, label: str, direction: bool) -> Union[int, None]:
+        class_images = self._class_images[label]
+        return class_images.next(image_id) if direction else class_images.previous(image_id)
@@ -0,0 +1,226 @@
+import json
+import os
+import time
+from typing import Dict, List, Tuple, Union
+
+import config as cfg
+
+
+class ShardCoordinator:
+    """Splits images into batches which labeling processes sharing output folder claim with leases
+
+    Lease of a batch is file <batch>.<generation>.lease created with O_EXCL, so only one process gets it.
+    Lease expires SHARD_LEASE_SECONDS after modification time of the file, holder renews it by touching
+    the file while it works. Expired lease is taken over by creating lease of the next generation, holder
+    which finds newer generation or done file has lost the batch. Finished batch gets <batch>.done file.
+    Lease files are never removed, so a late holder always finds out that its lease was taken over.
+    """
+
+    def __init__(self, output_folder: str, worker_name: str, images_amount: int,
+                 batch_size: int = cfg.SHARD_BATCH_SIZE, lease_seconds: float = cfg.SHARD_LEASE_SECONDS):
+        self._worker_name: str = worker_name
+        self._images_amount: int = images_amount
+        self._batch_size: int = batch_size
+        self._lease_seconds: float = lease_seconds
+        self._leases_dir: str = os.path.join(output_folder, cfg.SHARDS_DIRECTORY_NAME, "leases")
+        self._done_dir: str = os.path.join(output_folder, cfg.SHARDS_DIRECTORY_NAME, "done")
+        os.makedirs(self._leases_dir, exist_ok=True)
+        os.makedirs(self._done_dir, exist_ok=True)
+        # claimed batch and generation of its lease
+        self.batch: Union[int, None] = None
+        self._generation: int = 0
+        self._renew_time: float = 0.0
+
+    @property
+    def batches_amount(self) -> int:
+        return -(-self._images_amount // self._batch_size)
+
+    def get_batch(self, image_id: int) -> int:
+        return image_id // self._batch_size
+
+    def get_batch_image_ids(self, batch: int) -> range:
+        return range(batch * self._batch_size, min((batch + 1) * self._batch_size, self._images_amount))
+
+    def claim(self) -> Union[int, None]:
+        """Claims the first batch which is neither done nor leased by a live worker, None if there is no such batch
+
+        Lease left by this worker name, for example before a crash, is taken back first.
+        """
+        done_batches = self.read_done_batches()
+        leases = self.read_leases()
+        own_batches = [batch for batch, (_, worker_name, _) in leases.items()
+                       if worker_name == self._worker_name and batch not in done_batches]
+        for batch in sorted(own_batches):
+            generation, _, _ = leases[batch]
+            self._set_claimed(batch, generation)
+            self.renew(force=True)
+            return batch
+
+        now = time.time()
+        for batch in range(self.batches_amount):
+            if batch in done_batches:
+                continue
+            generation = -1
+            if batch in leases:
+                generation, _, expires = leases[batch]
+                if expires > now:
+                    continue
+            if self._create_lease(batch, generation + 1):
+                self._set_claimed(batch, generation + 1)
+                return batch
+        return None
+
+    def renew(self, force: bool = False) -> bool:
+        """Extends lease of claimed batch, returns False if lease was taken over by another worker"""
+        if self.batch is None:
+            return False
+        if not force and time.monotonic() - self._renew_time < self._lease_seconds / 3:
+            return True
+        if (os.path.exists(self._get_lease_path(self.batch, self._generation + 1))
+                or os.path.exists(self._get_done_path(self.batch))):
+            self.batch = None
+            return False
+        try:
+            os.utime(self._get_lease_path(self.batch, self._generation))
+        except FileNotFoundError:
+            self.batch = None
+            return False
+        self._renew_time = time.monotonic()
+        return True
+
+    def finish(self) -> bool:
+        """Marks claimed batch as done, returns False if lease was taken over by another worker"""
+        # batch of lost lease belongs to its new holder, marking it as done would take it away from that worker
+        if not self.renew(force=True):
+            return False
+        with open(self._get_done_path(self.batch), "w") as done_file:
+            json.dump({"worker": self._worker_name, "time": time.time()}, done_file)
+        self.batch = None
+        return True
+
+    def release(self):
+        """Gives up claimed batch, so another worker can claim it without waiting for lease expiry"""
+        if self.batch is None:
+            return
+        # lease is expired by moving its modification time to the past
+        try:
+            os.utime(self._get_lease_path(self.batch, self._generation), (0, 0))
+        except FileNotFoundError:
+            pass
+        self.batch = None
+
+    def read_done_batches(self) -> Dict[int, str]:
+        """Returns batch -> name of worker which finished it"""
+        done_batches = dict()
+        for file_name in os.listdir(self._done_dir):
+            batch, ext = os.path.splitext(file_name)
+            if ext != ".done" or not batch.isdigit():
+                continue
+            try:
+                with open(os.path.join(self._done_dir, file_name)) as done_file:
+                    done_batches[int(batch)] = json.load(done_file)["worker"]
+            except (OSError, ValueError, KeyError):
+                done_batches[int(batch)] = ""
+        return done_batches
+
+    def read_leases(self) -> Dict[int, Tuple[int, str, float]]:
+        """Returns batch -> (generation, worker name, expiry time) of the latest lease of batch"""
+        latest: Dict[int, int] = dict()
+        for file_name in os.listdir(self._leases_dir):
+            parts = file_name.split(".")
+            if len(parts) != 3 or parts[2] != "lease" or not parts[0].isdigit() or not parts[1].isdigit():
+                continue
+            batch, generation = int(parts[0]), int(parts[1])
+            latest[batch] = max(latest.get(batch, -1), generation)
+
+        leases = dict()
+        for batch, generation in latest.items():
+            lease_path = self._get_lease_path(batch, generation)
+            try:
+                expires = os.path.getmtime(lease_path) + self._lease_seconds
+                with open(lease_path) as lease_file:
+                    worker_name = json.load(lease_file)["worker"]
+            except FileNotFoundError:
+                continue
+            except (OSError, ValueError, KeyError):
+                # lease is read between its creation and write of its content
+                worker_name = ""
+            leases[batch] = (generation, worker_name, expires)
+        return leases
+
+    def _set_claimed(self, batch: int, generation: int):
+        self.batch = batch
+        self._generation = generation
+        self._renew_time = time.monotonic()
+
+    def _create_lease(self, batch: int, generation: int) -> bool:
+        try:
+            fd = os.open(self._get_lease_path(batch, generation), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as lease_file:
+            json.dump({"worker": self._worker_name, "pid": os.getpid()}, lease_file)
+        return True
+
+    def _get_lease_path(self, batch: int, generation: int) -> str:
+        return os.path.join(self._leases_dir, f"{batch}.{generation}.lease")
+
+    def _get_done_path(self, batch: int) -> str:
+        return os.path.join(self._done_dir, f"{batch}.done")
+
+
+def get_live_workers(coordinator: ShardCoordinator) -> List[str]:
+    """Returns names of workers holding live leases of batches which are not done"""
+    done_batches = coordinator.read_done_batches()
+    now = time.time()
+    return sorted({worker_name for batch, (_, worker_name, expires) in coordinator.read_leases().items()
+                   if batch not in done_batches and expires > now})
+
+
+def get_shard_status(coordinator: ShardCoordinator, saved_image_ids: List[int]) -> Dict:
+    """Returns amount of batches in every state and per worker progress"""
+    done_batches = coordinator.read_done_batches()
+    leases = coordinator.read_leases()
+    saved_per_batch: Dict[int, int] = dict()
+    for image_id in saved_image_ids:
+        batch = coordinator.get_batch(image_id)
+        saved_per_batch[batch] = saved_per_batch.get(batch, 0) + 1
+
+    now = time.time()
+    batches = {"done": 0, "leased": 0, "expired": 0, "free": 0}
+    workers: Dict[str, Dict] = dict()
+    for batch in range(coordinator.batches_amount):
+        if batch in done_batches:
+            state, worker_name = "done", done_batches[batch]
+        elif batch in leases:
+            _, worker_name, expires = leases[batch]
+            state = "leased" if expires > now else "expired"
+        else:
+            state, worker_name = "free", None
+        batches[state] += 1
+        if worker_name is None:
+            continue
+        worker = workers.setdefault(worker_name, {"done_batches": 0, "leased_batches": list(), "saved_images": 0})
+        if state == "done":
+            worker["done_batches"] += 1
+        else:
+            worker["leased_batches"].append({
+                "batch": batch,
+                "saved": saved_per_batch.get(batch, 0),
+                "images": len(coordinator.get_batch_image_ids(batch)),
+                "expires_in_s": round(expires - now),
+            })
+        worker["saved_images"] += saved_per_batch.get(batch, 0)
+    return {"batches": batches, "saved_images": len(saved_image_ids), "workers": workers}
+
+
+def print_shard_status(status: Dict):
+    batches = status["batches"]
+    print(f"batches: {sum(batches.values())}, " + ", ".join(f"{state} {amount}" for state, amount in batches.items()))
+    print(f"saved images: {status['saved_images']}")
+    for worker_name, worker in sorted(status["workers"].items()):
+        print(f"{worker_name or '<unknown>'}: {worker['done_batches']} batches done, "
+              f"{worker['saved_images']} images saved")
+        for lease in worker["leased_batches"]:
+            state = "expired" if lease["expires_in_s"] <= 0 else f"expires in {lease['expires_in_s']} s"
+            print(f"    batch {lease['batch']}: {lease['saved']}/{lease['images']} saved, lease {state}")
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import config as cfg
+from data_structures import BBox
+from synthetic_dataset import generate_dataset
+from utils import AnnotationStorage
+
+SMALL_DATASET_IMAGES = 1_000
+LARGE_DATASET_IMAGES = 1_000_000
+SAVES = 200
+
+
+@pytest.fixture(scope="module")
+def storages(tmp_path_factory):
+    """Opens storages of small and large synthetic datasets"""
+    storages = dict()
+    for images in (SMALL_DATASET_IMAGES, LARGE_DATASET_IMAGES):
+        dataset_dir = str(tmp_path_factory.mktemp(f"dataset_{images}"))
+        annotation_path = generate_dataset(dataset_dir, images, bboxes_per_image=1, image_files=1)
+        storages[images] = AnnotationStorage(annotation_path, os.path.join(dataset_dir, "output"),
+                                             os.path.join(dataset_dir, "images"))
+    return storages
+
+
+def measure_save_seconds(storage: AnnotationStorage) -> float:
+    """Returns median time of saving bboxes of evenly spread images"""
+    bboxes = [BBox(10, 20, 110, 220, next(iter(cfg.LABEL_CATEGORY_ID)))]
+    # navigation index is updated on every save once it is built
+    storage.get_image_status(0)
+    seconds = list()
+    for image_id in np.linspace(0, storage.images_amount - 1, SAVES).astype(int).tolist():
+        storage.set_current_image_id(image_id)
+        start_time = time.perf_counter()
+        storage.update_current_image_bboxes(bboxes, cfg.DIRECTORY_FOR_LABELED_NAME)
+        seconds.append(time.perf_counter() - start_time)
+    return float(np.median(seconds))
+
+
+def test_save_time_does_not_grow_with_dataset_size(storages):
+    small_seconds = measure_save_seconds(storages[SMALL_DATASET_IMAGES])
+    large_seconds = measure_save_seconds(storages[LARGE_DATASET_IMAGES])
+    # rebuilding per image structures on save is about a thousand times slower on the large dataset
+    assert large_seconds < 10 * small_seconds + 1e-4
+
+
+def test_save_keeps_image_ids_and_names(storages):
+    storage = storages[SMALL_DATASET_IMAGES]
+    names_before = [storage.get_image_name_by_id(image_id) for image_id in range(storage.images_amount)]
+    assert names_before == sorted(names_before)
+
+    bboxes = [BBox(1, 2, 30, 40, next(iter(cfg.LABEL_CATEGORY_ID)))]
+    for image_id in (0, storage.images_amount // 2, storage.images_amount - 1):
+        storage.set_current_image_id(image_id)
+        storage.update_current_image_bboxes(bboxes, cfg.DIRECTORY_FOR_LABELED_NAME)
+        assert storage.current_image_id == image_id
+        assert storage.current_bboxes == bboxes
+
+    assert [storage.get_image_name_by_id(image_id) for image_id in range(storage.images_amount)] == names_before
+    assert all(storage.get_image_id_by_name(image_name) == image_id
+               for image_id, image_name in enumerate(names_before))
@@ -0,0 +1,120 @@
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import config as cfg
+
+
+class _Span:
+    def __init__(self, tracer: "Tracer", name: str):
+        self._tracer: Tracer = tracer
+        self._name: str = name
+        self._start: float = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._tracer.add_event(self._name, self._start, time.perf_counter() - self._start)
+        return False
+
+
+class Tracer:
+    """Records duration of stages of handled keys and keeps rolling latency percentiles per key
+
+    Stages are recorded with `with tracer.span(name)`, from any thread. Key handling is a span too, its
+    durations are also kept in window of the last latency_window presses of the key.
+    """
+
+    enabled = True
+
+    def __init__(self, max_events: int = cfg.TRACE_MAX_EVENTS, latency_window: int = cfg.TRACE_LATENCY_WINDOW):
+        self._start_time: float = time.perf_counter()
+        # (name, start, duration, thread id)
+        self._events: "deque[Tuple[str, float, float, int]]" = deque(maxlen=max_events)
+        self._latency_window: int = latency_window
+        self._key_latencies: Dict[str, "deque[float]"] = dict()
+        self._key_name: str = ""
+        self._key_start: float = 0.0
+
+    def span(self, name: str) -> _Span:
+        return _Span(self, name)
+
+    def add_event(self, name: str, start: float, duration: float):
+        self._events.append((name, start, duration, threading.get_ident()))
+
+    def begin_key(self, key_name: str):
+        self._key_name = key_name
+        self._key_start = time.perf_counter()
+
+    def end_key(self):
+        duration = time.perf_counter() - self._key_start
+        self.add_event(f"key {self._key_name}", self._key_start, duration)
+        if self._key_name not in self._key_latencies:
+            self._key_latencies[self._key_name] = deque(maxlen=self._latency_window)
+        self._key_latencies[self._key_name].append(duration)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns key name -> count and p50, p95, p99 of the last presses in milliseconds"""
+        stats = dict()
+        for key_name, latencies in sorted(self._key_latencies.items()):
+            p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, (50, 95, 99)).tolist()
+            stats[key_name] = {"count": len(latencies), "p50_ms": round(p50, 2),
+                               "p95_ms": round(p95, 2), "p99_ms": round(p99, 2)}
+        return stats
+
+    def print_stats(self):
+        for key_name, key_stats in self.stats().items():
+            print(f"key {key_name}: {key_stats}")
+
+    def dump_chrome_trace(self, path: str):
+        """Writes events in chrome trace format, opened with chrome://tracing or Perfetto"""
+        thread_ids: Dict[int, int] = dict()
+        trace_events: List[dict] = list()
+        for name, start, duration, thread_ident in list(self._events):
+            trace_events.append({
+                "name": name,
+                "ph": "X",
+                "ts": round((start - self._start_time) * 1e6, 1),
+                "dur": round(duration * 1e6, 1),
+                "pid": os.getpid(),
+                "tid": thread_ids.setdefault(thread_ident, len(thread_ids)),
+            })
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms", "keyLatencies": self.stats()}, trace_file)
+        print(f"trace of {len(trace_events)} events saved to {path}")
+
+
+class NullTracer:
+    """Tracer which records nothing, used when tracing is disabled"""
+
+    enabled = False
+    _null_span = contextlib.nullcontext()
+
+    def span(self, name: str) -> contextlib.nullcontext:
+        return self._null_span
+
+    def add_event(self, name: str, start: float, duration: float):
+        pass
+
+    def begin_key(self, key_name: str):
+        pass
+
+    def end_key(self):
+        pass
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return dict()
+
+    def print_stats(self):
+        pass
+
+    def dump_chrome_trace(self, path: str):
+        pass
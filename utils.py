@@ -1,38 +1,173 @@
 import argparse
+import hashlib
 import json
+import math
 import os
+import pickle
 import sys
-from copy import deepcopy
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
 
-from typing import Union, List, Dict, NoReturn
+from typing import Callable, Iterable, Union, List, Dict, NoReturn, Tuple
 
 import cv2
 import numpy as np
 
 import config as cfg
+from annotation_journal import AnnotationJournal
+from annotation_store import ColumnarBBoxStore, ImageNameTable, PagedBBoxes
+from background_writer import BackgroundWriter
+from bbox_index import BBoxIndex
+from edit_history import AddBBox, DeleteBBox, EditHistory, EditOperation, RelabelBBox
+from navigation_index import ImageIdSet, NavigationIndex
+from coco_reader import CocoStreamReader
 from data_structures import BBox, Point
+from tracing import NullTracer, Tracer
+from window import HeadlessWindow, OpenCVWindow
+
+
+def file_fingerprint(path: str) -> Tuple[int, int, str]:
+    """Size, modification time and hash of the beginning and the end of file"""
+    stat = os.stat(path)
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as file:
+        sha1.update(file.read(cfg.FINGERPRINT_CHUNK_SIZE))
+        file.seek(max(stat.st_size - cfg.FINGERPRINT_CHUNK_SIZE, 0))
+        sha1.update(file.read(cfg.FINGERPRINT_CHUNK_SIZE))
+    return stat.st_size, stat.st_mtime_ns, sha1.hexdigest()
+
+
+def _read_json(path: str):
+    with open(path, 'r') as json_file:
+        return json.load(json_file)
+
+
+def read_annotation_files(dir_path: str, cached_files: Dict = None,
+                          workers: int = cfg.MERGE_WORKERS) -> Dict[str, Tuple[Tuple[int, int], List[List[int]]]]:
+    """Reads annotation files of directory in thread pool
+
+    Returns file name -> ((size, mtime), bboxes json) sorted by file name. Files with the same size and mtime
+    as in cached_files are not read again.
+    """
+    cached_files = cached_files or dict()
+    if not os.path.isdir(dir_path):
+        return dict()
+    files_state = list()
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            # skip temporary files of interrupted atomic writes
+            if entry.is_file() and not entry.name.endswith(cfg.TMP_FILE_SUFFIX):
+                stat = entry.stat()
+                files_state.append((entry.name, (stat.st_size, stat.st_mtime_ns)))
+    files_state.sort()
+
+    annotation_files = dict()
+    to_read = list()
+    for file_name, file_state in files_state:
+        cached = cached_files.get(file_name)
+        if cached is not None and cached[0] == file_state:
+            annotation_files[file_name] = cached
+        else:
+            annotation_files[file_name] = None
+            to_read.append((file_name, file_state))
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for batch_start in range(0, len(to_read), cfg.MERGE_BATCH_SIZE):
+            batch = to_read[batch_start:batch_start + cfg.MERGE_BATCH_SIZE]
+            paths = [os.path.join(dir_path, file_name) for file_name, _ in batch]
+            for (file_name, file_state), ann_values in zip(batch, executor.map(_read_json, paths)):
+                annotation_files[file_name] = (file_state, ann_values)
+
+            read_amount = batch_start + len(batch)
+            elapsed = time.perf_counter() - start_time
+            print(f"{dir_path}: {read_amount}/{len(to_read)} files read, {read_amount / max(elapsed, 1e-6):.0f} files/s",
+                  end="\r" if read_amount < len(to_read) else "\n")
+    return annotation_files
+
+
+def get_peak_rss_mb() -> Union[float, None]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on linux
+    return max_rss / 2 ** 20 if sys.platform == "darwin" else max_rss / 2 ** 10
+
+
+def get_current_rss_mb() -> Union[float, None]:
+    """Reads resident set size of the process, None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
 
 
 class AnnotationStorage:
 
-    def __init__(self, annotations: str, output_folder: str, image_folder: str, start_frame_id: str=None):
+    def __init__(self, annotations: str, output_folder: str, image_folder: str, start_frame_id: str=None,
+                 mmap_annotations: bool = False, journal: AnnotationJournal = None,
+                 merge_workers: int = cfg.MERGE_WORKERS, writer: BackgroundWriter = None,
+                 start_frame_name: str = None, variables_file_name: str = cfg.VARIABLES_FILE_NAME,
+                 window_size: int = None):
 
         self._images_folder: str = image_folder
         self._output_folder: str = output_folder
+        # if journal is set, labeled annotations are read from it instead of labeled folder
+        self._journal: Union[AnnotationJournal, None] = journal
+        self._merge_workers: int = merge_workers
+        # if writer is set, last frame id is saved in background
+        self._writer: Union[BackgroundWriter, None] = writer
         self._dir_skipped = os.path.join(self._output_folder, cfg.DIRECTORY_FOR_SKIPPED_NAME)
         self._dir_labeled = os.path.join(self._output_folder, cfg.DIRECTORY_FOR_LABELED_NAME)
 
-        self._variables_file_path = os.path.join(os.path.dirname(annotations), cfg.VARIABLES_FILE_NAME)
-
-        self._images_info_list: List[Dict] = list()
-        self._images_info_dict: Dict[str, List[BBox]] = dict()
+        self._variables_file_path = os.path.join(os.path.dirname(annotations), variables_file_name)
+        self._store_dir = os.path.join(os.path.dirname(annotations), cfg.CACHE_DIRECTORY_NAME,
+                                       os.path.splitext(os.path.basename(annotations))[0])
+        # if window size is set, only bboxes of images at most window_size images away from current one are kept
+        # as BBox objects, image names and coco bboxes are memory mapped
+        self._window_size: Union[int, None] = window_size
+        self._mmap_annotations: bool = mmap_annotations or window_size is not None
+
+        # image id -> image name, images are sorted by name once and ids never change after that
+        self._images_info_list: Union[List[str], ImageNameTable] = list()
+        # image name -> image id, which is also index of image in bboxes store, the same table in windowed mode
+        self._images_info_dict: Union[Dict[str, int], ImageNameTable] = dict()
+        # coco bboxes of all images, BBox objects are created only for requested image
+        self._bboxes_store: ColumnarBBoxStore
+        # bboxes changed in this session or loaded from labeled folder, image id -> bboxes
+        self._edited_bboxes: Union[Dict[int, List[BBox]], PagedBBoxes] = dict()
+        # image id -> bboxes json of loaded labeled annotations with unknown category ids, their bboxes are
+        # left out of edited bboxes but exported and reported by validation as they are saved
+        self._unknown_category_annotations: Dict[int, List[List[int]]] = dict()
+        # (image id, bboxes) of the last image created from bboxes store, reused until another image is requested
+        self._last_store_bboxes: Tuple[int, List[BBox]] = (-1, list())
+        # labeled file name -> ((size, mtime), bboxes json), used to merge only changed files on next launch
+        self._labeled_files: Dict[str, Tuple[Tuple[int, int], List[List[int]]]] = dict()
+        # image name without extension -> image name, built on first use
+        self._image_name_by_stem: Union[Dict[str, str], None] = None
+        # image id -> status of annotations saved in this session
+        self._saved_statuses: Dict[int, str] = dict()
+        # built on the first jump, so it does not delay the first frame
+        self._navigation_index: Union[NavigationIndex, None] = None
+        # images next and previous navigation stops at, all images if not set
+        self._navigation_filter: Union[ImageIdSet, None] = None
         self._open_annotations(annotations)
 
+        if start_frame_name is not None and start_frame_name not in self._images_info_dict:
+            print(f"image {start_frame_name} not exist")
+        elif start_frame_name is not None:
+            start_frame_id = self.get_image_id_by_name(start_frame_name)
         self._current_image_id: int = self._set_start_frame_id(start_frame_id)
+        self._move_window()
 
     @property
     def current_image_name(self):
-        return self._images_info_list[self._current_image_id]['image_name']
+        return self._images_info_list[self._current_image_id]
 
     @property
     def images_amount(self):
@@ -44,61 +179,381 @@ class AnnotationStorage:
 
     @property
     def current_bboxes(self):
-        return self._images_info_list[self._current_image_id]["bboxes"]
+        return self.get_bboxes_by_image_name(self.current_image_name)
 
     def get_bboxes_by_image_id(self, image_id: int) -> Union[List[BBox], None]:
         if image_id < len(self._images_info_list):
-            return self._images_info_list[image_id]["bboxes"]
+            if image_id in self._edited_bboxes:
+                return self._edited_bboxes[image_id]
+            if self._last_store_bboxes[0] != image_id:
+                self._last_store_bboxes = (image_id, self._bboxes_store.get_bboxes(image_id))
+            return self._last_store_bboxes[1]
         return None
 
+    def is_edited(self, image_id: int) -> bool:
+        """Returns True if coco bboxes of image are replaced by saved annotation"""
+        return image_id in self._edited_bboxes
+
     def get_bboxes_by_image_name(self, img_name: str) -> Union[List[BBox], None]:
-        if img_name in self._images_info_dict:
-            return self._images_info_dict[img_name]
+        image_id = self.get_image_id_by_name(img_name)
+        if image_id is not None:
+            return self.get_bboxes_by_image_id(image_id)
         return None
 
     def get_image_name_by_id(self, image_id: int) -> str:
-        return self._images_info_list[image_id]["image_name"]
+        return self._images_info_list[image_id]
+
+    def get_image_id_by_name(self, img_name: str) -> Union[int, None]:
+        if img_name is None:
+            return None
+        return self._images_info_dict.get(img_name)
+
+    def get_image_name_by_annotation_name(self, ann_name: str) -> Union[str, None]:
+        """Maps name of annotation file in output folder back to image name with any extension"""
+        if isinstance(self._images_info_list, ImageNameTable):
+            return self._images_info_list.find_by_stem(os.path.splitext(ann_name)[0])
+        if self._image_name_by_stem is None:
+            self._image_name_by_stem = {
+                os.path.splitext(image_name)[0]: image_name for image_name in self._images_info_list
+            }
+        return self._image_name_by_stem.get(os.path.splitext(ann_name)[0])
 
     def get_sorted_images_names(self) -> List[str]:
-        return [image_name["image_name"] for image_name in self._images_info_list]
+        return list(self._images_info_list)
+
+    def get_skipped_annotations(self) -> Dict[int, List[List[int]]]:
+        """Reads annotations of images marked as skipped, image id -> bboxes json"""
+        if self._journal is not None:
+            skipped = {
+                img_name: ann_values for img_name, (status, ann_values) in self._journal.replay().items()
+                if status == cfg.DIRECTORY_FOR_SKIPPED_NAME
+            }
+        else:
+            skipped = {
+                self.get_image_name_by_annotation_name(ann_name): ann_values
+                for ann_name, (_, ann_values) in read_annotation_files(self._dir_skipped,
+                                                                       workers=self._merge_workers).items()
+            }
+        skipped_ids = {img_name: self.get_image_id_by_name(img_name) for img_name in skipped}
+        return {
+            skipped_ids[img_name]: ann_values for img_name, ann_values in skipped.items()
+            if skipped_ids[img_name] is not None
+        }
+
+    def get_coco_bboxes_by_image_id(self, image_id: int) -> List[BBox]:
+        """Returns original coco bboxes of image even if they are replaced by saved annotation"""
+        return self._bboxes_store.get_bboxes(image_id)
+
+    def get_coco_bboxes_columns(self) -> Dict[str, np.ndarray]:
+        """Original coco bboxes of all images as numpy columns sorted by image id"""
+        return {name: self._bboxes_store.column(name) for name in ColumnarBBoxStore.COLUMNS}
+
+    def get_labeled_image_ids(self) -> np.ndarray:
+        """Returns sorted ids of images whose annotation is saved to labeled folder or journal"""
+        navigation_index = self._get_navigation_index()
+        return np.array(sorted(
+            image_id for image_id in navigation_index.get_saved_image_ids()
+            if navigation_index.get_status(image_id) == cfg.DIRECTORY_FOR_LABELED_NAME
+            and image_id in self._edited_bboxes
+        ), dtype=np.int64)
+
+    def get_edited_bboxes_columns(self, image_ids: np.ndarray) -> Dict[str, np.ndarray]:
+        """Bboxes of edited images among image_ids as numpy columns sorted by image id"""
+        is_requested = np.zeros(self.images_amount, dtype=bool)
+        is_requested[image_ids] = True
+        # edited bboxes are read in one pass, paged bboxes of windowed mode are read sequentially
+        rows = np.array([
+            [bbox.x1, bbox.y1, bbox.x2, bbox.y2, cfg.LABEL_CATEGORY_ID[bbox.label], image_id]
+            for image_id, bboxes in self._edited_bboxes.items() if is_requested[image_id]
+            for bbox in bboxes
+        ], dtype=np.float64).reshape(-1, len(ColumnarBBoxStore.COLUMNS))
+        rows = rows[np.argsort(rows[:, -1], kind="stable")]
+        return {
+            name: rows[:, i].astype(ColumnarBBoxStore.DTYPES[name]) for i, name in enumerate(ColumnarBBoxStore.COLUMNS)
+        }
+
+    def get_bboxes_columns(self, replaced_bboxes: Dict[int, List[List[int]]] = None) -> Dict[str, np.ndarray]:
+        """Bboxes of all images as numpy columns sorted by image id
+
+        Bboxes of images edited in this session or loaded from labeled folder replace coco bboxes, so do
+        replaced_bboxes (image id -> bboxes json) for images which are not edited.
+        """
+        is_replaced, replaced_columns = self.get_replaced_bboxes_columns(replaced_bboxes)
+        keep = ~is_replaced[self._bboxes_store.column("image_index")]
+        columns = {
+            name: np.concatenate([self._bboxes_store.column(name)[keep], replaced_columns[name]])
+            for name in ColumnarBBoxStore.COLUMNS
+        }
+        order = np.argsort(columns["image_index"], kind="stable")
+        return {name: column[order] for name, column in columns.items()}
+
+    def get_replaced_bboxes_columns(self, replaced_bboxes: Dict[int, List[List[int]]] = None
+                                    ) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """Returns mask of images whose coco bboxes are replaced and bboxes replacing them as numpy columns
+
+        Coco bboxes are replaced by bboxes edited in this session or loaded from labeled folder and by
+        replaced_bboxes (image id -> bboxes json) of images which are not edited.
+        """
+        replaced_bboxes = dict(replaced_bboxes or dict())
+        for image_id, bboxes in self._edited_bboxes.items():
+            replaced_bboxes[image_id] = [
+                [bbox.x1, bbox.y1, bbox.x2, bbox.y2, cfg.LABEL_CATEGORY_ID[bbox.label]] for bbox in bboxes
+            ]
+        replaced_bboxes.update(self._unknown_category_annotations)
+
+        is_replaced = np.zeros(self.images_amount, dtype=bool)
+        is_replaced[list(replaced_bboxes.keys())] = True
+        replaced_rows = np.array(
+            [ann_value[:5] + [image_id] for image_id, ann_values in replaced_bboxes.items() for ann_value in ann_values],
+            dtype=np.float64,
+        ).reshape(-1, len(ColumnarBBoxStore.COLUMNS))
+        replaced_rows = replaced_rows[np.argsort(replaced_rows[:, -1], kind="stable")]
+        return is_replaced, {
+            name: replaced_rows[:, i].astype(ColumnarBBoxStore.DTYPES[name])
+            for i, name in enumerate(ColumnarBBoxStore.COLUMNS)
+        }
 
     def change_current_image_id(self, direction, step):
         self._update_current_image_id(direction, step)
 
-    def update_current_image_bboxes(self, bboxes: List[BBox]):
-        self._images_info_dict[self.current_image_name] = bboxes
-        self._get_list_image_values_from_dict()
+    def set_current_image_id(self, image_id: int):
+        self._current_image_id = min(max(image_id, 0), self.images_amount - 1)
+        self._move_window()
+        self._save_image_id_to_variables_file()
+
+    def update_current_image_bboxes(self, bboxes: List[BBox], status: str = None):
+        """Replaces bboxes of current image, status is name of directory the annotation is saved to"""
+        self.update_images_bboxes([self._current_image_id], bboxes, status)
+
+    def update_images_bboxes(self, image_ids: Iterable[int], bboxes: List[BBox], status: str = None):
+        """Replaces bboxes of all images with the same bboxes"""
+        for image_id in image_ids:
+            self._edited_bboxes[image_id] = bboxes
+            self._unknown_category_annotations.pop(image_id, None)
+            if status is not None:
+                self._saved_statuses[image_id] = status
+                if self._navigation_index is not None:
+                    self._navigation_index.update_image(image_id, status, bboxes)
+
+    def get_image_status(self, image_id: int) -> Union[str, None]:
+        """Returns name of directory annotation of image is saved to, None for untouched image"""
+        return self._get_navigation_index().get_status(image_id)
+
+    def get_saved_image_ids(self) -> List[int]:
+        return self._get_navigation_index().get_saved_image_ids()
+
+    def reload_saved_annotations(self, image_ids: Iterable[int]):
+        """Reads annotations of images which may be saved by other labeling processes since start"""
+        image_ids = list(image_ids)
+        # image id -> (status, bboxes json), labeled annotation wins over skipped one
+        saved: Dict[int, Tuple[str, List[List[int]]]] = dict()
+        if self._journal is not None:
+            image_names = {self.get_image_name_by_id(image_id) for image_id in image_ids}
+            for img_name, (status, ann_values) in self._journal.replay().items():
+                if img_name in image_names:
+                    saved[self.get_image_id_by_name(img_name)] = (status, ann_values)
+        else:
+            for image_id in image_ids:
+                base_img_name, ext = os.path.splitext(self.get_image_name_by_id(image_id))
+                for status in (cfg.DIRECTORY_FOR_SKIPPED_NAME, cfg.DIRECTORY_FOR_LABELED_NAME):
+                    try:
+                        saved[image_id] = (status, _read_json(os.path.join(self._output_folder, status,
+                                                                           f"{base_img_name}.txt")))
+                    except (OSError, ValueError):
+                        pass
+
+        for image_id, (status, ann_values) in saved.items():
+            if status == cfg.DIRECTORY_FOR_LABELED_NAME:
+                self._set_labeled_bboxes(self.get_image_name_by_id(image_id), ann_values)
+            self._saved_statuses[image_id] = status
+            if self._navigation_index is not None:
+                self._navigation_index.update_image(image_id, status, self.get_bboxes_by_image_id(image_id))
+
+    def set_navigation_filter(self, is_visible: Union[np.ndarray, None]):
+        """Makes next and previous navigation skip images which are not visible, None shows all images"""
+        self._navigation_filter = ImageIdSet(is_visible) if is_visible is not None else None
+
+    def get_next_image_id(self, image_id: int, direction: bool) -> Union[int, None]:
+        """Returns id of image next or previous navigation goes to from image_id, None at the end"""
+        if self._navigation_filter is not None:
+            return self._navigation_filter.next(image_id) if direction else self._navigation_filter.previous(image_id)
+        next_image_id = image_id + 1 if direction else image_id - 1
+        return next_image_id if 0 <= next_image_id < self.images_amount else None
+
+    def find_untouched_image_id(self, direction: bool) -> Union[int, None]:
+        """Returns id of the nearest image which is neither labeled nor skipped"""
+        return self._get_navigation_index().find_untouched(self._current_image_id, direction)
+
+    def find_image_id_with_class(self, class_label: cfg.ClassLabel, direction: bool) -> Union[int, None]:
+        """Returns id of the nearest image with bbox of class_label"""
+        return self._get_navigation_index().find_with_class(self._current_image_id, class_label, direction)
+
+    def get_untouched_amount(self) -> int:
+        return self._get_navigation_index().untouched_amount
+
+    def release_memory(self):
+        """Drops BBox objects and pages of memory mapped files, they are read from disk again on demand"""
+        self._last_store_bboxes = (-1, list())
+        self._bboxes_store.release_pages()
+        if self._window_size is not None:
+            self._edited_bboxes.clear_window()
+            self._images_info_list.release_pages()
+
+    def get_memory_stats(self) -> Dict[str, int]:
+        stats = {"edited_images": len(self._edited_bboxes)}
+        if self._window_size is not None:
+            stats["materialized_images"] = self._edited_bboxes.materialized_amount
+        return stats
+
+    def close(self):
+        if self._window_size is not None:
+            self._edited_bboxes.close()
+
+    def _move_window(self):
+        if self._window_size is not None:
+            self._edited_bboxes.move_window(self._current_image_id)
+
+    def _get_navigation_index(self) -> NavigationIndex:
+        if self._navigation_index is None:
+            start_time = time.perf_counter()
+            statuses = self._read_saved_statuses()
+            statuses.update(self._saved_statuses)
+            self._navigation_index = NavigationIndex(self.images_amount,
+                                                     self._bboxes_store.column("image_index"),
+                                                     self._bboxes_store.column("category_id"),
+                                                     self._edited_bboxes,
+                                                     statuses)
+            print(f"navigation index built in {time.perf_counter() - start_time:.2f} s")
+        return self._navigation_index
+
+    def _read_saved_statuses(self) -> Dict[int, str]:
+        """Reads image id -> status of annotations saved by previous sessions"""
+        if self._journal is not None:
+            saved = {img_name: status for img_name, (status, _) in self._journal.replay().items()}
+        else:
+            saved = dict()
+            if os.path.isdir(self._dir_skipped):
+                with os.scandir(self._dir_skipped) as entries:
+                    for entry in entries:
+                        if not entry.name.endswith(cfg.TMP_FILE_SUFFIX):
+                            saved[self.get_image_name_by_annotation_name(entry.name)] = cfg.DIRECTORY_FOR_SKIPPED_NAME
+            for ann_name in self._labeled_files:
+                saved[self.get_image_name_by_annotation_name(ann_name)] = cfg.DIRECTORY_FOR_LABELED_NAME
+        saved_ids = {img_name: self.get_image_id_by_name(img_name) for img_name in saved}
+        return {
+            saved_ids[img_name]: status for img_name, status in saved.items() if saved_ids[img_name] is not None
+        }
 
     def _open_annotations(self, annotation_path):
-        self._open_coco_annotation(annotation_path)
-        self._update_annotations_with_labeled_annotations()
-
-    def _update_annotations_with_labeled_annotations(self):
-        output_annotation_names = os.listdir(self._dir_labeled)
-        for ann_name in output_annotation_names:
-            img_name = f'{os.path.splitext(ann_name)[0]}.jpg'
-            ann_path = os.path.join(self._dir_labeled, ann_name)
-            with open(ann_path, 'r') as json_file:
-                ann_values = json.load(json_file)
-
-            if img_name in self._images_info_dict:
-                self._images_info_dict[img_name] = []
-                for bbox in ann_values:
-                    self._images_info_dict[img_name].append(
+        snapshot = self._load_startup_snapshot(annotation_path)
+        if snapshot is None:
+            self._open_coco_annotation(annotation_path)
+            cached_labeled_files = dict()
+        else:
+            cached_labeled_files = snapshot["labeled_files"]
+        if self._window_size is not None:
+            self._edited_bboxes = PagedBBoxes(self._store_dir, self.images_amount, self._window_size)
+
+        self._update_annotations_with_labeled_annotations(cached_labeled_files)
+
+        # snapshot of windowed mode keeps image names in memory mapped table instead of list
+        names_in_snapshot = snapshot is not None and snapshot["image_names"] is not None
+        if (snapshot is None or self._labeled_files != cached_labeled_files
+                or names_in_snapshot != (self._window_size is None)):
+            self._save_startup_snapshot(annotation_path, save_store=snapshot is None)
+        if snapshot is None and self._mmap_annotations:
+            self._bboxes_store = ColumnarBBoxStore.load(self._store_dir, mmap=True)
+        if self._window_size is not None and not isinstance(self._images_info_list, ImageNameTable):
+            try:
+                names_table = ImageNameTable.load(self._store_dir)
+            except OSError:
+                names_table = ImageNameTable.from_names(self._images_info_list)
+            self._images_info_list = self._images_info_dict = names_table
+        if self._window_size is not None:
+            # annotations of labeled files are kept in paged bboxes, only names are needed to find saved images
+            self._labeled_files = dict.fromkeys(self._labeled_files)
+
+    def _load_startup_snapshot(self, annotation_path: str) -> Union[Dict, None]:
+        """Restores coco bboxes saved by previous launch if coco file has not changed since then"""
+        snapshot_path = os.path.join(self._store_dir, cfg.STARTUP_SNAPSHOT_FILE_NAME)
+        if not os.path.isfile(snapshot_path):
+            return None
+        try:
+            with open(snapshot_path, "rb") as snapshot_file:
+                snapshot = pickle.load(snapshot_file)
+            if (snapshot["version"] != cfg.STARTUP_SNAPSHOT_VERSION
+                    or snapshot["coco_fingerprint"] != file_fingerprint(annotation_path)):
+                return None
+            bboxes_store = ColumnarBBoxStore.load(self._store_dir, mmap=self._mmap_annotations)
+            names_table = ImageNameTable.load(self._store_dir) if snapshot["image_names"] is None else None
+        except (OSError, EOFError, KeyError, ValueError, pickle.UnpicklingError) as e:
+            print(f"startup snapshot is ignored: {e}")
+            return None
+
+        self._bboxes_store = bboxes_store
+        if names_table is not None and self._window_size is not None:
+            self._images_info_list = self._images_info_dict = names_table
+        else:
+            self._set_image_names(snapshot["image_names"] if names_table is None else list(names_table))
+        if snapshot["labeled_dir"] != os.path.abspath(self._dir_labeled):
+            snapshot["labeled_files"] = dict()
+        print(f"startup snapshot loaded, {self._bboxes_store.bboxes_amount} bboxes")
+        return snapshot
+
+    def _save_startup_snapshot(self, annotation_path: str, save_store: bool):
+        snapshot = {
+            "version": cfg.STARTUP_SNAPSHOT_VERSION,
+            "coco_fingerprint": file_fingerprint(annotation_path),
+            "image_names": self._images_info_list if self._window_size is None else None,
+            "labeled_dir": os.path.abspath(self._dir_labeled),
+            "labeled_files": self._labeled_files,
+        }
+        snapshot_path = os.path.join(self._store_dir, cfg.STARTUP_SNAPSHOT_FILE_NAME)
+        try:
+            if save_store:
+                self._bboxes_store.save(self._store_dir)
+            if self._window_size is not None and not isinstance(self._images_info_list, ImageNameTable):
+                ImageNameTable.from_names(self._images_info_list).save(self._store_dir)
+            with open(f"{snapshot_path}.tmp", "wb") as snapshot_file:
+                pickle.dump(snapshot, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{snapshot_path}.tmp", snapshot_path)
+        except OSError as e:
+            print(f"startup snapshot is not saved: {e}")
+
+    def _set_image_names(self, sorted_names: List[str]):
+        self._images_info_list = sorted_names
+        self._images_info_dict = {image_name: image_id for image_id, image_name in enumerate(sorted_names)}
+
+    def _update_annotations_with_labeled_annotations(self, cached_labeled_files: Dict):
+        if self._journal is not None:
+            for img_name, (status, ann_values) in self._journal.replay().items():
+                if status == cfg.DIRECTORY_FOR_LABELED_NAME:
+                    self._set_labeled_bboxes(img_name, ann_values)
+        else:
+            self._labeled_files = read_annotation_files(self._dir_labeled, cached_labeled_files, self._merge_workers)
+            for ann_name, (_, ann_values) in self._labeled_files.items():
+                img_name = self.get_image_name_by_annotation_name(ann_name)
+                if img_name is not None:
+                    self._set_labeled_bboxes(img_name, ann_values)
+            print(f"{len(self._labeled_files)} labeled annotations merged")
+        if self._unknown_category_annotations:
+            print(f"{len(self._unknown_category_annotations)} labeled annotations have bboxes of unknown categories, "
+                  f"these bboxes are not shown, run --validate to list them")
+
+    def _set_labeled_bboxes(self, img_name: str, ann_values: List[List[int]]):
+        image_id = self.get_image_id_by_name(img_name)
+        if image_id is not None:
+            bboxes = []
+            for bbox in ann_values:
+                if bbox[4] in cfg.CATEGORY_ID_TO_LABEL:
+                    bboxes.append(
                         BBox(bbox[0], bbox[1], bbox[2], bbox[3], cfg.CATEGORY_ID_TO_LABEL[bbox[4]],
                 ))
-
-        self._get_list_image_values_from_dict()
-
-    def _get_list_image_values_from_dict(self):
-        self._images_info_list = []
-        for image_name, bbox_list in self._images_info_dict.items():
-            self._images_info_list.append(
-                {
-                    "image_name": image_name,
-                    "bboxes": bbox_list,
-                }
-            )
+            if len(bboxes) < len(ann_values):
+                self._unknown_category_annotations[image_id] = ann_values
+            else:
+                self._unknown_category_annotations.pop(image_id, None)
+            self._edited_bboxes[image_id] = bboxes
 
     def _set_start_frame_id(self, frame_id: Union[int, str]):
         # try to open user specified index
@@ -123,17 +578,29 @@ class AnnotationStorage:
         return 0
     
     def _save_image_id_to_variables_file(self):
-        with open(self._variables_file_path, 'w') as json_file:
-            json.dump({cfg.PresistentVariableName.IMAGE_ID: self.current_image_id}, json_file)
+        values = {cfg.PresistentVariableName.IMAGE_ID: self.current_image_id}
+        if self._writer is not None:
+            self._writer.write_json(self._variables_file_path, values)
+        else:
+            with open(self._variables_file_path, 'w') as json_file:
+                json.dump(values, json_file)
 
     def _update_current_image_id(self, direction: bool, step: int):
-        new_image_id = (
-            self._current_image_id + step
-            if direction
-            else self._current_image_id - step
-        )
+        if self._navigation_filter is not None:
+            new_image_id = self._current_image_id
+            for _ in range(step):
+                next_image_id = self.get_next_image_id(new_image_id, direction)
+                if next_image_id is None:
+                    break
+                new_image_id = next_image_id
+        else:
+            new_image_id = (
+                self._current_image_id + step
+                if direction
+                else self._current_image_id - step
+            )
 
-        if new_image_id > self.images_amount:
+        if new_image_id >= self.images_amount:
             new_image_id = self.images_amount - 1
         elif new_image_id < 0:
             new_image_id = 0
@@ -142,90 +609,127 @@ class AnnotationStorage:
         self._save_image_id_to_variables_file()
 
     def _open_coco_annotation(self, annotation_path: str) -> NoReturn:
-
-        with open(annotation_path, "r") as jfile:
-            coco_ann = json.load(jfile)
-
-        images = coco_ann["images"]
-        categories = coco_ann["categories"]
-        labels = coco_ann["annotations"]
-
-        image_dict = dict()
-        category_dict = dict()
-
-        # images
-        for image_info in images:
-            image_dict[image_info["id"]] = image_info["file_name"]
-
-            self._images_info_dict[image_info["file_name"]] = list()
-
-        # categories
-        for category_info in categories:
-            category_name = category_info["name"]
-
-            category_dict[category_info["id"] - 1] = {
-                "class_name": category_name,
-            }
+        """Streams coco file into columnar bboxes store"""
+
+        image_names = list()
+        coco_image_ids = array("q")
+        columns = {name: array("d") for name in ColumnarBBoxStore.COORDINATE_COLUMNS}
+        category_ids = array("q")
+        ann_image_ids = array("q")
+
+        for key, item in CocoStreamReader(annotation_path).iter_items():
+            if key == "images":
+                image_names.append(item["file_name"])
+                coco_image_ids.append(item["id"])
+            elif key == "annotations":
+                x1, y1, w, h = item["bbox"]
+                columns["x1"].append(x1)
+                columns["y1"].append(y1)
+                columns["x2"].append(x1 + w)
+                columns["y2"].append(y1 + h)
+                category_ids.append(item["category_id"])
+                ann_image_ids.append(item["image_id"])
+
+        # images, sorted by image name
+        self._set_image_names(sorted(set(image_names)))
+        coco_position_to_image_id = np.array([self._images_info_dict[name] for name in image_names], dtype=np.int64)
 
         # labels
-        for i, label_info in enumerate(labels):
-
-            x1 = label_info["bbox"][0]
-            y1 = label_info["bbox"][1]
-            w = label_info["bbox"][2]
-            h = label_info["bbox"][3]
-
-            image_name = image_dict[label_info["image_id"]]
-
-            cat_id = label_info["category_id"]
-            self._images_info_dict[image_name].append(
-                BBox(
-                    x1,
-                    y1,
-                    x1 + w,
-                    y1 + h,
-                    cfg.CATEGORY_ID_TO_LABEL[label_info["category_id"]],
-                )
-            )
-
-        # converting image dict to list
-        self._get_list_image_values_from_dict()
-
-        # sort by image name
-        self._images_info_list.sort(key=lambda x: x["image_name"])
-
+        coco_image_ids = np.frombuffer(coco_image_ids, dtype=np.int64)
+        ann_image_ids = np.frombuffer(ann_image_ids, dtype=np.int64)
+        ids_order = np.argsort(coco_image_ids, kind="stable")
+        sorted_ids = coco_image_ids[ids_order]
+        found = np.searchsorted(sorted_ids, ann_image_ids).clip(max=max(len(sorted_ids) - 1, 0))
+        if len(ann_image_ids) and (not len(sorted_ids) or np.any(sorted_ids[found] != ann_image_ids)):
+            raise KeyError("annotations refer to image ids missing in images")
+
+        columns = {name: np.frombuffer(column, dtype=np.float64) for name, column in columns.items()}
+        columns["category_id"] = np.frombuffer(category_ids, dtype=np.int64)
+        columns["image_index"] = coco_position_to_image_id[ids_order[found]]
+        self._bboxes_store = ColumnarBBoxStore.from_columns(columns, len(self._images_info_list))
+        print(f"{self._bboxes_store.bboxes_amount} bboxes loaded, {self._bboxes_store.nbytes / 2 ** 20:.1f} MB")
+        unknown_amount = np.count_nonzero(~np.isin(columns["category_id"], list(cfg.CATEGORY_ID_TO_LABEL)))
+        if unknown_amount:
+            print(f"{unknown_amount} coco bboxes have unknown categories, these bboxes are not shown, "
+                  f"run --validate to list them")
 
 
 class Canvas:
     """Works with graphics"""
 
-    def __init__(self):
+    def __init__(self, undo_depth: int = cfg.UNDO_DEPTH, window: Union[OpenCVWindow, HeadlessWindow] = None,
+                 tracer: Union[Tracer, NullTracer] = None):
+        self._window: Union[OpenCVWindow, HeadlessWindow] = window if window is not None else OpenCVWindow()
+        self._tracer: Union[Tracer, NullTracer] = tracer if tracer is not None else NullTracer()
         self._bboxes: List[BBox]
-        self._current_image: np.ndarray
+        # operations applied to bboxes of current frame
+        self._history: EditHistory = EditHistory(undo_depth)
+        # _bboxes list is shared with storage until canvas changes it for the first time
+        self._bboxes_shared: bool = False
+        # coordinates of _bboxes in the same order, used for hit-testing
+        self._bbox_index: BBoxIndex = BBoxIndex()
+        # view layer with bboxes drawn on it, shown in window
+        self._current_image: Union[np.ndarray, None] = None
         self._mode: cfg.LabelingMode = cfg.LabelingMode.DRAWING
+        # decoded frame which is never drawn on
         self._clear_image: np.ndarray
+        # ratio between full resolution image and decoded frame
+        self._scale: int = 1
+        # (width, height) of frame in full resolution
+        self._image_size: Union[Tuple[int, int], None] = None
+        # decodes frame in full resolution when view is zoomed beyond resolution of decoded frame
+        self._full_resolution_loader: Union[Callable[[], np.ndarray], None] = None
+        # base layer, visible part of frame scaled to window, rebuilt only when view changes
+        self._view_image: Union[np.ndarray, None] = None
+        # image coordinates of top left corner of view and image pixels per view pixel
+        self._view_origin: Tuple[int, int] = (0, 0)
+        self._view_ratio: Tuple[float, float] = (1.0, 1.0)
+        # 1 is the whole frame, view center is in image coordinates
+        self._zoom: float = 1.0
+        self._view_center: Tuple[float, float] = (0.0, 0.0)
+        # (view point, view center) where panning with right button started
+        self._pan_start: Union[Tuple[Tuple[int, int], Tuple[float, float]], None] = None
+        # time of the last refresh in seconds
+        self._last_render_time: float = 0.0
         self._selected_class_label: cfg.ClassLabel = cfg.DEFAULT_CLASS_LABEL
         self._render_with_id: bool = False
+        # (bbox, change type) of differences from original bboxes drawn under bboxes in review
+        self._changes: List[Tuple[BBox, str]] = list()
         self._state: cfg.CanvasState = cfg.CanvasState.NORMAL
         # used to select bbox id using keyboard. Dict[number_on_keyboard: bbox_id]
         self._keyboard_key_to_bbox_id_mapper: Dict[int, int] = dict()
-        cv2.namedWindow(cfg.WINDOW_NAME, cv2.WINDOW_NORMAL | cv2.WINDOW_GUI_NORMAL)
-        cv2.setMouseCallback(cfg.WINDOW_NAME, self._on_mouse)
-        cv2.resizeWindow(cfg.WINDOW_NAME, 900, 600)
+        self._window.set_mouse_callback(self._on_mouse)
 
     @property
     def state(self):
         return self._state
 
+    @property
+    def selected_class_label(self):
+        return self._selected_class_label
+
+    @property
+    def last_render_time(self):
+        return self._last_render_time
+
     @property
     def bboxes(self):
-        return deepcopy(self._bboxes)
+        self._bboxes_shared = True
+        return self._bboxes
 
     def set_bboxes(self, bboxes):
-        self._bboxes = deepcopy(bboxes)
+        self._bboxes = bboxes
+        self._bboxes_shared = True
+        self._bbox_index.set_bboxes(self._bboxes)
+        self._changes = list()
+        self._history.clear()
         self._clear_keyboard_key_to_bbox_id_mapper()
         self._state: cfg.CanvasState = cfg.CanvasState.NORMAL
 
+    def set_changes(self, changes: List[Tuple[BBox, str]]):
+        """Sets differences from original bboxes to draw until bboxes of another image are set"""
+        self._changes = changes
+
     def specify_bbox(self, number: int):
 
         if number not in self._keyboard_key_to_bbox_id_mapper:
@@ -243,20 +747,93 @@ class Canvas:
         self._clear_keyboard_key_to_bbox_id_mapper()
         self.refresh()
 
+    def undo(self):
+        """Reverts the last operation applied to bboxes of current frame"""
+        operation = self._history.pop_undo()
+        if operation is None:
+            print("nothing to undo")
+            return
+        self._apply_operation_and_refresh(operation.inverse())
+        print(f"{type(operation).__name__} of bbox with id {operation.bbox_id} undone")
+
+    def redo(self):
+        operation = self._history.pop_redo()
+        if operation is None:
+            print("nothing to redo")
+            return
+        self._apply_operation_and_refresh(operation)
+        print(f"{type(operation).__name__} of bbox with id {operation.bbox_id} redone")
+
     def set_mode(self, mode: cfg.LabelingMode):
         self._mode = mode
 
-    def set_image(self, img: np.ndarray):
+    def set_image(self, img: np.ndarray, scale: int = 1, full_resolution_loader: Callable[[], np.ndarray] = None):
+        """Set image decoded downscaled by scale, bboxes stay in full resolution coordinates
+
+        Zoom and view center are kept if the frame has the same size as the previous one.
+        """
+        image_size = (img.shape[1] * scale, img.shape[0] * scale)
+        if image_size != self._image_size:
+            self._image_size = image_size
+            self._zoom = 1.0
+            self._view_center = (image_size[0] / 2, image_size[1] / 2)
         self._clear_image = img
+        self._scale = scale
+        self._full_resolution_loader = full_resolution_loader if scale > 1 else None
+        self._view_image = None
+
+    def zoom(self, factor: float):
+        """Zooms view in or out around its center"""
+        self._zoom_at(self._view_image.shape[1] // 2, self._view_image.shape[0] // 2, factor)
+
+    def reset_view(self):
+        self._zoom = 1.0
+        self._view_center = (self._image_size[0] / 2, self._image_size[1] / 2)
+        self._view_image = None
+        self.refresh()
 
     def refresh(self):
+        """Redraws the whole frame"""
+        start_time = time.perf_counter()
         self._render_bboxes(self._bboxes)
         self._turn_off_render_with_id()
+        self._last_render_time = time.perf_counter() - start_time
+        self._tracer.add_event("render", start_time, self._last_render_time)
+
+    def refresh_region(self, bboxes: List[BBox]):
+        """Redraws only the region covered by bboxes, the rest of the frame is left as it is"""
+        if self._keyboard_key_to_bbox_id_mapper:
+            # keyboard numbers may be drawn anywhere
+            self.refresh()
+            return
+
+        start_time = time.perf_counter()
+        x1, y1, x2, y2 = self._get_display_rect(bboxes[0])
+        for bbox in bboxes[1:]:
+            rect = self._get_display_rect(bbox)
+            x1, y1, x2, y2 = min(x1, rect[0]), min(y1, rect[1]), max(x2, rect[2]), max(y2, rect[3])
+
+        if x1 < x2 and y1 < y2:
+            region = self._current_image[y1:y2, x1:x2]
+            np.copyto(region, self._view_image[y1:y2, x1:x2])
+            for bbox, change_type in self._changes:
+                bx1, by1, bx2, by2 = self._get_display_rect(bbox)
+                if bx1 < x2 and x1 < bx2 and by1 < y2 and y1 < by2:
+                    self._draw_change(region, bbox, change_type, (x1, y1))
+            for bbox in self._bboxes:
+                bx1, by1, bx2, by2 = self._get_display_rect(bbox)
+                if bx1 < x2 and x1 < bx2 and by1 < y2 and y1 < by2:
+                    self._draw_bbox_rectangle(region, bbox, (x1, y1))
+        with self._tracer.span("imshow"):
+            self._window.show(self._current_image)
+        self._last_render_time = time.perf_counter() - start_time
+        self._tracer.add_event("render region", start_time, self._last_render_time)
 
     def set_class_label(self, class_label: cfg.ClassLabel):
         self._selected_class_label = class_label
 
     def get_bboxes_json(self):
+        # bboxes are stored in full resolution, so no remapping is needed
         bboxes_list = list()
         for bbox in self._bboxes:
             bboxes_list.append(
@@ -266,61 +843,113 @@ class Canvas:
 
 
     def draw_bbox(self):
-        region = cv2.selectROI(cfg.WINDOW_NAME, self._current_image)
-        cv2.setMouseCallback(cfg.WINDOW_NAME, self._on_mouse)
+        region = self._window.select_roi(self._current_image)
 
-        y1 = int(region[1])
-        y2 = int(region[1] + region[3])
-        x1 = int(region[0])
-        x2 = int(region[0] + region[2])
+        x1, y1 = self._to_image_coords(region[0], region[1])
+        x2, y2 = self._to_image_coords(region[0] + region[2], region[1] + region[3])
 
-        self._bboxes.append(BBox(x1, y1, x2, y2, self._selected_class_label))
+        bbox = BBox(x1, y1, x2, y2, self._selected_class_label)
+        self._do(AddBBox(len(self._bboxes), bbox))
         print(f"bbox with class {self._selected_class_label} created")
 
-        self.refresh()
+        self.refresh_region([bbox])
 
     def _on_mouse(self, event, x, y, flags, param):
-        point = Point(x, y)
+        if event == cv2.EVENT_MOUSEWHEEL:
+            # wheel delta is in the signed high word of flags
+            self._zoom_at(x, y, cfg.ZOOM_STEP if flags > 0 else 1 / cfg.ZOOM_STEP)
+        elif event == cv2.EVENT_RBUTTONDOWN:
+            self._pan_start = ((x, y), self._view_center)
+        elif event == cv2.EVENT_RBUTTONUP:
+            self._pan_start = None
+        elif event == cv2.EVENT_MOUSEMOVE and self._pan_start is not None and flags & cv2.EVENT_FLAG_RBUTTON:
+            (start_x, start_y), (center_x, center_y) = self._pan_start
+            self._view_center = (center_x - (x - start_x) * self._view_ratio[0],
+                                 center_y - (y - start_y) * self._view_ratio[1])
+            self._view_image = None
+            self.refresh()
+
+        point = Point(*self._to_image_coords(x, y))
         if event == cv2.EVENT_LBUTTONDOWN:
             if self.state == cfg.CanvasState.NORMAL:
+                changed_bbox = None
                 if self._mode == cfg.LabelingMode.DELETION:
-                    self._delete_bbox_contains_point(point)
+                    changed_bbox = self._delete_bbox_contains_point(point)
                 if self._mode == cfg.LabelingMode.SET_LABEL:
-                    self._set_label_to_bbox_contains_point(point)
-                self.refresh()
+                    changed_bbox = self._set_label_to_bbox_contains_point(point)
 
-    def _delete_bbox_by_id(self, bbox_id: int):
+                if self.state == cfg.CanvasState.ASK_BBOX_INDEX:
+                    self.refresh()
+                elif changed_bbox is not None:
+                    self.refresh_region([changed_bbox])
+
+    def _delete_bbox_by_id(self, bbox_id: int) -> Union[BBox, None]:
         if len(self._bboxes) > bbox_id:
-            del self._bboxes[bbox_id]
-        else:
-            print('no element with this id')
+            bbox = self._bboxes[bbox_id]
+            self._do(DeleteBBox(bbox_id, bbox))
+            return bbox
+        print('no element with this id')
+        return None
 
-    def _delete_bbox_contains_point(self, point: Point):
+    def _delete_bbox_contains_point(self, point: Point) -> Union[BBox, None]:
         bbox_id = self._get_selected_bbox_id(point)
         if bbox_id is not None:
-            self._delete_bbox_by_id(bbox_id)
             print(f"bbox with id {bbox_id} deleted")
+            return self._delete_bbox_by_id(bbox_id)
+        return None
 
-    def _set_label_to_bbox_by_id(self, bbox_id: int):
+    def _set_label_to_bbox_by_id(self, bbox_id: int) -> Union[BBox, None]:
         if len(self._bboxes) > bbox_id:
-            self._bboxes[bbox_id].label = self._selected_class_label
-        else:
-            print('no element with this id')
+            bbox = self._bboxes[bbox_id]
+            self._do(RelabelBBox(bbox_id, bbox, bbox.with_label(self._selected_class_label)))
+            return self._bboxes[bbox_id]
+        print('no element with this id')
+        return None
 
-    def _set_label_to_bbox_contains_point(self, point: Point):
+    def _set_label_to_bbox_contains_point(self, point: Point) -> Union[BBox, None]:
         bbox_id = self._get_selected_bbox_id(point)
         if bbox_id is not None:
-            self._set_label_to_bbox_by_id(bbox_id)
             print(f"set label {self._selected_class_label} for bbox with id {bbox_id}")
+            return self._set_label_to_bbox_by_id(bbox_id)
+        return None
+
+    def _do(self, operation: EditOperation):
+        self._apply_operation(operation)
+        self._history.push(operation)
+
+    def _apply_operation(self, operation: EditOperation):
+        self._own_bboxes()
+        if isinstance(operation, AddBBox):
+            self._bboxes.insert(operation.bbox_id, operation.bbox)
+            self._bbox_index.insert(operation.bbox_id, operation.bbox)
+        elif isinstance(operation, DeleteBBox):
+            del self._bboxes[operation.bbox_id]
+            self._bbox_index.delete(operation.bbox_id)
+        elif isinstance(operation, RelabelBBox):
+            self._bboxes[operation.bbox_id] = operation.bbox
+
+    def _apply_operation_and_refresh(self, operation: EditOperation):
+        if self._state == cfg.CanvasState.ASK_BBOX_INDEX:
+            # selected bbox ids may be changed by operation
+            self._change_state(cfg.CanvasState.NORMAL)
+            self._clear_keyboard_key_to_bbox_id_mapper()
+            self._apply_operation(operation)
+            self.refresh()
+        else:
+            self._apply_operation(operation)
+            self.refresh_region([operation.bbox])
+
+    def _own_bboxes(self):
+        """Copies shared list of bboxes before changing it, bboxes themselves are immutable and stay shared"""
+        if self._bboxes_shared:
+            self._bboxes = list(self._bboxes)
+            self._bboxes_shared = False
 
     def _clear_keyboard_key_to_bbox_id_mapper(self):
         self._keyboard_key_to_bbox_id_mapper = dict()
 
     def _get_selected_bbox_id(self, point: Point) -> Union[int, None]:
-        selected_id = list()
-        for i, bbox in enumerate(self._bboxes):
-            if point in bbox:
-                selected_id.append(i)
+        selected_id = self._bbox_index.get_ids_containing(point)
 
         # if clicked on more than one bbox simultaneously
         if len(selected_id) > 1:
@@ -350,18 +979,117 @@ class Canvas:
     def _change_state(self, state: cfg.CanvasState):
         self._state = state
 
+    def _to_image_coords(self, x: int, y: int) -> Tuple[int, int]:
+        return (int(self._view_origin[0] + x * self._view_ratio[0]),
+                int(self._view_origin[1] + y * self._view_ratio[1]))
+
+    def _to_display_coords(self, x: int, y: int) -> Tuple[int, int]:
+        return (math.floor((x - self._view_origin[0]) / self._view_ratio[0]),
+                math.floor((y - self._view_origin[1]) / self._view_ratio[1]))
+
+    def _zoom_at(self, x: int, y: int, factor: float):
+        """Zooms view keeping image point under view point (x, y) in place"""
+        zoom = min(max(self._zoom * factor, 1.0), cfg.MAX_ZOOM)
+        if zoom == self._zoom:
+            return
+        image_x, image_y = self._to_image_coords(x, y)
+        view_height, view_width = self._view_image.shape[:2]
+        # image pixels per view pixel after zoom
+        ratio = self._image_size[0] / zoom / view_width
+        self._view_center = (image_x + (view_width / 2 - x) * ratio, image_y + (view_height / 2 - y) * ratio)
+        self._zoom = zoom
+        self._view_image = None
+        self.refresh()
+
+    def _update_view(self):
+        """Crops visible part of frame and scales it to view, so redraw cost depends on window size only"""
+        image_width, image_height = self._image_size
+        fit = min(cfg.VIEWPORT_MAX_WIDTH / image_width, cfg.VIEWPORT_MAX_HEIGHT / image_height, 1.0)
+        view_width, view_height = max(1, round(image_width * fit)), max(1, round(image_height * fit))
+
+        visible_width, visible_height = image_width / self._zoom, image_height / self._zoom
+        # decoded frame is enough for the whole frame view, even if it is smaller than the window
+        if self._full_resolution_loader is not None and self._zoom > 1 and visible_width / view_width < self._scale:
+            full_resolution_image = self._full_resolution_loader()
+            self._full_resolution_loader = None
+            if full_resolution_image is not None:
+                self._clear_image = full_resolution_image
+                self._scale = 1
+
+        left = min(max(self._view_center[0] - visible_width / 2, 0), image_width - visible_width)
+        top = min(max(self._view_center[1] - visible_height / 2, 0), image_height - visible_height)
+        self._view_center = (left + visible_width / 2, top + visible_height / 2)
+
+        # crop then scale, only visible part of frame is resized
+        height, width = self._clear_image.shape[:2]
+        x1, y1 = min(int(left / self._scale), width - 1), min(int(top / self._scale), height - 1)
+        x2 = min(max(math.ceil((left + visible_width) / self._scale), x1 + 1), width)
+        y2 = min(max(math.ceil((top + visible_height) / self._scale), y1 + 1), height)
+        crop = self._clear_image[y1:y2, x1:x2]
+        interpolation = cv2.INTER_AREA if crop.shape[1] > view_width else cv2.INTER_NEAREST
+        self._view_image = cv2.resize(crop, (view_width, view_height), interpolation=interpolation)
+        self._view_origin = (x1 * self._scale, y1 * self._scale)
+        self._view_ratio = ((x2 - x1) * self._scale / view_width, (y2 - y1) * self._scale / view_height)
+
+    def _get_display_rect(self, bbox: BBox) -> Tuple[int, int, int, int]:
+        """Region of displayed image covered by bbox rectangle including line thickness"""
+        height, width = self._view_image.shape[:2]
+        margin = cfg.DEFAULT_BBOX_LINE_THICKNESS // 2 + 1
+        x1, y1 = self._to_display_coords(min(bbox.x1, bbox.x2), min(bbox.y1, bbox.y2))
+        x2, y2 = self._to_display_coords(max(bbox.x1, bbox.x2), max(bbox.y1, bbox.y2))
+        return (
+            min(max(x1 - margin, 0), width),
+            min(max(y1 - margin, 0), height),
+            min(max(x2 + margin + 1, 0), width),
+            min(max(y2 + margin + 1, 0), height),
+        )
+
+    def _draw_bbox_rectangle(self, image: np.ndarray, bbox: BBox, offset: Tuple[int, int] = (0, 0)):
+        """Draws bbox on image, which is region of displayed image starting at offset"""
+        x1, y1 = self._to_display_coords(bbox.x1, bbox.y1)
+        x2, y2 = self._to_display_coords(bbox.x2, bbox.y2)
+        cv2.rectangle(
+            image,
+            (x1 - offset[0], y1 - offset[1]),
+            (x2 - offset[0], y2 - offset[1]),
+            cfg.CLASS_COLORS[bbox.label],
+            cfg.DEFAULT_BBOX_LINE_THICKNESS,
+        )
+
+    def _draw_change(self, image: np.ndarray, bbox: BBox, change_type: str, offset: Tuple[int, int] = (0, 0)):
+        """Draws thin rectangle of changed bbox with change type above it"""
+        x1, y1 = self._to_display_coords(min(bbox.x1, bbox.x2), min(bbox.y1, bbox.y2))
+        x2, y2 = self._to_display_coords(max(bbox.x1, bbox.x2), max(bbox.y1, bbox.y2))
+        color = cfg.CHANGE_COLORS[change_type]
+        cv2.rectangle(image, (x1 - offset[0], y1 - offset[1]), (x2 - offset[0], y2 - offset[1]), color,
+                      cfg.DIFF_LINE_THICKNESS)
+        # text is lifted above line of corrected bbox drawn at the same place
+        text_y = y1 - offset[1] - cfg.DEFAULT_BBOX_LINE_THICKNESS - 2
+        cv2.putText(image, change_type, (x1 - offset[0], text_y), cv2.FONT_HERSHEY_SIMPLEX,
+                    self._current_image.shape[0] * cfg.TEXTSIZE_IM_WIDTH_RATIO / 2, color, 1, cv2.LINE_AA)
+
     def _render_bboxes(self, bboxes: List[BBox]):
-        self._current_image = self._clear_image.copy()
+        if self._view_image is None:
+            self._update_view()
+        # reuse composited buffer of previous frame instead of allocating a new one
+        if (self._current_image is not None
+                and self._current_image.shape == self._view_image.shape
+                and self._current_image.dtype == self._view_image.dtype):
+            np.copyto(self._current_image, self._view_image)
+        else:
+            self._current_image = self._view_image.copy()
 
-        # draw bboxes
-        for i, bbox in enumerate(bboxes):
-            cv2.rectangle(
-                self._current_image,
-                (bbox.x1, bbox.y1),
-                (bbox.x2, bbox.y2),
-                cfg.CLASS_COLORS[bbox.label],
-                cfg.DEFAULT_BBOX_LINE_THICKNESS,
-            )
+        # draw changes under bboxes, so corrected bboxes stay visible
+        for bbox, change_type in self._changes:
+            x1, y1, x2, y2 = self._get_display_rect(bbox)
+            if x1 < x2 and y1 < y2:
+                self._draw_change(self._current_image, bbox, change_type)
+
+        # draw bboxes, which are visible in view
+        for bbox in bboxes:
+            x1, y1, x2, y2 = self._get_display_rect(bbox)
+            if x1 < x2 and y1 < y2:
+                self._draw_bbox_rectangle(self._current_image, bbox)
 
         # draw keyboard numbers to select one of the simultaneously selected bboxes
         for keyboard_number, bbox_id in self._keyboard_key_to_bbox_id_mapper.items():
@@ -369,7 +1097,7 @@ class Canvas:
             self._current_image = cv2.putText(
                 self._current_image,
                 str(keyboard_number),
-                (bbox.x1, bbox.y1),
+                self._to_display_coords(bbox.x1, bbox.y1),
                 cv2.FONT_HERSHEY_SIMPLEX,
                 self._current_image.shape[0] * cfg.TEXTSIZE_IM_WIDTH_RATIO,
                 cfg.TEXT_COLOR,
@@ -379,4 +1107,5 @@ class Canvas:
                 cv2.LINE_AA,
             )
 
-        cv2.imshow(cfg.WINDOW_NAME, self._current_image)
+        with self._tracer.span("imshow"):
+            self._window.show(self._current_image)
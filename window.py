@@ -0,0 +1,93 @@
+import time
+from collections import deque
+from typing import Callable, Iterable, List, Tuple, Union
+
+import cv2
+import numpy as np
+
+import config as cfg
+
+
+class OpenCVWindow:
+    """Window shown with opencv highgui"""
+
+    def __init__(self, name: str = cfg.WINDOW_NAME):
+        self._name: str = name
+        self._mouse_callback: Union[Callable, None] = None
+        cv2.namedWindow(self._name, cv2.WINDOW_NORMAL | cv2.WINDOW_GUI_NORMAL)
+        cv2.resizeWindow(self._name, 900, 600)
+
+    def set_mouse_callback(self, callback: Callable):
+        self._mouse_callback = callback
+        cv2.setMouseCallback(self._name, callback)
+
+    def show(self, image: np.ndarray):
+        cv2.imshow(self._name, image)
+
+    def wait_key(self, timeout_ms: int = cfg.KEY_POLL_MS) -> int:
+        """Returns pressed key or NO_KEY if no key is pressed in timeout_ms"""
+        return cv2.waitKey(timeout_ms)
+
+    def select_roi(self, image: np.ndarray) -> Tuple[int, int, int, int]:
+        region = cv2.selectROI(self._name, image)
+        # selectROI replaces mouse callback of the window
+        cv2.setMouseCallback(self._name, self._mouse_callback)
+        return region
+
+    def close(self):
+        cv2.destroyAllWindows()
+
+
+class HeadlessWindow:
+    """Replays scripted events without display, used to drive canvas and labeling tool in benchmarks
+
+    Events are ("key", key code), ("mouse", cv2 mouse event, x, y) and ("roi", (x, y, width, height)).
+    Mouse events are passed to the callback, keys are returned from wait_key and regions from select_roi.
+    Once events are over wait_key returns quit hotkey. Time spent between returning a key and the next
+    wait_key call is recorded as latency of the key.
+    """
+
+    def __init__(self, events: Iterable[tuple] = ()):
+        self._events: deque = deque(events)
+        self._mouse_callback: Union[Callable, None] = None
+        self._last_key: Union[int, None] = None
+        self._last_key_time: float = 0.0
+        # (key, seconds spent handling it)
+        self.key_latencies: List[Tuple[int, float]] = list()
+        self.shown_frames: int = 0
+        self.last_image: Union[np.ndarray, None] = None
+
+    def add_events(self, events: Iterable[tuple]):
+        self._events.extend(events)
+
+    def set_mouse_callback(self, callback: Callable):
+        self._mouse_callback = callback
+
+    def show(self, image: np.ndarray):
+        self.shown_frames += 1
+        self.last_image = image
+
+    def wait_key(self, timeout_ms: int = cfg.KEY_POLL_MS) -> int:
+        if self._last_key is not None:
+            self.key_latencies.append((self._last_key, time.perf_counter() - self._last_key_time))
+
+        while self._events and self._events[0][0] == "mouse":
+            _, event, x, y = self._events.popleft()
+            self._mouse_callback(event, x, y, 0, None)
+
+        if self._events and self._events[0][0] == "key":
+            key = self._events.popleft()[1]
+        else:
+            key = cfg.HotKey.Quit
+        self._last_key = key
+        self._last_key_time = time.perf_counter()
+        return key
+
+    def select_roi(self, image: np.ndarray) -> Tuple[int, int, int, int]:
+        if self._events and self._events[0][0] == "roi":
+            return self._events.popleft()[1]
+        # the same as selection cancelled in opencv window
+        return 0, 0, 0, 0
+
+    def close(self):
+        pass